@@ -0,0 +1,216 @@
+"""
+API JSON v1 para clientes móviles y el frontend.
+
+Devuelve registros recortados y tipados (no los objetos completos de Jikan y
+OpenLibrary). Todas las respuestas llevan ETag y, cuando se conoce, la fecha
+de la última modificación, de modo que las peticiones repetidas se contestan
+con 304 sin cuerpo. En las búsquedas el ETag sale de la consulta ya resuelta
+en el catálogo y del conjunto de favoritos, así que el 304 se decide antes de
+buscar. Lo que depende de los favoritos toma como fecha la del último cambio
+(`favoritos.modificados()`), que también avanza con las bajas.
+"""
+import hashlib
+import json
+
+import requests
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET
+
+from . import catalogo, favoritos, items, listados, snapshots
+from .items import AUTOR_DESCONOCIDO
+from .models import Favorito, ImportacionFavoritos
+from .sesion import usuario_requerido_api
+
+# Nombres de tipo en la API -> tipo_contenido
+TIPOS = {'anime': 'anime', 'books': 'libro'}
+
+
+def anime_api(anime):
+    """`AnimeItem` -> anime de la API."""
+    return {
+        'id': anime.mal_id,
+        'title': anime.title,
+        'url': anime.url,
+        'image': anime.image_url,
+        'type': anime.type,
+        'episodes': anime.episodes,
+        'score': anime.score,
+        'genres': anime.genres,
+    }
+
+
+def libro_api(libro):
+    """`BookItem` -> libro de la API."""
+    return {
+        'id': libro.work_id,
+        'title': libro.title,
+        'authors': [] if libro.author_name == AUTOR_DESCONOCIDO else libro.author_name.split(', '),
+        'year': libro.first_publish_year,
+        'cover': libro.cover_url,
+    }
+
+
+def _serializar(tipo_contenido, datos):
+    item = items.desde_dict(tipo_contenido, datos)
+    return anime_api(item) if tipo_contenido == 'anime' else libro_api(item)
+
+
+def _no_modificado(request, etag, modificado=None):
+    """Respuesta 304 si el cliente ya tiene la versión `etag`/`modificado`; si no, None."""
+    marca = int(modificado.timestamp()) if modificado is not None else None
+    response = get_conditional_response(request, etag=etag, last_modified=marca)
+    return None if response is None else _cabeceras(response, etag, marca)
+
+
+def _json(request, datos, modificado=None, status=200, etag=None):
+    """
+    JsonResponse compacta con ETag (hash del cuerpo, salvo que se dé `etag`) y
+    Last-Modified; si el cliente ya tiene esa versión se contesta 304.
+    """
+    cuerpo = json.dumps(datos, ensure_ascii=False, separators=(',', ':'))
+    etag = etag or quote_etag(hashlib.sha1(cuerpo.encode('utf-8')).hexdigest())
+    response = _no_modificado(request, etag, modificado)
+    if response is None:
+        marca = int(modificado.timestamp()) if modificado is not None else None
+        response = _cabeceras(HttpResponse(cuerpo, content_type='application/json', status=status), etag, marca)
+    return response
+
+
+def _cabeceras(response, etag, marca):
+    response['ETag'] = etag
+    if marca is not None:
+        response['Last-Modified'] = http_date(marca)
+    # Datos por usuario: solo en la caché del cliente y siempre revalidados
+    patch_cache_control(response, private=True, no_cache=True)
+    response['Vary'] = 'Cookie'
+    return response
+
+
+def _error(mensaje, status):
+    return JsonResponse({'error': mensaje}, status=status)
+
+
+async def _buscar(request, tipo_contenido):
+    # require_GET no admite vistas asíncronas en Django 4.2
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    consulta = request.GET.get('q', '').strip()
+    if not consulta:
+        return _error("Falta el parámetro 'q'", 400)
+    ids = await sync_to_async(favoritos.ids_favoritos)(request.usuario.id, tipo_contenido)
+    cambio = await sync_to_async(favoritos.modificados)(request.usuario.id)
+    registro = await sync_to_async(catalogo.consulta_fresca)(tipo_contenido, consulta[:100])
+    if registro is not None:
+        # Mientras la consulta siga fresca el resultado solo cambia con los favoritos: 304 sin buscar
+        response = await sync_to_async(_no_modificado)(
+            request, _etag_busqueda(consulta, registro, ids), max(registro.actualizado, cambio))
+        if response is not None:
+            return response
+    try:
+        resultados = await catalogo.abuscar_con_api(tipo_contenido, consulta[:100])
+    except requests.exceptions.RequestException:
+        return _error('La API externa no está disponible', 502)
+    except ValueError:
+        return _error('Respuesta no válida de la API externa', 502)
+    items = []
+    for datos in resultados:
+        item = _serializar(tipo_contenido, datos)
+        item['favorite'] = str(item['id']) in ids
+        items.append(item)
+    datos = {'query': consulta, 'results': items}
+    if registro is None:
+        registro = await sync_to_async(catalogo.consulta_fresca)(tipo_contenido, consulta[:100])
+    if registro is None:
+        return await sync_to_async(_json)(request, datos)
+    return await sync_to_async(_json)(request, datos, modificado=max(registro.actualizado, cambio),
+                                      etag=_etag_busqueda(consulta, registro, ids))
+
+
+def _etag_busqueda(consulta, registro, ids):
+    """ETag de una búsqueda: la consulta, cuándo se resolvió y los favoritos del usuario."""
+    clave = '\n'.join([consulta, registro.tipo_contenido, registro.actualizado.isoformat(), *sorted(ids)])
+    return quote_etag(hashlib.sha1(clave.encode('utf-8')).hexdigest())
+
+
+@usuario_requerido_api
+async def buscar_anime(request):
+    return await _buscar(request, 'anime')
+
+
+@usuario_requerido_api
+async def buscar_libros(request):
+    return await _buscar(request, 'libro')
+
+
+@require_GET
+@usuario_requerido_api
+def recomendaciones(request, tipo):
+    """Lee el snapshot del usuario igual que las páginas HTML; `stale` indica que se está recalculando."""
+    if tipo not in TIPOS:
+        return _error("Tipo desconocido: usa 'anime' o 'books'", 404)
+    tipo_contenido = TIPOS[tipo]
+    snapshot = snapshots.obtener(request.usuario.id, tipo_contenido)
+    if snapshot is None:
+        snapshots.refrescar(request.usuario.id, tipo_contenido)
+        snapshot = snapshots.obtener(request.usuario.id, tipo_contenido)
+    obsoleto = snapshots.obsoleto(snapshot)
+    if obsoleto:
+        snapshots.encolar(request.usuario.id, tipo_contenido)
+    contenido = snapshot.contenido
+    return _json(request, {
+        'results': [_serializar(tipo_contenido, datos) for datos in contenido['recomendaciones']],
+        'because_you_liked': [
+            {'title': titulo, 'results': [_serializar(tipo_contenido, datos) for datos in items]}
+            for titulo, items in contenido['cruzadas']
+        ],
+        'error': contenido['error_api'],
+        'stale': obsoleto,
+        'generated': snapshot.generado.isoformat(),
+    }, modificado=snapshot.generado)
+
+
+@require_GET
+@usuario_requerido_api
+def lista_favoritos(request):
+    """Favoritos del usuario, más recientes primero, paginados por cursor (`next`)."""
+    consulta = Favorito.objects.filter(usuario=request.usuario)
+    tipo = request.GET.get('type')
+    if tipo:
+        if tipo not in TIPOS:
+            return _error("'type' debe ser 'anime' o 'books'", 400)
+        consulta = consulta.filter(tipo_contenido=TIPOS[tipo])
+    filas, siguiente = listados.paginar(
+        consulta.only('contenido_id', 'contenido_titulo', 'tipo_contenido', 'autor', 'fecha_agregado'),
+        ['-fecha_agregado', '-id'], request.GET.get('cursor'))
+    modificado = favoritos.modificados(request.usuario.id)
+    return _json(request, {
+        'results': [{
+            'id': fila.contenido_id,
+            'type': 'anime' if fila.tipo_contenido == 'anime' else 'books',
+            'title': fila.contenido_titulo,
+            'author': fila.autor,
+            'added': fila.fecha_agregado.isoformat(),
+        } for fila in filas],
+        'next': siguiente,
+    }, modificado=modificado)
+
+
+@require_GET
+@usuario_requerido_api
+def estado_importacion(request, importacion_id):
+    """Estado de una importación de favoritos subida desde la web: `pending`, `running`, `done` o `error`."""
+    fila = ImportacionFavoritos.objects.filter(pk=importacion_id, usuario=request.usuario).first()
+    if fila is None:
+        return _error('Importación no encontrada', 404)
+    estados = {'pendiente': 'pending', 'en_curso': 'running', 'terminada': 'done', 'error': 'error'}
+    return _json(request, {
+        'status': estados[fila.estado],
+        'read': fila.resumen.get('leidas', 0),
+        'imported': fila.resumen.get('importadas', 0),
+        'duplicates': fila.resumen.get('repetidas', 0),
+        'unresolved': fila.resumen.get('sin_resolver', 0),
+        'error': fila.error or None,
+    }, modificado=fila.actualizada)
@@ -0,0 +1,249 @@
+"""
+Catálogo local de animes y libros con índice invertido sobre títulos, autores y géneros.
+
+Las búsquedas se resuelven primero contra el catálogo; solo se consulta la API
+externa cuando la consulta no se ha visto antes o su registro ha caducado, y
+los resultados recibidos se incorporan al catálogo.
+"""
+import logging
+import re
+import unicodedata
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .http_cache import cache_respuestas
+from .items import CAMPOS_OPENLIBRARY, AnimeItem, BookItem
+from .models import ConsultaCatalogo, Favorito, ItemCatalogo, ObrasAutor, TerminoCatalogo
+
+logger = logging.getLogger(__name__)
+
+# Peso de cada campo en el ranking de resultados
+PESO_TITULO = 3
+PESO_AUTOR = 2
+PESO_GENERO = 1
+
+_SEPARADOR = re.compile(r'[\W_]+')
+
+# Búsqueda en la API de cada tipo: (endpoint de la caché, ajuste con la URL base, ruta,
+# parámetros fijos, lista de resultados en el JSON)
+BUSQUEDAS_REMOTAS = {
+    # Using sfw filter to ensure content is generally safe for work
+    'anime': ('jikan_busqueda', 'JIKAN_API_URL', '/anime', {'sfw': 'true'}, 'data'),
+    'libro': ('openlibrary_busqueda', 'OPENLIBRARY_URL', '/search.json', {'limit': 20, 'fields': CAMPOS_OPENLIBRARY}, 'docs'),
+}
+
+
+def _sin_acentos(texto):
+    """Quita las tildes de las letras latinas; el resto de escrituras (kana, cirílico...) se conservan."""
+    caracteres, base_latina = [], False
+    for c in unicodedata.normalize('NFKD', texto):
+        if not unicodedata.combining(c):
+            base_latina = c.isascii()
+        elif base_latina:
+            continue
+        caracteres.append(c)
+    return unicodedata.normalize('NFC', ''.join(caracteres))
+
+
+def tokenizar(texto):
+    """Términos en minúsculas y sin tildes, en cualquier escritura; se descartan las letras y cifras ASCII sueltas."""
+    texto = _sin_acentos(texto or '').casefold()
+    return [t for t in _SEPARADOR.split(texto) if len(t) > 1 or (t and not t.isascii())]
+
+
+def normalizar_consulta(consulta):
+    """Clave de `ConsultaCatalogo`: la consulta tal cual, en minúsculas y con los espacios colapsados."""
+    return ' '.join((consulta or '').casefold().split())[:100]
+
+
+def normalizar_anime(anime_data):
+    """Registro compacto (`AnimeItem.como_dict()`) de un anime de Jikan."""
+    return AnimeItem.desde_jikan(anime_data).como_dict()
+
+
+def normalizar_libro(libro_data):
+    """Registro compacto (`BookItem.como_dict()`) de un libro de OpenLibrary."""
+    return BookItem.desde_openlibrary(libro_data).como_dict()
+
+
+def _campos_indexables(tipo_contenido, datos):
+    """(contenido_id, titulo, autores, generos) de un registro normalizado."""
+    if tipo_contenido == 'anime':
+        return str(datos['mal_id']), datos['title'] or '', '', ', '.join(datos['genres'])
+    return datos['work_id'], datos['title'] or '', datos['author_name'], ', '.join(datos['subject'])
+
+
+def guardar(tipo_contenido, registros):
+    """Inserta o actualiza registros normalizados y reconstruye sus entradas del índice."""
+    ahora = timezone.now()
+    items = {}
+    for datos in registros:
+        contenido_id, titulo, autores, generos = _campos_indexables(tipo_contenido, datos)
+        items[contenido_id] = ItemCatalogo(
+            tipo_contenido=tipo_contenido, contenido_id=contenido_id, titulo=titulo[:255],
+            autores=autores[:500], generos=generos[:500], datos=datos, actualizado=ahora,
+        )
+    if not items:
+        return
+    with transaction.atomic():
+        ItemCatalogo.objects.bulk_create(
+            items.values(),
+            update_conflicts=True,
+            unique_fields=['tipo_contenido', 'contenido_id'],
+            update_fields=['titulo', 'autores', 'generos', 'datos', 'actualizado'],
+        )
+        guardados = ItemCatalogo.objects.filter(tipo_contenido=tipo_contenido, contenido_id__in=items)
+        TerminoCatalogo.objects.filter(item__in=guardados).delete()
+        terminos = []
+        for item in guardados:
+            pesos = {}
+            for texto, peso in ((item.generos, PESO_GENERO), (item.autores, PESO_AUTOR), (item.titulo, PESO_TITULO)):
+                for termino in tokenizar(texto):
+                    pesos[termino[:100]] = max(pesos.get(termino[:100], 0), peso)
+            terminos.extend(TerminoCatalogo(termino=t, item=item, peso=p) for t, p in pesos.items())
+        TerminoCatalogo.objects.bulk_create(terminos)
+
+
+def buscar_local(tipo_contenido, consulta, limite=20, primero=()):
+    """
+    Items que contienen todos los términos de la consulta, ordenados por
+    relevancia. Los `contenido_id` de `primero` (p. ej. el orden que devolvió
+    la API para esta consulta) van delante.
+    """
+    terminos = set(tokenizar(consulta))
+    orden = []
+    if terminos:
+        ranking = (
+            TerminoCatalogo.objects
+            .filter(item__tipo_contenido=tipo_contenido, termino__in=terminos)
+            .values('item_id')
+            .annotate(coincidencias=Count('termino'), relevancia=Sum('peso'))
+            .filter(coincidencias=len(terminos))
+            .order_by('-relevancia', 'item_id')[:limite]
+        )
+        orden = [fila['item_id'] for fila in ranking]
+    filas = list(ItemCatalogo.objects.filter(tipo_contenido=tipo_contenido).filter(
+        Q(pk__in=orden) | Q(contenido_id__in=list(primero))
+    ).values_list('pk', 'contenido_id', 'datos'))
+    por_pk = {pk: datos for pk, _, datos in filas}
+    por_id = {contenido_id: pk for pk, contenido_id, _ in filas}
+    pks = list(dict.fromkeys([por_id[c] for c in primero if c in por_id] + orden))
+    return [por_pk[pk] for pk in pks[:limite]]
+
+
+def consulta_fresca(tipo_contenido, consulta):
+    """`ConsultaCatalogo` de la consulta si se resolvió hace menos de CATALOGO_TTL; si no, None."""
+    frescura = timezone.now() - timedelta(seconds=settings.CATALOGO_TTL)
+    return ConsultaCatalogo.objects.filter(
+        tipo_contenido=tipo_contenido, consulta=normalizar_consulta(consulta), actualizado__gte=frescura).first()
+
+
+def _buscar_si_fresca(tipo_contenido, consulta, limite):
+    """Resultados del catálogo si la consulta se resolvió hace menos de CATALOGO_TTL; si no, None."""
+    registro = consulta_fresca(tipo_contenido, consulta)
+    if registro is None:
+        return None
+    return buscar_local(tipo_contenido, consulta, limite, primero=registro.resultados)
+
+
+def buscar(tipo_contenido, consulta, buscar_remoto, limite=20):
+    """
+    Resuelve `consulta` desde el catálogo si ya se consultó a la API hace
+    menos de CATALOGO_TTL; si no, llama a `buscar_remoto()` (que devuelve la
+    lista de registros crudos de la API), los incorpora al catálogo y
+    devuelve sus versiones normalizadas.
+    """
+    resultados = _buscar_si_fresca(tipo_contenido, consulta, limite)
+    if resultados is not None:
+        return resultados
+    return _incorporar(tipo_contenido, consulta, buscar_remoto(), limite)
+
+
+async def abuscar(tipo_contenido, consulta, buscar_remoto, limite=20):
+    """Como `buscar()`, con `buscar_remoto` asíncrono."""
+    resultados = await sync_to_async(_buscar_si_fresca)(tipo_contenido, consulta, limite)
+    if resultados is not None:
+        return resultados
+    return await sync_to_async(_incorporar)(tipo_contenido, consulta, await buscar_remoto(), limite)
+
+
+async def abuscar_con_api(tipo_contenido, consulta, limite=20):
+    """`abuscar()` con la API del tipo (Jikan u OpenLibrary) como búsqueda remota."""
+    endpoint, base, ruta, params, lista = BUSQUEDAS_REMOTAS[tipo_contenido]
+    url = getattr(settings, base) + ruta
+
+    async def buscar_remoto():
+        data = await cache_respuestas.aobtener(endpoint, url, {'q': consulta, **params})
+        return data.get(lista, [])
+
+    return await abuscar(tipo_contenido, consulta, buscar_remoto, limite)
+
+
+def _incorporar(tipo_contenido, consulta, datos_api, limite):
+    """Normaliza los registros crudos de la API, los guarda y anota la consulta como resuelta."""
+    normalizar = normalizar_anime if tipo_contenido == 'anime' else normalizar_libro
+    registros = []
+    for data in datos_api:
+        datos = normalizar(data)
+        if (tipo_contenido == 'anime' and isinstance(datos['mal_id'], int)) or (
+                tipo_contenido == 'libro' and datos['work_id']):
+            registros.append(datos)
+    guardar(tipo_contenido, registros)
+    ConsultaCatalogo.objects.update_or_create(
+        tipo_contenido=tipo_contenido, consulta=normalizar_consulta(consulta), defaults={
+            'resultados': [_campos_indexables(tipo_contenido, datos)[0] for datos in registros],
+            'actualizado': timezone.now(),
+        })
+    return registros[:limite]
+
+
+def registros(tipo_contenido, contenido_ids):
+    """
+    {contenido_id: registro normalizado} para mostrar items de los que solo
+    tenemos el id. Si no están en el catálogo se arma un registro mínimo con
+    el título guardado en Favorito.
+    """
+    contenido_ids = [str(c) for c in contenido_ids]
+    encontrados = dict(ItemCatalogo.objects.filter(
+        tipo_contenido=tipo_contenido, contenido_id__in=contenido_ids).values_list('contenido_id', 'datos'))
+    faltan = [c for c in contenido_ids if c not in encontrados]
+    if faltan:
+        favoritos = Favorito.objects.filter(
+            tipo_contenido=tipo_contenido, contenido_id__in=faltan).values_list('contenido_id', 'contenido_titulo', 'autor')
+        for contenido_id, titulo, autor in favoritos:
+            if contenido_id in encontrados:
+                continue
+            if tipo_contenido == 'anime':
+                if not contenido_id.isdigit():  # Filas antiguas: hoy toggle_favorito y la importación lo rechazan
+                    logger.warning("Favorito de anime con id no numérico: %r", contenido_id)
+                    continue
+                encontrados[contenido_id] = normalizar_anime({
+                    'mal_id': int(contenido_id), 'title': titulo,
+                    'url': f"https://myanimelist.net/anime/{contenido_id}",
+                })
+            else:
+                encontrados[contenido_id] = normalizar_libro({
+                    'key': f"/works/{contenido_id}", 'title': titulo,
+                    'author_name': [autor or 'Autor desconocido'],
+                })
+    return encontrados
+
+
+def obras_de_autores(autor_keys):
+    """{autor_key: [work_id, ...]} de los autores indexados hace menos de CATALOGO_TTL."""
+    frescura = timezone.now() - timedelta(seconds=settings.CATALOGO_TTL)
+    return dict(ObrasAutor.objects.filter(autor_key__in=autor_keys, actualizado__gte=frescura)
+                .values_list('autor_key', 'obras'))
+
+
+def indexar_obras(autor_key, registros):
+    """Guarda en el catálogo los libros de un autor (registros normalizados) y su entrada del índice."""
+    guardar('libro', registros)
+    ObrasAutor.objects.update_or_create(autor_key=autor_key, defaults={
+        'obras': [datos['work_id'] for datos in registros], 'actualizado': timezone.now(),
+    })
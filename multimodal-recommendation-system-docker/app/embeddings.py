@@ -0,0 +1,193 @@
+"""
+Índice vectorial común para animes y libros del catálogo local.
+
+Cada item se representa con un vector TF-IDF de n-gramas de palabras
+proyectados con feature hashing (títulos, sinopsis, géneros, temas y autores),
+normalizado a norma 1 y guardado como matriz float32 en disco. La matriz se
+abre con memmap y la búsqueda de vecinos es un producto escalar vectorizado
+con NumPy, por lo que "porque te gustó el anime X" puede devolver libros (y al
+revés) sin salir a la red.
+"""
+import glob
+import json
+import os
+import threading
+import time
+import zlib
+
+import numpy as np
+from django.conf import settings
+
+from .catalogo import tokenizar
+from .models import ItemCatalogo
+
+ARCHIVO_META = 'vectores.json'
+
+# Peso de cada campo al construir el vector
+PESO_TITULO = 2.0
+PESO_GENERO = 1.5
+PESO_AUTOR = 1.0
+PESO_TEXTO = 0.5
+
+
+def _rasgos(datos):
+    """{rasgo: peso} de un registro normalizado del catálogo (anime o libro)."""
+    primera_frase = datos.get('first_sentence') or ''
+    if isinstance(primera_frase, list):  # Registros guardados como lista de frases
+        primera_frase = ' '.join(primera_frase)
+    campos = [
+        (datos.get('title'), PESO_TITULO),
+        (' '.join(datos.get('genres', []) + datos.get('subject', [])), PESO_GENERO),
+        (datos.get('author_name') if datos.get('author_name') != 'Autor desconocido' else '', PESO_AUTOR),
+        (datos.get('synopsis') or primera_frase, PESO_TEXTO),
+    ]
+    rasgos = {}
+    for texto, peso in campos:
+        terminos = tokenizar(texto)
+        for n_grama in terminos + [f'{a} {b}' for a, b in zip(terminos, terminos[1:])]:
+            rasgos[n_grama] = rasgos.get(n_grama, 0.0) + peso
+    return rasgos
+
+
+def _vector_crudo(datos, dimensiones):
+    """Vector de frecuencias con hashing con signo (sin IDF ni normalizar)."""
+    vector = np.zeros(dimensiones, dtype=np.float32)
+    for rasgo, peso in _rasgos(datos).items():
+        h = zlib.crc32(rasgo.encode('utf-8'))
+        signo = 1.0 if h & 0x80000000 else -1.0
+        vector[h % dimensiones] += signo * np.log1p(peso)
+    return vector
+
+
+def _normalizar(matriz):
+    normas = np.linalg.norm(matriz, axis=-1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return matriz / normas
+
+
+def construir(directorio=None, dimensiones=None):
+    """
+    Vectoriza todo el catálogo y guarda matriz y metadatos en `directorio`.
+    Las filas se ordenan por tipo para que cada tipo sea un bloque contiguo.
+    Devuelve el número de items indexados.
+    """
+    directorio = directorio or settings.EMBEDDINGS_DIR
+    dimensiones = dimensiones or settings.EMBEDDINGS_DIMENSIONES
+    os.makedirs(directorio, exist_ok=True)
+
+    items = list(ItemCatalogo.objects.order_by('tipo_contenido', 'id').values_list('tipo_contenido', 'contenido_id', 'datos'))
+    matriz = np.zeros((len(items), dimensiones), dtype=np.float32)
+    for fila, (_, _, datos) in enumerate(items):
+        matriz[fila] = _vector_crudo(datos, dimensiones)
+    # IDF por componente: los rasgos comunes pesan menos
+    df = np.count_nonzero(matriz, axis=0)
+    idf = (np.log((len(items) + 1) / (df + 1)) + 1).astype(np.float32)
+    matriz = _normalizar(matriz * idf)
+
+    bloques = {}
+    for fila, (tipo, _, _) in enumerate(items):
+        inicio, _ = bloques.get(tipo, (fila, fila))
+        bloques[tipo] = (inicio, fila + 1)
+
+    # Cada construcción escribe una matriz nueva y el cambio se publica al
+    # reemplazar (atómicamente) los metadatos que la nombran
+    nombre_matriz = f'vectores-{time.time_ns()}.npy'
+    np.save(os.path.join(directorio, nombre_matriz), matriz)
+    ruta_meta = os.path.join(directorio, ARCHIVO_META)
+    with open(ruta_meta + '.tmp', 'w') as archivo:
+        json.dump({
+            'matriz': nombre_matriz,
+            'dimensiones': dimensiones,
+            'ids': [[tipo, contenido_id] for tipo, contenido_id, _ in items],
+            'bloques': bloques,
+            'idf': idf.tolist(),
+        }, archivo)
+    os.replace(ruta_meta + '.tmp', ruta_meta)
+    # Los procesos con la matriz anterior abierta en memmap pueden seguir usándola
+    for ruta in glob.glob(os.path.join(directorio, 'vectores-*.npy')):
+        if os.path.basename(ruta) != nombre_matriz:
+            os.remove(ruta)
+    return len(items)
+
+
+class IndiceVectorial:
+    def __init__(self, directorio):
+        with open(os.path.join(directorio, ARCHIVO_META)) as archivo:
+            meta = json.load(archivo)
+        self.matriz = np.load(os.path.join(directorio, meta['matriz']), mmap_mode='r')
+        self.dimensiones = meta['dimensiones']
+        self.ids = [tuple(par) for par in meta['ids']]
+        self.filas = {par: fila for fila, par in enumerate(self.ids)}
+        self.bloques = {tipo: tuple(rango) for tipo, rango in meta['bloques'].items()}
+        self.idf = np.asarray(meta['idf'], dtype=np.float32)
+
+    def vector(self, tipo, contenido_id, datos=None):
+        """Vector del item; si no está indexado se calcula a partir de `datos`."""
+        fila = self.filas.get((tipo, str(contenido_id)))
+        if fila is not None:
+            return np.asarray(self.matriz[fila])
+        if datos is None:
+            return None
+        return _normalizar(_vector_crudo(datos, self.dimensiones) * self.idf)
+
+    def buscar(self, consulta, tipo_destino, k=10, excluir=()):
+        """Los `k` items de `tipo_destino` más parecidos a `consulta`: [(contenido_id, score)]."""
+        if tipo_destino not in self.bloques:
+            return []
+        inicio, fin = self.bloques[tipo_destino]
+        scores = np.asarray(self.matriz[inicio:fin] @ consulta)
+        excluir = set(excluir)
+        pedir = min(len(scores), k + len(excluir))
+        if pedir == 0:
+            return []
+        mejores = np.argpartition(-scores, pedir - 1)[:pedir]
+        mejores = mejores[np.argsort(-scores[mejores], kind='stable')]
+        resultado = []
+        for posicion in mejores:
+            contenido_id = self.ids[inicio + posicion][1]
+            if contenido_id not in excluir and scores[posicion] > 0:
+                resultado.append((contenido_id, float(scores[posicion])))
+            if len(resultado) == k:
+                break
+        return resultado
+
+
+_indice = None
+_mtime = None
+_lock = threading.Lock()
+
+
+def indice():
+    """Índice abierto en este proceso; se vuelve a abrir si el archivo cambió. None si no existe."""
+    global _indice, _mtime
+    try:
+        mtime = os.stat(os.path.join(settings.EMBEDDINGS_DIR, ARCHIVO_META)).st_mtime
+    except FileNotFoundError:
+        return None
+    with _lock:
+        if mtime != _mtime:
+            try:
+                _indice = IndiceVectorial(settings.EMBEDDINGS_DIR)
+                _mtime = mtime
+            except FileNotFoundError:
+                pass  # Se está publicando una construcción nueva; seguimos con la actual
+        return _indice
+
+
+def porque_te_gusto(favoritos, tipo_destino, por_favorito=4, excluir=()):
+    """
+    Para cada favorito (tipo, id, titulo), los items de `tipo_destino` más
+    parecidos. Devuelve [(titulo, [(contenido_id, score), ...]), ...].
+    """
+    actual = indice()
+    if actual is None:
+        return []
+    grupos = []
+    for tipo, contenido_id, titulo in favoritos:
+        consulta = actual.vector(tipo, contenido_id)
+        if consulta is None:
+            continue
+        similares = actual.buscar(consulta, tipo_destino, k=por_favorito, excluir=excluir)
+        if similares:
+            grupos.append((titulo, similares))
+    return grupos
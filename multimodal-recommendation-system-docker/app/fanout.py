@@ -0,0 +1,66 @@
+"""
+Peticiones concurrentes a APIs externas con límite de tasa y presupuesto de tiempo.
+"""
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+
+from .singleflight import EsperaAgotada, vuelos
+from .upstream import cliente
+
+
+class PresupuestoAgotado(Exception):
+    """No quedó tiempo en el presupuesto de la página para lanzar la petición."""
+
+
+def obtener_json_concurrente(urls, limiter, presupuesto, max_workers=4, timeout=10):
+    """
+    Descarga en paralelo los JSON de `urls` (dict clave -> url).
+
+    Cada petición espera un permiso de `limiter` antes de salir; las URLs que
+    ya está descargando otra petición del proceso no se repiten. Cuando se
+    agota `presupuesto` (segundos) se devuelve lo que haya llegado hasta ese
+    momento. Devuelve `(resultados, errores, pendientes)`: los dos primeros
+    son dicts clave -> JSON / excepción y `pendientes` es la lista de claves
+    que no terminaron a tiempo.
+    """
+    limite = time.monotonic() + presupuesto
+
+    def _descargar(url):
+        restante = limite - time.monotonic()
+        if restante <= 0 or not limiter.acquire(timeout=restante):
+            raise PresupuestoAgotado(url)
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            raise PresupuestoAgotado(url)
+        return cliente.get_json(url, timeout=min(timeout, restante))
+
+    def _obtener(url):
+        # Si otra página ya está pidiendo esta URL, esperamos su respuesta
+        try:
+            return vuelos.hacer(url, lambda: _descargar(url), timeout=max(0, limite - time.monotonic()))
+        except EsperaAgotada:
+            raise PresupuestoAgotado(url)
+
+    resultados, errores = {}, {}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        # Cada hilo con una copia del contexto, para que sus llamadas cuenten en la medición de la petición
+        futuros = {executor.submit(contextvars.copy_context().run, _obtener, url): clave for clave, url in urls.items()}
+        hechos, no_hechos = wait(futuros, timeout=presupuesto)
+        for futuro in hechos:
+            clave = futuros[futuro]
+            try:
+                resultados[clave] = futuro.result()
+            except PresupuestoAgotado:
+                no_hechos.add(futuro)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                errores[clave] = e
+    finally:
+        # No esperamos a los hilos rezagados: la página se sirve con resultados parciales
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    pendientes = [futuros[futuro] for futuro in no_hechos]
+    return resultados, errores, pendientes
@@ -0,0 +1,51 @@
+"""
+Conjunto de ids favoritos de cada usuario por tipo de contenido, en la caché compartida.
+
+Las búsquedas lo usan para marcar qué resultados ya son favoritos sin leer la
+tabla en cada petición; `toggle_favorito` lo invalida. Junto al conjunto se
+guarda cuándo cambiaron por última vez los favoritos del usuario (altas y
+bajas), que la API usa como Last-Modified.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Favorito
+
+CLAVE = 'favoritos:{usuario_id}:{tipo}'
+CLAVE_CAMBIO = 'favoritos:{usuario_id}:cambio'
+
+
+def ids_favoritos(usuario_id, tipo_contenido):
+    """frozenset con los `contenido_id` favoritos del usuario para `tipo_contenido`."""
+    clave = CLAVE.format(usuario_id=usuario_id, tipo=tipo_contenido)
+    ids = cache.get(clave)
+    if ids is None:
+        ids = frozenset(Favorito.objects.filter(
+            usuario_id=usuario_id, tipo_contenido=tipo_contenido).values_list('contenido_id', flat=True))
+        cache.set(clave, ids, settings.FAVORITOS_CACHE_TTL)
+    return ids
+
+
+def modificados(usuario_id):
+    """Última vez que cambiaron los favoritos del usuario; si la caché la perdió, cuenta como ahora."""
+    clave = CLAVE_CAMBIO.format(usuario_id=usuario_id)
+    marca = cache.get(clave)
+    if marca is None:
+        marca = timezone.now()
+        cache.add(clave, marca, None)
+    return marca
+
+
+def invalidar(usuario_id, tipo_contenido):
+    cache.delete(CLAVE.format(usuario_id=usuario_id, tipo=tipo_contenido))
+    # Last-Modified va en segundos: cada cambio avanza al menos uno para que un
+    # If-Modified-Since del mismo segundo no dé por buena la versión anterior
+    clave = CLAVE_CAMBIO.format(usuario_id=usuario_id)
+    anterior = cache.get(clave)
+    marca = timezone.now()
+    if anterior is not None:
+        marca = max(marca, anterior + timedelta(seconds=1))
+    cache.set(clave, marca, None)
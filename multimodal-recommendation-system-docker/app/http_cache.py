@@ -0,0 +1,307 @@
+"""
+Caché persistente de respuestas JSON de Jikan y OpenLibrary.
+
+Las entradas se guardan en la tabla `cache_respuestas` (sobreviven a reinicios)
+con un TTL por endpoint. Pasado el TTL, durante la ventana de
+stale-while-revalidate se sirve la copia vieja y se refresca en segundo plano.
+Delante de la base de datos hay un LRU pequeño en memoria para las claves más
+calientes.
+"""
+import hashlib
+import logging
+import threading
+from collections import Counter, OrderedDict
+from datetime import timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from . import metricas
+from .models import RespuestaCache
+from .ratelimit import para_host
+from .singleflight import abloqueo_entre_procesos, bloqueo_entre_procesos, vuelos
+from .upstream import acliente, cliente
+
+logger = logging.getLogger(__name__)
+
+# Parámetros cuyo valor no distingue mayúsculas en las APIs externas
+_PARAMS_TEXTO = {'q', 'author', 'title'}
+
+
+def normalizar_url(url, params=None):
+    """URL canónica: host en minúsculas, parámetros ordenados y texto de búsqueda normalizado."""
+    partes = urlsplit(url)
+    consulta = parse_qsl(partes.query, keep_blank_values=True)
+    if params:
+        consulta.extend((k, str(v)) for k, v in params.items())
+    normalizada = []
+    for clave, valor in consulta:
+        if clave in _PARAMS_TEXTO:
+            valor = ' '.join(valor.split()).lower()
+        normalizada.append((clave, valor))
+    normalizada.sort()
+    return urlunsplit((partes.scheme.lower(), partes.netloc.lower(), partes.path, urlencode(normalizada), ''))
+
+
+def _clave(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+class CuotaAgotada(requests.exceptions.Timeout):
+    """No hubo turno en el limitador del host antes de RATELIMIT_ESPERA_MAX."""
+
+
+def _descargar(url):
+    limitador = para_host(urlsplit(url).netloc)
+    # Con la cuota agotada la espera puede ser de casi un minuto: mejor la copia vieja, si la hay
+    if limitador is not None and not limitador.acquire(timeout=settings.RATELIMIT_ESPERA_MAX):
+        raise CuotaAgotada(f"Sin turno en la cuota de {urlsplit(url).netloc}")
+    return cliente.get_json(url)
+
+
+async def _adescargar(url):
+    limitador = para_host(urlsplit(url).netloc)
+    if limitador is not None and not await limitador.aacquire(timeout=settings.RATELIMIT_ESPERA_MAX):
+        raise CuotaAgotada(f"Sin turno en la cuota de {urlsplit(url).netloc}")
+    return await acliente.get_json(url)
+
+
+class ResponseCache:
+    def __init__(self, max_entradas, max_memoria=512, purgar_cada=100):
+        self.max_entradas = max_entradas
+        self.max_memoria = max_memoria
+        self.purgar_cada = purgar_cada
+        self._memoria = OrderedDict()  # clave -> (contenido, obtenido, expira)
+        self._lock = threading.Lock()
+        self._revalidando = set()
+        self._escrituras = 0
+        self.contadores = Counter()
+
+    def _politica(self, endpoint):
+        ttl, swr = settings.UPSTREAM_CACHE_TTL.get(endpoint, settings.UPSTREAM_CACHE_TTL['default'])
+        return timedelta(seconds=ttl), timedelta(seconds=swr)
+
+    def _contar(self, endpoint, evento):
+        with self._lock:
+            self.contadores[(endpoint, evento)] += 1
+        metricas.cache(evento)
+
+    def estadisticas(self):
+        """Contadores {(endpoint, 'hit'|'stale'|'miss'|'error'|'desalojo'): n} de este proceso."""
+        with self._lock:
+            return dict(self.contadores)
+
+    # --- Lectura ---
+
+    def _leer_memoria(self, clave):
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None:
+                self._memoria.move_to_end(clave)
+            return entrada
+
+    def _recordar(self, clave, contenido, obtenido, expira):
+        with self._lock:
+            self._memoria[clave] = (contenido, obtenido, expira)
+            self._memoria.move_to_end(clave)
+            while len(self._memoria) > self.max_memoria:
+                self._memoria.popitem(last=False)
+
+    def _buscar(self, claves):
+        """Devuelve {clave: (contenido, obtenido, expira)} mirando memoria y luego la BD."""
+        encontradas, faltan = {}, []
+        for clave in claves:
+            entrada = self._leer_memoria(clave)
+            if entrada is not None:
+                encontradas[clave] = entrada
+            else:
+                faltan.append(clave)
+        if faltan:
+            ahora = timezone.now()
+            filas = list(RespuestaCache.objects.filter(clave__in=faltan))
+            for fila in filas:
+                entrada = (fila.contenido, fila.obtenido, fila.expira)
+                encontradas[fila.clave] = entrada
+                self._recordar(fila.clave, *entrada)
+            # Solo tocamos ultimo_acceso si ha pasado un rato, para no escribir en cada lectura
+            viejas = [fila.pk for fila in filas if ahora - fila.ultimo_acceso > timedelta(minutes=5)]
+            if viejas:
+                RespuestaCache.objects.filter(pk__in=viejas).update(ultimo_acceso=ahora)
+        return encontradas
+
+    def obtener(self, endpoint, url, params=None):
+        """
+        Devuelve el JSON de `url` desde la caché o, si falta o está caducado,
+        desde la API (propaga las excepciones de `requests` si no hay copia).
+        """
+        url = normalizar_url(url, params)
+        hits, faltan = self.obtener_varios(endpoint, {url: url})
+        if url in hits:
+            return hits[url]
+        try:
+            contenido = self._descargar_una_vez(endpoint, url)
+        except (requests.exceptions.RequestException, ValueError):
+            # stale-if-error: mejor una copia vieja que una página de error
+            entrada = self._buscar([_clave(url)]).get(_clave(url))
+            self._contar(endpoint, 'error')
+            if entrada is None:
+                raise
+            return entrada[0]
+        return contenido
+
+    def _vigente_en_bd(self, url):
+        """Copia vigente guardada (quizá por otro proceso mientras esperábamos el cerrojo)."""
+        return RespuestaCache.objects.filter(
+            clave=_clave(url), expira__gt=timezone.now()).values_list('contenido', flat=True).first()
+
+    def _descargar_una_vez(self, endpoint, url):
+        """Descarga y guarda `url`; las peticiones simultáneas a la misma URL comparten la descarga."""
+        def descargar():
+            with bloqueo_entre_procesos(_clave(url)):
+                contenido = self._vigente_en_bd(url)
+                if contenido is None:
+                    contenido = _descargar(url)
+                    self.guardar(endpoint, url, contenido)
+                return contenido
+        return vuelos.hacer(_clave(url), descargar)
+
+    async def _adescargar_una_vez(self, endpoint, url):
+        async def descargar():
+            async with abloqueo_entre_procesos(_clave(url)):
+                contenido = await sync_to_async(self._vigente_en_bd)(url)
+                if contenido is None:
+                    contenido = await _adescargar(url)
+                    await sync_to_async(self.guardar)(endpoint, url, contenido)
+                return contenido
+        return await vuelos.ahacer(_clave(url), descargar)
+
+    async def aobtener(self, endpoint, url, params=None):
+        """Versión asíncrona de `obtener()`: la descarga no bloquea el bucle de eventos."""
+        url = normalizar_url(url, params)
+        hits, faltan = await sync_to_async(self.obtener_varios)(endpoint, {url: url})
+        if url in hits:
+            return hits[url]
+        try:
+            contenido = await self._adescargar_una_vez(endpoint, url)
+        except (requests.exceptions.RequestException, ValueError):
+            entrada = (await sync_to_async(self._buscar)([_clave(url)])).get(_clave(url))
+            self._contar(endpoint, 'error')
+            if entrada is None:
+                raise
+            return entrada[0]
+        return contenido
+
+    def obtener_varios(self, endpoint, urls):
+        """
+        Consulta varias URLs (dict clave -> url) de una vez. Devuelve
+        `(hits, faltan)`: el JSON de las que están en caché y el dict de las
+        que hay que pedir a la API. Las entradas caducadas dentro de la
+        ventana de revalidación se sirven y se refrescan en segundo plano.
+        """
+        ttl, swr = self._politica(endpoint)
+        normalizadas = {clave: normalizar_url(url) for clave, url in urls.items()}
+        entradas = self._buscar([_clave(url) for url in normalizadas.values()])
+        ahora = timezone.now()
+        hits, faltan, revalidar = {}, {}, []
+        for clave, url in normalizadas.items():
+            entrada = entradas.get(_clave(url))
+            if entrada is None:
+                faltan[clave] = url
+                self._contar(endpoint, 'miss')
+                continue
+            contenido, obtenido, expira = entrada
+            if ahora < expira:
+                hits[clave] = contenido
+                self._contar(endpoint, 'hit')
+            elif ahora < expira + swr:
+                hits[clave] = contenido
+                revalidar.append(url)
+                self._contar(endpoint, 'stale')
+            else:
+                faltan[clave] = url
+                self._contar(endpoint, 'miss')
+        if revalidar:
+            self._revalidar(endpoint, revalidar)
+        return hits, faltan
+
+    # --- Escritura ---
+
+    def guardar(self, endpoint, url, contenido):
+        self.guardar_varios(endpoint, {url: contenido})
+
+    def guardar_varios(self, endpoint, contenidos):
+        """Guarda {url: json} con el TTL del endpoint."""
+        if not contenidos:
+            return
+        ttl, _ = self._politica(endpoint)
+        ahora = timezone.now()
+        filas = []
+        for url, contenido in contenidos.items():
+            url = normalizar_url(url)
+            clave = _clave(url)
+            filas.append(RespuestaCache(
+                clave=clave, endpoint=endpoint, url=url, contenido=contenido,
+                obtenido=ahora, expira=ahora + ttl, ultimo_acceso=ahora,
+            ))
+            self._recordar(clave, contenido, ahora, ahora + ttl)
+        RespuestaCache.objects.bulk_create(
+            filas,
+            update_conflicts=True,
+            unique_fields=['clave'],
+            update_fields=['contenido', 'obtenido', 'expira', 'ultimo_acceso'],
+        )
+        with self._lock:
+            self._escrituras += len(filas)
+            purgar = self._escrituras >= self.purgar_cada
+            if purgar:
+                self._escrituras = 0
+        if purgar:
+            self.purgar()
+
+    def purgar(self):
+        """Desalojo LRU: deja como mucho `max_entradas` filas, quitando las menos usadas."""
+        sobrantes = RespuestaCache.objects.count() - self.max_entradas
+        if sobrantes <= 0:
+            return 0
+        pks = list(RespuestaCache.objects.order_by('ultimo_acceso').values_list('pk', flat=True)[:sobrantes])
+        RespuestaCache.objects.filter(pk__in=pks).delete()
+        with self._lock:
+            self.contadores[('*', 'desalojo')] += len(pks)
+        return len(pks)
+
+    def olvidar(self):
+        """Vacía la copia en memoria de este proceso (la tabla no se toca)."""
+        with self._lock:
+            self._memoria.clear()
+
+    def _revalidar(self, endpoint, urls):
+        with self._lock:
+            urls = [url for url in urls if url not in self._revalidando]
+            self._revalidando.update(urls)
+        if not urls:
+            return
+
+        def _refrescar():
+            try:
+                for url in urls:
+                    try:
+                        self.guardar(endpoint, url, _descargar(url))
+                    except (requests.exceptions.RequestException, ValueError) as e:
+                        logger.warning("No se pudo revalidar %s: %s", url, e)
+                    finally:
+                        with self._lock:
+                            self._revalidando.discard(url)
+            finally:
+                connection.close()
+
+        threading.Thread(target=_refrescar, daemon=True).start()
+
+
+cache_respuestas = ResponseCache(
+    max_entradas=getattr(settings, 'UPSTREAM_CACHE_MAX_ENTRADAS', 20000),
+    max_memoria=getattr(settings, 'UPSTREAM_CACHE_MAX_MEMORIA', 512),
+)
@@ -0,0 +1,324 @@
+"""
+Importación y exportación masiva de favoritos.
+
+Formatos de entrada (se detectan solos):
+
+- XML de exportación de MyAnimeList (`<myanimelist><anime>...`): animes por mal_id.
+- CSV de exportación de Goodreads: libros, que se resuelven a obras de
+  OpenLibrary por ISBN en lotes (`isbn:(A OR B ...)`) o, si no hay ISBN o no
+  aparece, por título y autor en el catálogo local.
+- El CSV de `mis_favoritos?formato=csv`, que ya trae los `contenido_id`.
+
+El archivo se lee en streaming (iterparse / csv) y se procesa por lotes de
+IMPORTACION_LOTE filas: se resuelven los ids del lote y se insertan con
+`bulk_create(ignore_conflicts=True)`, así que la memoria no depende del tamaño
+del archivo. Al terminar se invalidan las cachés de favoritos, los candidatos
+del recomendador y los snapshots del usuario.
+
+Las importaciones subidas desde la web no se hacen en la petición (resolver
+miles de ISBN con la cuota de OpenLibrary lleva minutos): `crear()` guarda el
+archivo y las encola, y las procesa un hilo del propio proceso
+(IMPORTACION_LOCAL) o el comando `refrescar_recomendaciones`.
+"""
+import csv
+import io
+import logging
+import os
+import queue
+import threading
+import uuid
+import xml.etree.ElementTree as ET
+from collections import Counter
+from datetime import timedelta
+from itertools import islice
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.html import escape
+
+from . import catalogo, favoritos, listados, recomendador, snapshots
+from .fanout import obtener_json_concurrente
+from .http_cache import cache_respuestas, normalizar_url
+from .items import AUTOR_DESCONOCIDO, CAMPOS_OPENLIBRARY
+from .models import Favorito, ImportacionFavoritos
+from .ratelimit import OPENLIBRARY_LIMITER
+
+logger = logging.getLogger(__name__)
+
+_cola = queue.Queue()
+_hilo = None
+_lock = threading.Lock()
+
+
+class FormatoDesconocido(ValueError):
+    """El archivo no es un XML de MyAnimeList ni un CSV conocido."""
+
+
+class Fila(NamedTuple):
+    tipo_contenido: str
+    contenido_id: str  # None si hay que resolverlo
+    titulo: str
+    autor: str = None
+    autor_key: str = None
+    isbns: tuple = ()
+
+
+# --- Lectura ---
+
+def _leer_mal(archivo):
+    eventos = ET.iterparse(archivo, events=('start', 'end'))
+    _, raiz = next(eventos)
+    if raiz.tag != 'myanimelist':
+        raise FormatoDesconocido(raiz.tag)
+    for evento, elemento in eventos:
+        if evento == 'end' and elemento.tag == 'anime':
+            contenido_id = (elemento.findtext('series_animedb_id') or '').strip()
+            if contenido_id.isdigit():
+                yield Fila('anime', contenido_id, (elemento.findtext('series_title') or '').strip())
+            raiz.clear()  # Sin esto el árbol crece con cada anime leído
+
+
+def _isbn(valor):
+    # Goodreads exporta los ISBN como fórmulas: ="9780441013593"
+    valor = (valor or '').strip().lstrip('=').strip('"')
+    return valor if valor.isdigit() or (valor[:-1].isdigit() and valor[-1:] in 'Xx') else None
+
+
+def _leer_csv(texto):
+    lector = csv.DictReader(texto)
+    columnas = set(lector.fieldnames or ())
+    if {'contenido_id', 'tipo_contenido', 'contenido_titulo'} <= columnas:
+        for fila in lector:
+            tipo, contenido_id = fila['tipo_contenido'], fila['contenido_id']
+            if (tipo == 'anime' and contenido_id.isdigit()) or (tipo == 'libro' and contenido_id):
+                yield Fila(fila['tipo_contenido'], fila['contenido_id'], fila['contenido_titulo'],
+                           fila.get('autor') or None, fila.get('autor_key') or None)
+    elif {'Title', 'Author'} <= columnas:
+        for fila in lector:
+            isbns = tuple(filter(None, (_isbn(fila.get('ISBN13')), _isbn(fila.get('ISBN')))))
+            yield Fila('libro', None, fila['Title'].strip(), fila['Author'].strip() or None, isbns=isbns)
+    else:
+        raise FormatoDesconocido(', '.join(sorted(columnas)))
+
+
+def leer(archivo):
+    """Filas de un archivo binario abierto (MAL XML o CSV), sin cargarlo entero en memoria."""
+    inicio = archivo.read(64)
+    archivo.seek(0)
+    if inicio.lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'<'):
+        return _leer_mal(archivo)
+    return _leer_csv(io.TextIOWrapper(archivo, encoding='utf-8-sig', newline=''))
+
+
+# --- Resolución de libros ---
+
+def _por_isbn(isbns):
+    """{isbn: doc} de OpenLibrary, en lotes de IMPORTACION_ISBN_LOTE pedidos en paralelo."""
+    isbns = sorted(set(isbns))
+    lote = settings.IMPORTACION_ISBN_LOTE
+    urls = {
+        i: normalizar_url(f"{settings.OPENLIBRARY_URL}/search.json", {
+            'q': 'isbn:({})'.format(' OR '.join(isbns[i:i + lote])),
+            'fields': CAMPOS_OPENLIBRARY + ',isbn', 'limit': lote,
+        })
+        for i in range(0, len(isbns), lote)
+    }
+    resultados, urls_pendientes = cache_respuestas.obtener_varios('openlibrary_isbn', urls)
+    descargados, errores, _ = obtener_json_concurrente(
+        urls_pendientes, OPENLIBRARY_LIMITER,
+        presupuesto=settings.IMPORTACION_PRESUPUESTO, max_workers=settings.OPENLIBRARY_MAX_WORKERS,
+    )
+    cache_respuestas.guardar_varios('openlibrary_isbn', {urls_pendientes[clave]: data for clave, data in descargados.items()})
+    resultados.update(descargados)
+    for error in errores.values():
+        logger.warning("No se pudieron resolver ISBN en OpenLibrary: %s", error)
+
+    buscados, encontrados = set(isbns), {}
+    for data in resultados.values():
+        for doc in data.get('docs', []):
+            if not doc.get('key'):
+                continue
+            for isbn in buscados.intersection(doc.get('isbn') or ()):
+                encontrados.setdefault(isbn, doc)
+    return encontrados
+
+
+def _resolver_libros(filas):
+    """Completa el `contenido_id` (work_id) de los libros que no lo traen; los que no se encuentran se descartan."""
+    docs = _por_isbn([isbn for fila in filas if fila.contenido_id is None for isbn in fila.isbns])
+    catalogo.guardar('libro', [catalogo.normalizar_libro(doc) for doc in {id(d): d for d in docs.values()}.values()])
+    resueltas = []
+    for fila in filas:
+        if fila.contenido_id is None:
+            doc = next((docs[isbn] for isbn in fila.isbns if isbn in docs), None)
+            if doc is not None:
+                libro = catalogo.normalizar_libro(doc)
+                fila = fila._replace(contenido_id=libro['work_id'], autor_key=libro['author_key'],
+                                     autor=fila.autor or libro['author_name'])
+            else:
+                locales = catalogo.buscar_local('libro', f'{fila.titulo} {fila.autor or ""}', limite=1)
+                if not locales:
+                    continue
+                fila = fila._replace(contenido_id=locales[0]['work_id'], autor_key=locales[0].get('author_key'))
+        resueltas.append(fila)
+    return resueltas
+
+
+# --- Importación ---
+
+def _lotes(filas, tamano):
+    filas = iter(filas)
+    while lote := list(islice(filas, tamano)):
+        yield lote
+
+
+def importar(usuario_id, filas, progreso=None):
+    """
+    Inserta las `filas` como favoritos del usuario, por lotes. Llama a
+    `progreso(resumen)` tras cada lote y devuelve el resumen final: Counter
+    con `leidas`, `importadas`, `repetidas` y `sin_resolver`.
+    """
+    resumen = Counter(leidas=0, importadas=0, repetidas=0, sin_resolver=0)
+    tipos = set()
+    total = Favorito.objects.filter(usuario_id=usuario_id).count()
+    for lote in _lotes(filas, settings.IMPORTACION_LOTE):
+        resumen['leidas'] += len(lote)
+        if any(fila.contenido_id is None for fila in lote):
+            resueltas = _resolver_libros(lote)
+            resumen['sin_resolver'] += len(lote) - len(resueltas)
+            lote = resueltas
+        nuevos = {}
+        for fila in lote:
+            libro = fila.tipo_contenido == 'libro'
+            nuevos.setdefault((fila.tipo_contenido, fila.contenido_id), Favorito(
+                usuario_id=usuario_id, tipo_contenido=fila.tipo_contenido, contenido_id=fila.contenido_id[:100],
+                contenido_titulo=(fila.titulo or fila.contenido_id)[:255],
+                autor=((fila.autor or AUTOR_DESCONOCIDO)[:255]) if libro else None,
+                autor_key=fila.autor_key if libro else None,
+            ))
+            tipos.add(fila.tipo_contenido)
+        Favorito.objects.bulk_create(nuevos.values(), ignore_conflicts=True)
+        anterior, total = total, Favorito.objects.filter(usuario_id=usuario_id).count()
+        resumen['importadas'] += total - anterior
+        resumen['repetidas'] += len(lote) - (total - anterior)
+        if progreso is not None:
+            progreso(resumen)
+
+    if resumen['importadas']:
+        for tipo in tipos:
+            favoritos.invalidar(usuario_id, tipo)
+        recomendador.olvidar_candidatos(usuario_id)
+        for tipo in snapshots.marcar_pendientes(usuario_id):
+            snapshots.encolar(usuario_id, tipo)
+    return resumen
+
+
+# --- Importaciones en segundo plano ---
+
+def crear(usuario_id, subido):
+    """
+    Guarda el archivo subido en IMPORTACION_DIR y registra la importación
+    como pendiente. Lanza FormatoDesconocido si no es un formato conocido.
+    """
+    os.makedirs(settings.IMPORTACION_DIR, exist_ok=True)
+    ruta = os.path.join(settings.IMPORTACION_DIR, uuid.uuid4().hex)
+    with open(ruta, 'wb') as destino:
+        for trozo in subido.chunks():
+            destino.write(trozo)
+    try:
+        # Solo la primera fila: basta para rechazar el archivo antes de encolarlo
+        with open(ruta, 'rb') as archivo:
+            next(iter(leer(archivo)), None)
+    except (FormatoDesconocido, ET.ParseError, UnicodeDecodeError) as e:
+        os.remove(ruta)
+        raise FormatoDesconocido(str(e))
+    importacion = ImportacionFavoritos.objects.create(usuario_id=usuario_id, archivo=ruta, actualizada=timezone.now())
+    encolar(importacion.pk)
+    return importacion
+
+
+def reciente(usuario_id, importacion_id):
+    """La importación si es del usuario y sigue en marcha o terminó hace menos de un día; si no, None."""
+    return (ImportacionFavoritos.objects.filter(pk=importacion_id, usuario_id=usuario_id)
+            .filter(Q(estado__in=['pendiente', 'en_curso']) | Q(actualizada__gte=timezone.now() - timedelta(days=1)))
+            .first())
+
+
+def _por_procesar():
+    atascada = timezone.now() - timedelta(seconds=settings.IMPORTACION_ATASCADA)
+    return ImportacionFavoritos.objects.filter(
+        Q(estado='pendiente') | Q(estado='en_curso', actualizada__lt=atascada))
+
+
+def pendientes(limite=10):
+    """Ids de las importaciones pendientes (o en curso sin avances: su proceso murió), las más antiguas primero."""
+    return list(_por_procesar().order_by('actualizada').values_list('pk', flat=True)[:limite])
+
+
+def procesar(importacion_id):
+    """Ejecuta una importación encolada; otro proceso que la haya tomado antes la deja pasar."""
+    if not _por_procesar().filter(pk=importacion_id).update(estado='en_curso', actualizada=timezone.now()):
+        return
+    fila = ImportacionFavoritos.objects.get(pk=importacion_id)
+
+    def avance(resumen):
+        ImportacionFavoritos.objects.filter(pk=importacion_id).update(resumen=dict(resumen), actualizada=timezone.now())
+
+    try:
+        with open(fila.archivo, 'rb') as archivo:
+            resumen = importar(fila.usuario_id, leer(archivo), avance)
+    except Exception as e:
+        logger.exception("Falló la importación %s", importacion_id)
+        ImportacionFavoritos.objects.filter(pk=importacion_id).update(
+            estado='error', error=str(e)[:1000], actualizada=timezone.now())
+    else:
+        ImportacionFavoritos.objects.filter(pk=importacion_id).update(
+            estado='terminada', resumen=dict(resumen), actualizada=timezone.now())
+    try:
+        os.remove(fila.archivo)
+    except FileNotFoundError:
+        pass
+
+
+def encolar(importacion_id):
+    """Pasa la importación al hilo consumidor del proceso (si está activado); si no, la recoge el worker."""
+    global _hilo
+    if not settings.IMPORTACION_LOCAL:
+        return
+    with _lock:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_consumir, daemon=True)
+            _hilo.start()
+    _cola.put(importacion_id)
+
+
+def _consumir():
+    while True:
+        importacion_id = _cola.get()
+        try:
+            procesar(importacion_id)
+        except Exception:
+            logger.exception("No se pudo procesar la importación %s", importacion_id)
+        finally:
+            connection.close()
+
+
+# --- Exportación ---
+
+def _lineas_mal(queryset):
+    yield '<?xml version="1.0" encoding="UTF-8" ?>\n<myanimelist>\n'
+    filas = queryset.values_list('contenido_id', 'contenido_titulo').iterator(chunk_size=settings.LISTADOS_CHUNK)
+    for contenido_id, titulo in filas:
+        yield (f'  <anime><series_animedb_id>{escape(contenido_id)}</series_animedb_id>'
+               f'<series_title><![CDATA[{titulo.replace("]]>", "]]]]><![CDATA[>")}]]></series_title>'
+               f'<my_status>Completed</my_status></anime>\n')
+    yield '</myanimelist>\n'
+
+
+def exportar_mal(request, queryset):
+    """Los animes de `queryset` como XML de MyAnimeList (el que acepta su importador), en streaming."""
+    return listados.descarga(request, _lineas_mal(queryset.filter(tipo_contenido='anime')),
+                             'application/xml; charset=utf-8', 'animelist.xml')
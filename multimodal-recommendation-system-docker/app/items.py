@@ -0,0 +1,142 @@
+"""
+Registros compactos de animes y libros.
+
+Jikan y OpenLibrary devuelven objetos con decenas de campos (los `docs` de
+OpenLibrary pueden traer cientos: ediciones, ISBN, ...). Aquí se extraen solo
+los que usan las plantillas y la API, en dataclasses con `__slots__`.
+`como_dict()` da la forma JSON que guardan el catálogo y los snapshots y
+`desde_dict()` la vuelve a leer.
+"""
+from dataclasses import asdict, dataclass, field, fields
+
+AUTOR_DESCONOCIDO = 'Autor desconocido'
+
+# Campos que se piden a search.json de OpenLibrary (parámetro `fields`)
+CAMPOS_OPENLIBRARY = 'key,title,author_name,author_key,first_publish_year,cover_i,language,first_sentence,subject'
+
+
+def _entero(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _primera_frase(valor):
+    # search.json devuelve una lista de frases; la API de obras, {'value': ...}
+    if isinstance(valor, list):
+        valor = valor[0] if valor else None
+    if isinstance(valor, dict):
+        valor = valor.get('value')
+    return valor or None
+
+
+class _Item:
+    __slots__ = ()
+
+    def como_dict(self):
+        """Forma JSON del item (sin `es_favorito`, que depende del usuario)."""
+        datos = asdict(self)
+        del datos['es_favorito']
+        return datos
+
+    @classmethod
+    def _desde_campos(cls, datos):
+        nombres = {f.name for f in fields(cls)}
+        return cls(**{clave: valor for clave, valor in datos.items() if clave in nombres})
+
+
+@dataclass(slots=True)
+class AnimeItem(_Item):
+    mal_id: int
+    title: str = ''
+    url: str = None
+    image_url: str = None
+    type: str = None
+    episodes: int = None
+    score: float = None
+    synopsis: str = None
+    genres: list = field(default_factory=list)
+    es_favorito: bool = False
+
+    @property
+    def contenido_id(self):
+        return str(self.mal_id)
+
+    @classmethod
+    def desde_jikan(cls, data):
+        """Item a partir de un anime de Jikan (resultado de búsqueda o `entry` de recomendaciones)."""
+        return cls(
+            mal_id=data.get('mal_id'),
+            title=data.get('title') or '',
+            url=data.get('url'),
+            image_url=((data.get('images') or {}).get('jpg') or {}).get('image_url'),
+            type=data.get('type'),
+            episodes=data.get('episodes'),
+            score=data.get('score'),
+            synopsis=data.get('synopsis'),
+            genres=[g['name'] for g in data.get('genres') or [] if g.get('name')],
+        )
+
+    @classmethod
+    def desde_dict(cls, datos):
+        if 'images' in datos:  # Registro guardado antes de existir AnimeItem
+            datos = dict(datos, image_url=((datos['images'] or {}).get('jpg') or {}).get('image_url'))
+        return cls._desde_campos(datos)
+
+
+@dataclass(slots=True)
+class BookItem(_Item):
+    work_id: str
+    title: str = ''
+    author_name: str = AUTOR_DESCONOCIDO
+    author_key: str = None  # Clave OpenLibrary del primer autor (OL...A)
+    first_publish_year: int = None
+    cover_url: str = None
+    language: list = field(default_factory=list)
+    first_sentence: str = None
+    subject: list = field(default_factory=list)
+    es_favorito: bool = False
+
+    @property
+    def contenido_id(self):
+        return self.work_id
+
+    @property
+    def key(self):
+        return f'/works/{self.work_id}'
+
+    @classmethod
+    def desde_openlibrary(cls, data):
+        """Item a partir de un `doc` de search.json de OpenLibrary."""
+        return cls(
+            work_id=(data.get('key') or '').split('/')[-1],
+            title=data.get('title') or '',
+            author_name=', '.join(data.get('author_name') or [AUTOR_DESCONOCIDO]),
+            author_key=(data.get('author_key') or [None])[0],
+            first_publish_year=_entero(data.get('first_publish_year')),
+            cover_url=(f"https://covers.openlibrary.org/b/id/{data['cover_i']}-M.jpg"
+                       if data.get('cover_i') else None),
+            language=(data.get('language') or [])[:3],
+            first_sentence=_primera_frase(data.get('first_sentence')),
+            subject=(data.get('subject') or [])[:10],
+        )
+
+    @classmethod
+    def desde_dict(cls, datos):
+        # Los registros antiguos guardaban la frase como lista y 'N/A' si no había año
+        datos = dict(datos, first_publish_year=_entero(datos.get('first_publish_year')),
+                     first_sentence=_primera_frase(datos.get('first_sentence')))
+        return cls._desde_campos(datos)
+
+
+CLASES = {'anime': AnimeItem, 'libro': BookItem}
+
+
+def desde_dict(tipo_contenido, datos):
+    """Item del tipo dado a partir de un registro del catálogo o de un snapshot."""
+    return CLASES[tipo_contenido].desde_dict(datos)
+
+
+def lista(tipo_contenido, registros):
+    return [desde_dict(tipo_contenido, datos) for datos in registros]
@@ -0,0 +1,115 @@
+"""
+Listados largos: paginación por cursor (keyset) y exportación en streaming.
+
+`paginar()` no usa OFFSET: el cursor codifica los valores de ordenación de la
+última fila mostrada y la página siguiente se pide con un WHERE sobre esos
+valores, así que cada página cuesta lo mismo esté donde esté. `exportar()`
+devuelve un CSV o JSON Lines que se genera mientras se envía, leyendo la
+tabla por bloques con `.iterator()`. Bajo ASGI el contenido tiene que ser un
+iterador asíncrono: Django consume los síncronos enteros antes de enviar nada.
+"""
+import base64
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def codificar_cursor(valores):
+    texto = json.dumps([v.isoformat() if hasattr(v, 'isoformat') else v for v in valores])
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor, modelo, orden):
+    """Valores del cursor convertidos al tipo de cada campo; None si falta o no es válido."""
+    if not cursor:
+        return None
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if len(valores) != len(orden):
+            return None
+        return [modelo._meta.get_field(campo.lstrip('-')).to_python(v) for campo, v in zip(orden, valores)]
+    except (ValueError, TypeError, ValidationError):
+        return None
+
+
+def _despues_de(orden, valores):
+    """Q de las filas que van detrás de `valores` en el orden dado (comparación lexicográfica)."""
+    condicion = Q()
+    for i, campo in enumerate(orden):
+        nombre = campo.lstrip('-')
+        operador = 'lt' if campo.startswith('-') else 'gt'
+        iguales = {orden[j].lstrip('-'): valores[j] for j in range(i)}
+        condicion |= Q(**iguales, **{f'{nombre}__{operador}': valores[i]})
+    return condicion
+
+
+def paginar(queryset, orden, cursor=None, tamano=None):
+    """
+    Una página de `queryset` ordenado por `orden` (el último campo debe ser
+    único, p. ej. el id). Devuelve `(filas, cursor_siguiente)`; el cursor es
+    None en la última página.
+    """
+    tamano = tamano or settings.LISTADOS_TAMANO_PAGINA
+    queryset = queryset.order_by(*orden)
+    valores = decodificar_cursor(cursor, queryset.model, orden)
+    if valores is not None:
+        queryset = queryset.filter(_despues_de(orden, valores))
+    filas = list(queryset[:tamano + 1])
+    if len(filas) <= tamano:
+        return filas, None
+    filas = filas[:tamano]
+    return filas, codificar_cursor([getattr(filas[-1], campo.lstrip('-')) for campo in orden])
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve la línea en lugar de guardarla."""
+
+    def write(self, valor):
+        return valor
+
+
+def _lineas(queryset, campos, formato):
+    filas = queryset.only(*campos).iterator(chunk_size=settings.LISTADOS_CHUNK)
+    if formato == 'csv':
+        escritor = csv.writer(_Eco())
+        yield escritor.writerow(campos)
+        for fila in filas:
+            yield escritor.writerow([getattr(fila, campo) for campo in campos])
+    else:
+        for fila in filas:
+            yield json.dumps({campo: getattr(fila, campo) for campo in campos},
+                             ensure_ascii=False, default=str) + '\n'
+
+
+async def _en_bloques(lineas):
+    """Las líneas de un generador síncrono, LISTADOS_CHUNK por vez, leídas en un hilo fuera del bucle de eventos."""
+    siguiente = sync_to_async(lambda: ''.join(islice(lineas, settings.LISTADOS_CHUNK)))
+    while bloque := await siguiente():
+        yield bloque
+
+
+def descarga(request, lineas, content_type, archivo):
+    """StreamingHttpResponse que envía `lineas` a medida que se generan, también bajo ASGI."""
+    if isinstance(request, ASGIRequest):
+        lineas = _en_bloques(lineas)
+    response = StreamingHttpResponse(lineas, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{archivo}"'
+    return response
+
+
+def exportar(request, queryset, campos, formato, nombre):
+    """StreamingHttpResponse con `campos` de cada fila en CSV o JSON Lines."""
+    return descarga(request, _lineas(queryset, campos, formato), FORMATOS[formato], f'{nombre}.{formato}')
@@ -0,0 +1,240 @@
+import json
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, teardown_databases
+
+from app import stub_apis
+from app.http_cache import cache_respuestas
+from app.models import ConsultaCatalogo, Favorito, ItemCatalogo, RespuestaCache, SnapshotRecomendacion, Usuario
+
+# Consultas de búsqueda: las primeras vueltas van a la API, las siguientes salen del catálogo local
+CONSULTAS = ['bebop', 'alchemist', 'steins gate', 'titan', 'death note', 'evangelion', 'chihiro', 'naruto',
+             'hunter', 'tolkien', 'dune', 'earthsea', 'orwell', 'soledad', 'foundation', 'neuromancer']
+
+
+def _favoritos_de_prueba(tipo_contenido, cantidad):
+    """(contenido_id, titulo, autor) de `cantidad` favoritos: primero los grabados, después sintéticos."""
+    if tipo_contenido == 'anime':
+        grabados = [(str(a['mal_id']), a['title'], None) for a in stub_apis._grabacion('jikan_anime.json')['data']]
+        sinteticos = ((str(100000 + i), f'Anime {i}', None) for i in range(cantidad))
+    else:
+        grabados = [(d['key'].split('/')[-1], d['title'], d['author_name'][0])
+                    for d in stub_apis._grabacion('openlibrary_search.json')['docs']]
+        autores = [autor for _, _, autor in grabados]
+        sinteticos = ((f'OL{900000 + i}W', f'Libro {i}', autores[i % len(autores)]) for i in range(cantidad))
+    return (grabados + list(sinteticos))[:cantidad]
+
+
+def _buscar(ruta):
+    def peticion(cliente, usuario, i):
+        return cliente.get(ruta, {'query': CONSULTAS[i % len(CONSULTAS)]})
+    return None, peticion
+
+
+def _toggle():
+    def peticion(cliente, usuario, i):
+        # Cada anime se añade y en la siguiente vuelta se quita
+        contenido_id = 200000 + i % 12
+        return cliente.post('/toggle-favorito/', {
+            'contenido_id': contenido_id, 'contenido_titulo': f'Anime {contenido_id}', 'tipo_contenido': 'anime',
+        })
+    return None, peticion
+
+
+def _recomendaciones(ruta, tipo_contenido):
+    def preparar(usuario):
+        # Sin snapshot la vista calcula la página en la petición: es el coste que depende de los favoritos
+        SnapshotRecomendacion.objects.filter(usuario=usuario, tipo_contenido=tipo_contenido).delete()
+
+    def peticion(cliente, usuario, i):
+        return cliente.get(ruta)
+    return preparar, peticion
+
+
+ESCENARIOS = {
+    'buscar_anime': lambda: _buscar('/buscar-anime/'),
+    'buscar_libros': lambda: _buscar('/buscar-libros/'),
+    'toggle_favorito': _toggle,
+    'recomendaciones_anime': lambda: _recomendaciones('/recomendaciones/', 'anime'),
+    'recomendaciones_libros': lambda: _recomendaciones('/recomendaciones-libros/', 'libro'),
+}
+
+
+def _lista(valor, convertir=str):
+    return [convertir(v.strip()) for v in valor.split(',') if v.strip()]
+
+
+class Command(BaseCommand):
+    help = ('Pruebas de carga de las vistas contra stubs locales de Jikan y OpenLibrary: latencia '
+            'p50/p95/p99, throughput, consultas SQL y llamadas a las APIs por escenario. Usa una base '
+            'de datos de prueba que se crea y se borra en cada ejecución.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escenarios', default=','.join(ESCENARIOS),
+                            help=f"Escenarios separados por comas ({', '.join(ESCENARIOS)})")
+        parser.add_argument('--favoritos', default='5,50', help='Favoritos por usuario (anime y libros), p. ej. 5,50,200')
+        parser.add_argument('--peticiones', type=int, default=40, help='Peticiones por escenario')
+        parser.add_argument('--concurrencia', type=int, default=4, help='Clientes simultáneos (un usuario cada uno)')
+        parser.add_argument('--latencia', type=float, default=80, help='Latencia media de los stubs (ms)')
+        parser.add_argument('--jitter', type=float, default=40, help='Variación de la latencia de los stubs (ms)')
+        parser.add_argument('--prob-429', type=float, default=0.02, help='Probabilidad de que un stub responda 429')
+        parser.add_argument('--retry-after', type=int, default=1, help='Retry-After (segundos) de los 429')
+        parser.add_argument('--semilla', type=int, default=1, help='Semilla de la latencia y los 429 de los stubs')
+        parser.add_argument('--salida', help='Guarda los resultados en este archivo JSON')
+        parser.add_argument('--comparar', help='JSON de una ejecución anterior: falla si algún escenario empeora')
+        parser.add_argument('--tolerancia', type=float, default=0.25,
+                            help='Empeoramiento admitido al comparar (0.25 = 25%% en p95 y consultas SQL)')
+
+    def handle(self, *args, **options):
+        escenarios = _lista(options['escenarios'])
+        desconocidos = set(escenarios) - set(ESCENARIOS)
+        if desconocidos:
+            raise CommandError(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+        cantidades = _lista(options['favoritos'], int)
+        base = None
+        if options['comparar']:
+            with open(options['comparar']) as archivo:
+                base = json.load(archivo)
+
+        stubs = {
+            nombre: stub_apis.StubAPI(
+                nombre, rutas(), latencia=options['latencia'] / 1000, jitter=options['jitter'] / 1000,
+                prob_429=options['prob_429'], retry_after=options['retry_after'], semilla=options['semilla'] + i,
+            ).iniciar()
+            for i, (nombre, rutas) in enumerate([('jikan', stub_apis.rutas_jikan), ('openlibrary', stub_apis.rutas_openlibrary)])
+        }
+        directorio_metricas = tempfile.mkdtemp()
+        ajustes = override_settings(
+            JIKAN_API_URL=stubs['jikan'].url,
+            OPENLIBRARY_URL=stubs['openlibrary'].url,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            # Cachés propias: los ids de la base de prueba no deben pisar los de la real
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'},
+                'plantillas': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark-plantillas'},
+            },
+            RATELIMIT_ENTRE_PROCESOS=False,  # Cuotas propias del proceso, sin tocar las de los workers
+            SNAPSHOTS_REFRESCO_LOCAL=False,  # Sin hilos en segundo plano que sigan usando la base al borrarla
+            METRICAS_DIR=directorio_metricas,
+        )
+        configuracion = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        resultados = {}
+        try:
+            with ajustes:
+                for cantidad in cantidades:
+                    for escenario in escenarios:
+                        nombre = f'{escenario}[favoritos={cantidad}]'
+                        resultados[nombre] = self._ejecutar(escenario, cantidad, options, stubs)
+                        self._mostrar(nombre, resultados[nombre])
+        finally:
+            connections.close_all()
+            teardown_databases(configuracion, verbosity=0)
+            for stub in stubs.values():
+                stub.detener()
+            shutil.rmtree(directorio_metricas, ignore_errors=True)
+
+        if options['salida']:
+            with open(options['salida'], 'w') as archivo:
+                json.dump(resultados, archivo, indent=2)
+        if base is not None:
+            self._comparar(base, resultados, options['tolerancia'])
+
+    def _reiniciar(self, cantidad, concurrencia):
+        """Base y cachés vacías y un usuario por cliente con `cantidad` favoritos de cada tipo."""
+        for modelo in (Usuario, RespuestaCache, ConsultaCatalogo, ItemCatalogo):
+            modelo.objects.all().delete()
+        cache_respuestas.olvidar()
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        usuarios = []
+        for n in range(concurrencia):
+            usuario = Usuario.objects.create(nombre=f'benchmark{n}', email=f'benchmark{n}@example.com', password_hash='!')
+            Favorito.objects.bulk_create([
+                Favorito(usuario=usuario, tipo_contenido=tipo, contenido_id=contenido_id,
+                         contenido_titulo=titulo, autor=autor)
+                for tipo in ('anime', 'libro')
+                for contenido_id, titulo, autor in _favoritos_de_prueba(tipo, cantidad)
+            ])
+            usuarios.append(usuario)
+        return usuarios
+
+    def _ejecutar(self, escenario, cantidad, options, stubs):
+        preparar, peticion = ESCENARIOS[escenario]()
+        concurrencia = options['concurrencia']
+        usuarios = self._reiniciar(cantidad, concurrencia)
+        antes = {nombre: stub.estadisticas() for nombre, stub in stubs.items()}
+
+        def cliente(n):
+            usuario = usuarios[n]
+            http = Client(raise_request_exception=False)
+            sesion = http.session
+            sesion['usuario_id'] = usuario.id
+            sesion.save()
+            medidas = []
+            try:
+                for i in range(n, options['peticiones'], concurrencia):
+                    if preparar is not None:
+                        preparar(usuario)
+                    inicio = time.perf_counter()
+                    response = peticion(http, usuario, i)
+                    segundos = time.perf_counter() - inicio
+                    medicion = getattr(response.wsgi_request, 'medicion', None)
+                    medidas.append((
+                        segundos, response.status_code >= 400,
+                        medicion.db_consultas if medicion else 0,
+                        sum(llamadas for llamadas, _ in medicion.upstream.values()) if medicion else 0,
+                    ))
+            finally:
+                connections.close_all()
+            return medidas
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+            medidas = [m for lista in executor.map(cliente, range(concurrencia)) for m in lista]
+        total = time.perf_counter() - inicio
+
+        latencias = np.array([m[0] for m in medidas]) * 1000
+        p50, p95, p99 = np.percentile(latencias, [50, 95, 99]) if len(latencias) else (0.0, 0.0, 0.0)
+        despues = {nombre: stub.estadisticas() for nombre, stub in stubs.items()}
+        return {
+            'peticiones': len(medidas),
+            'errores': sum(1 for m in medidas if m[1]),
+            'p50_ms': round(float(p50), 1),
+            'p95_ms': round(float(p95), 1),
+            'p99_ms': round(float(p99), 1),
+            'rps': round(len(medidas) / total, 2) if total else 0.0,
+            'consultas_sql': round(sum(m[2] for m in medidas) / max(len(medidas), 1), 2),
+            'upstream': round(sum(m[3] for m in medidas) / max(len(medidas), 1), 2),
+            'upstream_429': sum(despues[n].get('429', 0) - antes[n].get('429', 0) for n in stubs),
+        }
+
+    def _mostrar(self, nombre, r):
+        self.stdout.write(
+            f"{nombre:<40} {r['peticiones']:>4} pet. {r['errores']:>3} err. | "
+            f"p50 {r['p50_ms']:7.1f} ms  p95 {r['p95_ms']:7.1f} ms  p99 {r['p99_ms']:7.1f} ms | "
+            f"{r['rps']:6.1f} pet/s | SQL {r['consultas_sql']:5.1f}/pet. | "
+            f"upstream {r['upstream']:4.1f}/pet. ({r['upstream_429']} x 429)")
+
+    def _comparar(self, base, resultados, tolerancia):
+        regresiones = []
+        for nombre, r in resultados.items():
+            anterior = base.get(nombre)
+            if anterior is None:
+                continue
+            for metrica in ('p95_ms', 'consultas_sql'):
+                if r[metrica] > anterior[metrica] * (1 + tolerancia) and r[metrica] - anterior[metrica] >= 1:
+                    regresiones.append(f"{nombre}: {metrica} {anterior[metrica]} -> {r[metrica]}")
+            if r['errores'] > anterior['errores']:
+                regresiones.append(f"{nombre}: errores {anterior['errores']} -> {r['errores']}")
+        if regresiones:
+            raise CommandError('Regresiones respecto a la ejecución anterior:\n' + '\n'.join(regresiones))
+        self.stdout.write(self.style.SUCCESS('Sin regresiones respecto a la ejecución anterior.'))
@@ -0,0 +1,65 @@
+import time
+
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+from app.items import AnimeItem, BookItem
+
+PLANTILLAS = {
+    'anime_search.html': 'resultados',
+    'recomendaciones_anime.html': 'recomendaciones',
+    'libro_search.html': 'resultados',
+    'recomendaciones_libros.html': 'recomendaciones',
+}
+
+
+def _items(plantilla, cantidad):
+    if 'anime' in plantilla:
+        return [AnimeItem(
+            mal_id=i, title=f'Anime {i}', url=f'https://myanimelist.net/anime/{i}',
+            image_url=f'https://cdn.myanimelist.net/images/anime/{i}.jpg', type='TV', episodes=24, score=8.1,
+            synopsis='Un grupo de amigos descubre que su ciudad esconde un secreto. ' * 5,
+            genres=['Action', 'Drama'],
+        ) for i in range(cantidad)]
+    return [BookItem(
+        work_id=f'OL{i}W', title=f'Libro {i}', author_name='Ursula K. Le Guin', first_publish_year=1968,
+        cover_url=f'https://covers.openlibrary.org/b/id/{i}-M.jpg', language=['eng', 'spa'],
+        first_sentence='Only in silence the word, only in dark the light. ' * 3, subject=['Fantasy'],
+    ) for i in range(cantidad)]
+
+
+class Command(BaseCommand):
+    help = 'Mide el tiempo de render (real y de CPU) de las páginas de resultados con y sin la caché de fragmentos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=24, help='Tarjetas por página')
+        parser.add_argument('--repeticiones', type=int, default=200, help='Renders por medición')
+
+    def _medir(self, plantilla, contexto, request, repeticiones, en_frio):
+        fragmentos = caches['plantillas']
+        real = cpu = 0.0
+        for _ in range(repeticiones):
+            if en_frio:
+                fragmentos.clear()
+            inicio_real, inicio_cpu = time.perf_counter(), time.process_time()
+            render_to_string(plantilla, contexto, request=request)
+            real += time.perf_counter() - inicio_real
+            cpu += time.process_time() - inicio_cpu
+        return real / repeticiones * 1000, cpu / repeticiones * 1000
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        request.usuario = None
+        for plantilla, variable in PLANTILLAS.items():
+            contexto = {variable: _items(plantilla, options['items']), 'cruzadas': []}
+            render_to_string(plantilla, contexto, request=request)  # Compila la plantilla (cargador con caché)
+            frio = self._medir(plantilla, contexto, request, options['repeticiones'], en_frio=True)
+            caliente = self._medir(plantilla, contexto, request, options['repeticiones'], en_frio=False)
+            self.stdout.write(
+                f"{plantilla:<30} en frío {frio[0]:6.2f} ms (CPU {frio[1]:6.2f} ms) | "
+                f"en caliente {caliente[0]:6.2f} ms (CPU {caliente[1]:6.2f} ms) | x{frio[0] / caliente[0]:.1f}")
+        caches['plantillas'].clear()
@@ -0,0 +1,23 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app import recomendador
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los vecinos item-item (filtrado colaborativo) a partir de la tabla de favoritos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=settings.RECOMENDADOR_K, help='Vecinos a guardar por item')
+        parser.add_argument('--metrica', choices=['coseno', 'jaccard'], default=settings.RECOMENDADOR_METRICA)
+        parser.add_argument('--min-coocurrencias', type=int, default=settings.RECOMENDADOR_MIN_COOCURRENCIAS,
+                            help='Descarta pares con menos usuarios en común')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        filas = recomendador.construir_modelo(
+            k=options['k'], metrica=options['metrica'], min_coocurrencias=options['min_coocurrencias'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{filas} similitudes guardadas en {time.monotonic() - inicio:.2f}s"))
@@ -0,0 +1,39 @@
+import time
+import xml.etree.ElementTree as ET
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import importacion
+from app.models import Usuario
+
+
+class Command(BaseCommand):
+    help = ('Importa los favoritos de un usuario desde una exportación de MyAnimeList (XML) o de '
+            'Goodreads (CSV), o desde el CSV de mis favoritos')
+
+    def add_arguments(self, parser):
+        parser.add_argument('usuario', help='Email o id del usuario')
+        parser.add_argument('archivo', help='Archivo a importar')
+
+    def handle(self, *args, **options):
+        usuario = options['usuario']
+        filtro = {'pk': int(usuario)} if usuario.isdigit() else {'email': usuario}
+        try:
+            usuario = Usuario.objects.get(**filtro)
+        except Usuario.DoesNotExist:
+            raise CommandError(f"No existe el usuario {options['usuario']}")
+
+        inicio = time.monotonic()
+
+        def progreso(resumen):
+            self.stdout.write(f"{resumen['leidas']} leídas, {resumen['importadas']} importadas "
+                              f"({time.monotonic() - inicio:.1f}s)")
+
+        try:
+            with open(options['archivo'], 'rb') as archivo:
+                resumen = importacion.importar(usuario.id, importacion.leer(archivo), progreso)
+        except (importacion.FormatoDesconocido, ET.ParseError, UnicodeDecodeError) as e:
+            raise CommandError(f"Formato no reconocido: {e}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{resumen['importadas']} favoritos importados de {resumen['leidas']} en {time.monotonic() - inicio:.2f}s "
+            f"({resumen['repetidas']} repetidos, {resumen['sin_resolver']} sin resolver)"))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import precalentamiento
+
+
+class Command(BaseCommand):
+    help = ('Precalienta el catálogo y la caché de respuestas: listados top/temporada/populares de Jikan, '
+            'recomendaciones de los animes con más favoritos y obras de los autores de los libros con más '
+            'favoritos. Si se interrumpe, la siguiente ejecución continúa donde se quedó.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paginas', type=int, default=4, help='Páginas de cada listado de Jikan')
+        parser.add_argument('--favoritos', type=int, default=200,
+                            help='Animes y libros con más favoritos a precalentar (de cada tipo)')
+        parser.add_argument('--reiniciar', action='store_true', help='Descarta el progreso guardado y empieza de cero')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        progreso = precalentamiento.Progreso(
+            {'paginas': options['paginas'], 'favoritos': options['favoritos']}, reiniciar=options['reiniciar'])
+        tareas = precalentamiento.planificar(options['paginas'], options['favoritos'])
+        if progreso.hechas:
+            self.stdout.write(f"Reanudando: {sum(1 for t in tareas if t.clave in progreso.hechas)} de "
+                              f"{len(tareas)} tareas ya hechas")
+
+        def avisar(fase, resumen):
+            self.stdout.write(f"[{fase}] {resumen['en_cache']} en caché, {resumen['descargadas']} descargadas, "
+                              f"{resumen['errores']} errores ({time.monotonic() - inicio:.1f}s)")
+
+        resumen = precalentamiento.precalentar(tareas, progreso, avisar)
+        mensaje = (f"{len(tareas)} tareas en {time.monotonic() - inicio:.2f}s: {resumen['descargadas']} descargadas, "
+                   f"{resumen['en_cache']} ya en caché, {resumen['omitidas']} de una ejecución anterior")
+        if resumen['errores'] or resumen['pendientes']:
+            self.stdout.write(self.style.WARNING(
+                f"{mensaje}; {resumen['errores']} con error y {resumen['pendientes']} sin tiempo. "
+                "Vuelve a ejecutar el comando para reintentarlas."))
+        else:
+            self.stdout.write(self.style.SUCCESS(mensaje))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import importacion, snapshots
+
+
+class Command(BaseCommand):
+    help = ('Recalcula los snapshots de recomendaciones pendientes o caducados y ejecuta las importaciones '
+            'de favoritos subidas desde la web')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=100, help='Snapshots a recalcular por pasada')
+        parser.add_argument('--continuo', action='store_true', help='Sigue atendiendo la cola indefinidamente')
+        parser.add_argument('--intervalo', type=float, default=30,
+                            help='Segundos de espera cuando no hay nada que recalcular (con --continuo)')
+
+    def handle(self, *args, **options):
+        while True:
+            inicio = time.monotonic()
+            pendientes = snapshots.por_refrescar(options['lote'])
+            for usuario_id, tipo_contenido in pendientes:
+                try:
+                    snapshots.refrescar(usuario_id, tipo_contenido)
+                except Exception as e:
+                    self.stderr.write(f"Error en {usuario_id}/{tipo_contenido}: {e}")
+            if pendientes:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{len(pendientes)} snapshots recalculados en {time.monotonic() - inicio:.2f}s"))
+            importaciones = importacion.pendientes()
+            for importacion_id in importaciones:
+                importacion.procesar(importacion_id)
+            if importaciones:
+                self.stdout.write(self.style.SUCCESS(f"{len(importaciones)} importaciones de favoritos procesadas"))
+            if not options['continuo']:
+                break
+            if len(pendientes) < options['lote'] and not importaciones:
+                time.sleep(options['intervalo'])
@@ -0,0 +1,322 @@
+"""
+Instrumentación por vista y exposición de métricas en formato Prometheus.
+
+`MetricasMiddleware` abre una `Medicion` por petición en una ContextVar (la
+heredan los hilos de `sync_to_async`) y al terminar la vuelca en los
+histogramas de la vista: tiempo total, consultas SQL y su tiempo, llamadas a
+cada API externa y su latencia, aciertos y fallos de la caché de respuestas
+y tiempo de render de plantillas. Lo que ocurre fuera de una petición (p. ej.
+el refresco de snapshots) se anota con `vista="-"`.
+
+Cada worker vuelca sus métricas en METRICAS_DIR cada METRICAS_VOLCADO
+segundos y `/metrics` suma las de todos los procesos. Con
+METRICAS_SERVER_TIMING las respuestas llevan además la cabecera
+`Server-Timing` con el desglose de la petición.
+"""
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates
+
+# Límites superiores (segundos) de los buckets de los histogramas de latencia
+BUCKETS_LATENCIA = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_RAPIDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+BUCKETS_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# nombre -> (tipo, ayuda, buckets)
+FAMILIAS = {
+    'app_vista_duracion_segundos': ('histogram', 'Tiempo total de la petición por vista.', BUCKETS_LATENCIA),
+    'app_vista_db_consultas': ('histogram', 'Consultas SQL por petición.', BUCKETS_CONSULTAS),
+    'app_vista_db_segundos': ('histogram', 'Tiempo en consultas SQL por petición.', BUCKETS_RAPIDOS),
+    'app_vista_plantillas_segundos': ('histogram', 'Tiempo de render de plantillas por petición.', BUCKETS_RAPIDOS),
+    'app_upstream_segundos': ('histogram', 'Latencia de cada llamada a una API externa.', BUCKETS_LATENCIA),
+    'app_cache_respuestas_total': ('counter', 'Eventos de la caché de respuestas (hit, stale, miss, error, desalojo).', None),
+}
+
+
+class Histograma:
+    """Histograma acumulativo al estilo Prometheus (buckets, suma y cuenta)."""
+
+    def __init__(self, buckets=BUCKETS_LATENCIA):
+        self.buckets = buckets
+        self.cuentas = [0] * (len(buckets) + 1)  # El último es +Inf
+        self.suma = 0.0
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def observar(self, valor):
+        with self._lock:
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    self.cuentas[i] += 1
+                    break
+            else:
+                self.cuentas[-1] += 1
+            self.suma += valor
+            self.total += 1
+
+    def exportar(self, nombre, etiquetas=''):
+        """Líneas en formato de exposición de Prometheus."""
+        separador = ',' if etiquetas else ''
+        with self._lock:
+            lineas, acumulado = [], 0
+            for limite, cuenta in zip(self.buckets + ('+Inf',), self.cuentas):
+                acumulado += cuenta
+                lineas.append(f'{nombre}_bucket{{{etiquetas}{separador}le="{limite}"}} {acumulado}')
+            lineas.append(f'{nombre}_sum{{{etiquetas}}} {self.suma}')
+            lineas.append(f'{nombre}_count{{{etiquetas}}} {self.total}')
+        return lineas
+
+
+class Registro:
+    """Histogramas y contadores de este proceso, indexados por (nombre, etiquetas)."""
+
+    def __init__(self):
+        self._histogramas = {}
+        self._contadores = Counter()
+        self._lock = threading.Lock()
+
+    def observar(self, nombre, etiquetas, valor):
+        with self._lock:
+            histograma = self._histogramas.get((nombre, etiquetas))
+            if histograma is None:
+                histograma = self._histogramas[(nombre, etiquetas)] = Histograma(FAMILIAS[nombre][2])
+        histograma.observar(valor)
+
+    def contar(self, nombre, etiquetas, cantidad=1):
+        with self._lock:
+            self._contadores[(nombre, etiquetas)] += cantidad
+
+    def estado(self):
+        """Forma JSON del registro, para volcarla y sumarla con la de otros procesos."""
+        with self._lock:
+            histogramas, contadores = dict(self._histogramas), dict(self._contadores)
+        return {
+            'histogramas': [[nombre, etiquetas, h.cuentas, h.suma, h.total]
+                            for (nombre, etiquetas), h in histogramas.items()],
+            'contadores': [[nombre, etiquetas, n] for (nombre, etiquetas), n in contadores.items()],
+        }
+
+
+registro = Registro()
+
+
+def _etiquetas(**valores):
+    return ','.join(f'{clave}="{valor}"' for clave, valor in valores.items())
+
+
+class Medicion:
+    """Lo que consume una petición; varios hilos de la misma petición pueden anotar a la vez."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.db_consultas = 0
+        self.db_segundos = 0.0
+        self.plantillas_segundos = 0.0
+        self.upstream = defaultdict(lambda: [0, 0.0])  # host -> [llamadas, segundos]
+        self.cache = Counter()
+        self._lock = threading.Lock()
+
+    def server_timing(self, total):
+        partes = [
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={self.db_segundos * 1000:.1f};desc="{self.db_consultas} consultas"',
+            f'plantillas;dur={self.plantillas_segundos * 1000:.1f}',
+        ]
+        partes.extend(f'upstream;dur={segundos * 1000:.1f};desc="{host} x{llamadas}"'
+                      for host, (llamadas, segundos) in self.upstream.items())
+        if self.cache:
+            partes.append('cache;desc="{}"'.format(' '.join(f'{k}={v}' for k, v in sorted(self.cache.items()))))
+        return ', '.join(partes)
+
+    def registrar(self, vista, total):
+        registro.observar('app_vista_duracion_segundos', _etiquetas(vista=vista), total)
+        registro.observar('app_vista_db_consultas', _etiquetas(vista=vista), self.db_consultas)
+        registro.observar('app_vista_db_segundos', _etiquetas(vista=vista), self.db_segundos)
+        registro.observar('app_vista_plantillas_segundos', _etiquetas(vista=vista), self.plantillas_segundos)
+
+
+_actual = contextvars.ContextVar('medicion', default=None)
+
+
+def upstream(host, segundos):
+    """Hook del cliente upstream: una llamada a `host` que tardó `segundos`."""
+    medicion = _actual.get()
+    vista = getattr(medicion, 'vista', '-')
+    registro.observar('app_upstream_segundos', _etiquetas(vista=vista, host=host), segundos)
+    if medicion is not None:
+        with medicion._lock:
+            medicion.upstream[host][0] += 1
+            medicion.upstream[host][1] += segundos
+
+
+def cache(resultado):
+    """Hook de la caché de respuestas: 'hit', 'stale', 'miss', 'error' o 'desalojo'."""
+    medicion = _actual.get()
+    registro.contar('app_cache_respuestas_total', _etiquetas(vista=getattr(medicion, 'vista', '-'), resultado=resultado))
+    if medicion is not None:
+        with medicion._lock:
+            medicion.cache[resultado] += 1
+
+
+def _medir_consulta(execute, sql, params, many, context):
+    medicion = _actual.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        with medicion._lock:
+            medicion.db_consultas += 1
+            medicion.db_segundos += time.perf_counter() - inicio
+
+
+def _instalar(conexion):
+    if _medir_consulta not in conexion.execute_wrappers:
+        conexion.execute_wrappers.append(_medir_consulta)
+
+
+@receiver(connection_created)
+def _al_conectar(sender, connection, **kwargs):
+    _instalar(connection)
+
+
+class _PlantillaMedida:
+    def __init__(self, plantilla):
+        self.plantilla = plantilla
+
+    def __getattr__(self, nombre):
+        return getattr(self.plantilla, nombre)
+
+    def render(self, context=None, request=None):
+        medicion = _actual.get()
+        if medicion is None:
+            return self.plantilla.render(context, request)
+        inicio = time.perf_counter()
+        try:
+            return self.plantilla.render(context, request)
+        finally:
+            with medicion._lock:
+                medicion.plantillas_segundos += time.perf_counter() - inicio
+
+
+class PlantillasMedidas(DjangoTemplates):
+    """Backend de plantillas de Django que anota el tiempo de render en la medición de la petición."""
+
+    def from_string(self, template_code):
+        return _PlantillaMedida(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _PlantillaMedida(super().get_template(template_name))
+
+
+_ultimo_volcado = 0.0
+_volcado_lock = threading.Lock()
+
+
+def volcar(forzar=False):
+    """Escribe el estado de este proceso en METRICAS_DIR (como mucho cada METRICAS_VOLCADO segundos)."""
+    global _ultimo_volcado
+    with _volcado_lock:
+        ahora = time.monotonic()
+        if not forzar and ahora - _ultimo_volcado < settings.METRICAS_VOLCADO:
+            return
+        _ultimo_volcado = ahora
+    os.makedirs(settings.METRICAS_DIR, exist_ok=True)
+    ruta = os.path.join(settings.METRICAS_DIR, f'{os.getpid()}.json')
+    with open(ruta + '.tmp', 'w') as archivo:
+        json.dump(registro.estado(), archivo)
+    os.replace(ruta + '.tmp', ruta)
+
+
+def exportar():
+    """Métricas de todos los procesos sumadas, en formato de exposición de Prometheus."""
+    volcar(forzar=True)
+    histogramas, contadores = {}, Counter()
+    for ruta in glob.glob(os.path.join(settings.METRICAS_DIR, '*.json')):
+        try:
+            with open(ruta) as archivo:
+                estado = json.load(archivo)
+        except (OSError, ValueError):
+            continue  # Un proceso lo está reemplazando
+        for nombre, etiquetas, cuentas, suma, total in estado['histogramas']:
+            if nombre not in FAMILIAS:
+                continue
+            histograma = histogramas.get((nombre, etiquetas))
+            if histograma is None:
+                histograma = histogramas[(nombre, etiquetas)] = Histograma(FAMILIAS[nombre][2])
+            histograma.cuentas = [a + b for a, b in zip(histograma.cuentas, cuentas)]
+            histograma.suma += suma
+            histograma.total += total
+        for nombre, etiquetas, cantidad in estado['contadores']:
+            contadores[(nombre, etiquetas)] += cantidad
+
+    lineas = []
+    for nombre, (tipo, ayuda, _) in FAMILIAS.items():
+        lineas.extend([f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} {tipo}'])
+        if tipo == 'histogram':
+            for (familia, etiquetas), histograma in sorted(histogramas.items()):
+                if familia == nombre:
+                    lineas.extend(histograma.exportar(nombre, etiquetas))
+        else:
+            lineas.extend(f'{nombre}{{{etiquetas}}} {cantidad}'
+                          for (familia, etiquetas), cantidad in sorted(contadores.items()) if familia == nombre)
+    return '\n'.join(lineas) + '\n'
+
+
+class MetricasMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _empezar(self):
+        for conexion in connections.all(initialized_only=True):
+            _instalar(conexion)  # Conexiones abiertas antes de importar este módulo
+        medicion = Medicion()
+        return medicion, _actual.set(medicion)
+
+    def _terminar(self, request, response, medicion, token):
+        _actual.reset(token)
+        total = time.perf_counter() - medicion.inicio
+        medicion.registrar(medicion.vista, total)
+        if settings.METRICAS_SERVER_TIMING:
+            response['Server-Timing'] = medicion.server_timing(total)
+        volcar()
+        return response
+
+    def process_view(self, request, vista, args, kwargs):
+        medicion = _actual.get()
+        if medicion is not None:
+            medicion.vista = request.resolver_match.view_name
+        return None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        medicion, token = self._empezar()
+        medicion.vista = '-'
+        request.medicion = medicion
+        response = self.get_response(request)
+        return self._terminar(request, response, medicion, token)
+
+    async def __acall__(self, request):
+        medicion, token = self._empezar()
+        medicion.vista = '-'
+        request.medicion = medicion
+        response = await self.get_response(request)
+        return self._terminar(request, response, medicion, token)
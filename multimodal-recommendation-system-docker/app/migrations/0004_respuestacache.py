@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_update_favorito_model'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RespuestaCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=64, unique=True)),
+                ('endpoint', models.CharField(max_length=50)),
+                ('url', models.TextField()),
+                ('contenido', models.JSONField()),
+                ('obtenido', models.DateTimeField()),
+                ('expira', models.DateTimeField()),
+                ('ultimo_acceso', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Respuesta en caché',
+                'verbose_name_plural': 'Respuestas en caché',
+                'db_table': 'cache_respuestas',
+            },
+        ),
+    ]
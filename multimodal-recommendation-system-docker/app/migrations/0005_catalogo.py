@@ -0,0 +1,58 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_respuestacache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemCatalogo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo_contenido', models.CharField(choices=[('anime', 'Anime'), ('libro', 'Libro')], max_length=10)),
+                ('contenido_id', models.CharField(max_length=100)),
+                ('titulo', models.CharField(max_length=255)),
+                ('autores', models.CharField(blank=True, default='', max_length=500)),
+                ('generos', models.CharField(blank=True, default='', max_length=500)),
+                ('datos', models.JSONField()),
+                ('actualizado', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Item del catálogo',
+                'verbose_name_plural': 'Items del catálogo',
+                'db_table': 'catalogo_items',
+                'unique_together': {('tipo_contenido', 'contenido_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TerminoCatalogo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('termino', models.CharField(max_length=100)),
+                ('peso', models.PositiveSmallIntegerField(default=1)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terminos', to='app.itemcatalogo')),
+            ],
+            options={
+                'db_table': 'catalogo_terminos',
+                'unique_together': {('termino', 'item')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ConsultaCatalogo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo_contenido', models.CharField(choices=[('anime', 'Anime'), ('libro', 'Libro')], max_length=10)),
+                ('consulta', models.CharField(max_length=100)),
+                ('resultados', models.JSONField(default=list)),
+                ('actualizado', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'catalogo_consultas',
+                'unique_together': {('tipo_contenido', 'consulta')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_catalogo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilitudItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo_contenido', models.CharField(choices=[('anime', 'Anime'), ('libro', 'Libro')], max_length=10)),
+                ('contenido_id', models.CharField(max_length=100)),
+                ('vecino_tipo', models.CharField(choices=[('anime', 'Anime'), ('libro', 'Libro')], max_length=10)),
+                ('vecino_id', models.CharField(max_length=100)),
+                ('score', models.FloatField()),
+                ('coocurrencias', models.PositiveIntegerField()),
+            ],
+            options={
+                'db_table': 'similitudes_items',
+                'unique_together': {('tipo_contenido', 'contenido_id', 'vecino_tipo', 'vecino_id')},
+                'indexes': [models.Index(fields=['tipo_contenido', 'contenido_id', '-score'], name='similitud_item_score_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_similituditem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotRecomendacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo_contenido', models.CharField(choices=[('anime', 'Anime'), ('libro', 'Libro')], max_length=10)),
+                ('contenido', models.JSONField(default=dict)),
+                ('generado', models.DateTimeField()),
+                ('expira', models.DateTimeField()),
+                ('pendiente', models.BooleanField(default=False)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='app.usuario')),
+            ],
+            options={
+                'db_table': 'snapshots_recomendaciones',
+                'unique_together': {('usuario', 'tipo_contenido')},
+                'indexes': [models.Index(fields=['pendiente', 'expira'], name='snapshot_refresco_idx')],
+            },
+        ),
+    ]
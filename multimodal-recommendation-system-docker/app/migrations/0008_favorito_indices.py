@@ -0,0 +1,34 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_snapshotrecomendacion'),
+    ]
+
+    operations = [
+        # 0003 creó la tabla nueva como "FavoritoContenido" sin retirar el
+        # modelo antiguo del estado; aquí el estado vuelve a coincidir con
+        # models.py (sin tocar la base de datos) para que makemigrations funcione.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.DeleteModel(name='Favorito'),
+                migrations.RenameModel(old_name='FavoritoContenido', new_name='Favorito'),
+                migrations.AlterField(
+                    model_name='favorito',
+                    name='usuario',
+                    field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='favoritos', to='app.usuario'),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='favorito',
+            index=models.Index(fields=['usuario', 'tipo_contenido'], name='favorito_usuario_tipo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='favorito',
+            index=models.Index(fields=['usuario', '-fecha_agregado'], name='favorito_usuario_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_favorito_indices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favorito',
+            name='autor_key',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.CreateModel(
+            name='ObrasAutor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('autor_key', models.CharField(max_length=50, unique=True)),
+                ('obras', models.JSONField(default=list)),
+                ('actualizado', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'catalogo_obras_autor',
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_autor_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportacionFavoritos',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archivo', models.CharField(max_length=255)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_curso', 'En curso'), ('terminada', 'Terminada'), ('error', 'Error')], default='pendiente', max_length=10)),
+                ('resumen', models.JSONField(default=dict)),
+                ('error', models.TextField(blank=True, default='')),
+                ('creada', models.DateTimeField(auto_now_add=True)),
+                ('actualizada', models.DateTimeField()),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='importaciones', to='app.usuario')),
+            ],
+            options={
+                'db_table': 'importaciones_favoritos',
+                'indexes': [models.Index(fields=['estado', 'actualizada'], name='importacion_cola_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_importacionfavoritos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionVecinos',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo_contenido', models.CharField(choices=[('anime', 'Anime'), ('libro', 'Libro')], max_length=10)),
+                ('contenido_id', models.CharField(max_length=100)),
+                ('version', models.CharField(max_length=32)),
+            ],
+            options={
+                'db_table': 'similitudes_versiones',
+                'unique_together': {('tipo_contenido', 'contenido_id')},
+            },
+        ),
+    ]
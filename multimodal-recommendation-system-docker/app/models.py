@@ -37,10 +37,17 @@ class Favorito(models.Model):
     contenido_titulo = models.CharField(max_length=255)
     tipo_contenido = models.CharField(max_length=10, choices=TIPO_CONTENIDO)
     autor = models.CharField(max_length=255, blank=True, null=True)  # Para libros
+    autor_key = models.CharField(max_length=50, blank=True, null=True)  # Clave OpenLibrary del autor (OL...A)
     fecha_agregado = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ('usuario', 'contenido_id', 'tipo_contenido')
+        indexes = [
+            # Búsquedas y recomendaciones: favoritos de un usuario por tipo
+            models.Index(fields=['usuario', 'tipo_contenido'], name='favorito_usuario_tipo_idx'),
+            # Mis favoritos: los más recientes primero
+            models.Index(fields=['usuario', '-fecha_agregado'], name='favorito_usuario_fecha_idx'),
+        ]
         db_table = 'favoritos_contenido'
         verbose_name = 'Favorito'
         verbose_name_plural = 'Favoritos'
@@ -48,4 +55,144 @@ class Favorito(models.Model):
     def __str__(self):
         if self.tipo_contenido == 'libro':
             return f"{self.contenido_titulo} por {self.autor} (Favorito de {self.usuario.nombre})"
-        return f"{self.contenido_titulo} (Favorito de {self.usuario.nombre})"
\ No newline at end of file
+        return f"{self.contenido_titulo} (Favorito de {self.usuario.nombre})"
+
+class RespuestaCache(models.Model):
+    """Respuesta JSON de una API externa guardada por la caché de respuestas (ver app/http_cache.py)."""
+    clave = models.CharField(max_length=64, unique=True)  # sha256 de la URL normalizada
+    endpoint = models.CharField(max_length=50)
+    url = models.TextField()
+    contenido = models.JSONField()
+    obtenido = models.DateTimeField()
+    expira = models.DateTimeField()
+    ultimo_acceso = models.DateTimeField(db_index=True)  # Para el desalojo LRU
+
+    class Meta:
+        db_table = 'cache_respuestas'
+        verbose_name = 'Respuesta en caché'
+        verbose_name_plural = 'Respuestas en caché'
+
+    def __str__(self):
+        return f"{self.endpoint}: {self.url}"
+
+
+class ItemCatalogo(models.Model):
+    """Anime o libro normalizado a partir de respuestas de Jikan / OpenLibrary ya recibidas."""
+    tipo_contenido = models.CharField(max_length=10, choices=Favorito.TIPO_CONTENIDO)
+    contenido_id = models.CharField(max_length=100)  # mal_id para anime, work_id para libros
+    titulo = models.CharField(max_length=255)
+    autores = models.CharField(max_length=500, blank=True, default='')
+    generos = models.CharField(max_length=500, blank=True, default='')
+    datos = models.JSONField()  # Campos que usan las plantillas
+    actualizado = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('tipo_contenido', 'contenido_id')
+        db_table = 'catalogo_items'
+        verbose_name = 'Item del catálogo'
+        verbose_name_plural = 'Items del catálogo'
+
+    def __str__(self):
+        return f"{self.titulo} ({self.tipo_contenido})"
+
+
+class TerminoCatalogo(models.Model):
+    """Entrada del índice invertido del catálogo: término -> item, con peso según el campo."""
+    termino = models.CharField(max_length=100)
+    item = models.ForeignKey(ItemCatalogo, on_delete=models.CASCADE, related_name='terminos')
+    peso = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        unique_together = ('termino', 'item')
+        db_table = 'catalogo_terminos'
+
+
+class ConsultaCatalogo(models.Model):
+    """Búsqueda ya resuelta contra la API externa; mientras esté fresca se sirve desde el catálogo."""
+    tipo_contenido = models.CharField(max_length=10, choices=Favorito.TIPO_CONTENIDO)
+    consulta = models.CharField(max_length=100)  # Normalizada
+    resultados = models.JSONField(default=list)  # contenido_id devueltos por la API, en orden
+    actualizado = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('tipo_contenido', 'consulta')
+        db_table = 'catalogo_consultas'
+
+
+class ObrasAutor(models.Model):
+    """Índice autor -> obras de OpenLibrary (los registros de las obras están en ItemCatalogo)."""
+    autor_key = models.CharField(max_length=50, unique=True)
+    obras = models.JSONField(default=list)  # work_id en el orden de OpenLibrary
+    actualizado = models.DateTimeField()
+
+    class Meta:
+        db_table = 'catalogo_obras_autor'
+
+
+class SimilitudItem(models.Model):
+    """Vecino precalculado de un item según el filtrado colaborativo item-item sobre Favorito."""
+    tipo_contenido = models.CharField(max_length=10, choices=Favorito.TIPO_CONTENIDO)
+    contenido_id = models.CharField(max_length=100)
+    vecino_tipo = models.CharField(max_length=10, choices=Favorito.TIPO_CONTENIDO)
+    vecino_id = models.CharField(max_length=100)
+    score = models.FloatField()
+    coocurrencias = models.PositiveIntegerField()  # Usuarios que tienen ambos en favoritos
+
+    class Meta:
+        unique_together = ('tipo_contenido', 'contenido_id', 'vecino_tipo', 'vecino_id')
+        indexes = [
+            models.Index(fields=['tipo_contenido', 'contenido_id', '-score'], name='similitud_item_score_idx'),
+        ]
+        db_table = 'similitudes_items'
+
+
+class VersionVecinos(models.Model):
+    """Versión de los vecinos de un item: cambia cada vez que se reescriben sus filas de SimilitudItem."""
+    tipo_contenido = models.CharField(max_length=10, choices=Favorito.TIPO_CONTENIDO)
+    contenido_id = models.CharField(max_length=100)
+    version = models.CharField(max_length=32)
+
+    class Meta:
+        unique_together = ('tipo_contenido', 'contenido_id')
+        db_table = 'similitudes_versiones'
+
+
+class SnapshotRecomendacion(models.Model):
+    """Recomendaciones ya calculadas de un usuario para un tipo de contenido; las vistas solo leen esta fila."""
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='snapshots')
+    tipo_contenido = models.CharField(max_length=10, choices=Favorito.TIPO_CONTENIDO)
+    contenido = models.JSONField(default=dict)  # recomendaciones, cruzadas, error_api, sin_favoritos
+    generado = models.DateTimeField()
+    expira = models.DateTimeField()
+    pendiente = models.BooleanField(default=False)  # Cambiaron los favoritos desde que se generó
+    version = models.PositiveIntegerField(default=0)  # Sube con cada cambio de favoritos
+
+    class Meta:
+        unique_together = ('usuario', 'tipo_contenido')
+        indexes = [
+            models.Index(fields=['pendiente', 'expira'], name='snapshot_refresco_idx'),
+        ]
+        db_table = 'snapshots_recomendaciones'
+
+
+class ImportacionFavoritos(models.Model):
+    """Importación masiva de favoritos subida desde la web; la procesa un hilo o worker en segundo plano."""
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('en_curso', 'En curso'),
+        ('terminada', 'Terminada'),
+        ('error', 'Error'),
+    ]
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='importaciones')
+    archivo = models.CharField(max_length=255)  # Copia del archivo subido en IMPORTACION_DIR
+    estado = models.CharField(max_length=10, choices=ESTADOS, default='pendiente')
+    resumen = models.JSONField(default=dict)  # leidas, importadas, repetidas, sin_resolver
+    error = models.TextField(blank=True, default='')
+    creada = models.DateTimeField(auto_now_add=True)
+    actualizada = models.DateTimeField()  # Último avance; una importación en curso sin avances se retoma
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['estado', 'actualizada'], name='importacion_cola_idx'),
+        ]
+        db_table = 'importaciones_favoritos'
@@ -0,0 +1,44 @@
+"""
+Caché de páginas completas para visitantes sin sesión.
+
+`cache_publica` guarda la respuesta de una vista GET mientras el visitante no
+haya iniciado sesión ni tenga mensajes pendientes, con una entrada por URL e
+idioma activo (el de la sesión, la cookie o Accept-Language que resolvió
+LocaleMiddleware). Las páginas que usan el token CSRF o ponen cookies no se
+guardan, porque no se pueden compartir entre visitantes. Se activa con PAGINAS_CACHE_TTL.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.utils import translation
+
+
+def _clave(request):
+    url = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+    return f'pagina:{translation.get_language()}:{url}'
+
+
+def _compartible(request, response):
+    return (response.status_code == 200 and not response.cookies and not response.streaming
+            and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE'))
+
+
+def cache_publica(vista):
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        ttl = settings.PAGINAS_CACHE_TTL
+        # Con sesión iniciada o mensajes pendientes la página es solo de este visitante
+        if not ttl or request.method != 'GET' or 'usuario_id' in request.session or len(get_messages(request)):
+            return vista(request, *args, **kwargs)
+        cache = caches['plantillas']
+        clave = _clave(request)
+        response = cache.get(clave)
+        if response is None:
+            response = vista(request, *args, **kwargs)
+            if _compartible(request, response):
+                cache.set(clave, response, ttl)
+        return response
+    return envoltura
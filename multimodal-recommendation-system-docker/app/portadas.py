@@ -0,0 +1,198 @@
+"""
+Proxy local de portadas (OpenLibrary) e imágenes de anime (MyAnimeList).
+
+Cada imagen se descarga una sola vez (single-flight, también entre
+procesos), se reduce a miniatura JPEG y se guarda en disco con la extensión
+del formato que de verdad se guardó (el original si no se pudo reducir). El directorio
+tiene un tope de tamaño con desalojo LRU: las lecturas renuevan la fecha de
+modificación del archivo y al purgar se borran los más antiguos. Como las
+URLs de origen no cambian de contenido, el navegador puede guardarlas
+indefinidamente (Cache-Control inmutable y ETag).
+
+Las miniaturas necesitan Pillow; sin él se guarda y sirve la imagen original.
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from .singleflight import bloqueo_entre_procesos, vuelos
+from .upstream import cliente
+
+try:
+    from PIL import Image
+except ImportError:  # Sin Pillow no hay miniaturas
+    Image = None
+
+# Caja máxima (ancho, alto) de cada tamaño de miniatura
+TAMANOS = {'s': (120, 180), 'm': (400, 600)}
+
+# Formatos que se guardan -> Content-Type, en el orden en que se buscan en disco (las miniaturas son JPEG)
+EXTENSIONES = {'.jpg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp', '.gif': 'image/gif'}
+
+# La sesión del cliente pide JSON; a los CDN de imágenes se les piden imágenes
+ACCEPT = 'image/avif,image/webp,image/png,image/jpeg,image/*;q=0.8'
+
+
+class ImagenNoPermitida(ValueError):
+    """La URL no es de un host de imágenes conocido."""
+
+
+def permitida(url):
+    partes = urlsplit(url or '')
+    return partes.scheme == 'https' and partes.netloc in settings.PORTADAS_HOSTS
+
+
+def extension(contenido):
+    """Extensión de `contenido` según su firma; ValueError si no es un formato de imagen conocido."""
+    if contenido[:3] == b'\xff\xd8\xff':
+        return '.jpg'
+    if contenido[:8] == b'\x89PNG\r\n\x1a\n':
+        return '.png'
+    if contenido[:4] == b'RIFF' and contenido[8:12] == b'WEBP':
+        return '.webp'
+    if contenido[:6] in (b'GIF87a', b'GIF89a'):
+        return '.gif'
+    raise ValueError("El contenido no es una imagen")
+
+
+def miniatura(contenido, tamano):
+    """JPEG reducido a la caja de `tamano`; la imagen original si no hay Pillow o no se puede leer."""
+    if Image is None:
+        return contenido
+    try:
+        with Image.open(io.BytesIO(contenido)) as imagen:
+            imagen.draft('RGB', TAMANOS[tamano])  # Los JPEG se decodifican ya a escala reducida
+            imagen = imagen.convert('RGB')
+            imagen.thumbnail(TAMANOS[tamano])
+            salida = io.BytesIO()
+            imagen.save(salida, 'JPEG', quality=settings.PORTADAS_CALIDAD, optimize=True, progressive=True)
+    except (OSError, ValueError):
+        return contenido
+    return salida.getvalue()
+
+
+class CachePortadas:
+    def __init__(self, directorio, max_bytes, purgar_cada=50):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.purgar_cada = purgar_cada
+        self._lock = threading.Lock()
+        self._escrituras = 0
+
+    @staticmethod
+    def clave(url, tamano):
+        return f"{hashlib.sha256(url.encode('utf-8')).hexdigest()[:40]}-{tamano}"
+
+    def ruta(self, url, tamano, extension=''):
+        """Ruta de la imagen con `extension`; sin ella, la base común a todos los formatos."""
+        clave = self.clave(url, tamano)
+        return os.path.join(self.directorio, clave[:2], clave + extension)
+
+    def _buscar(self, base):
+        """Ruta de la imagen ya guardada con cualquiera de las EXTENSIONES, o None."""
+        for ext in EXTENSIONES:
+            if self._leer(base + ext):
+                return base + ext
+        return None
+
+    @staticmethod
+    def tipo(ruta):
+        return EXTENSIONES.get(os.path.splitext(ruta)[1], 'application/octet-stream')
+
+    def _leer(self, ruta):
+        try:
+            estado = os.stat(ruta)
+        except FileNotFoundError:
+            return False
+        # Renovar la fecha como mucho una vez por hora para no escribir en cada lectura
+        if time.time() - estado.st_mtime > 3600:
+            try:
+                os.utime(ruta)
+            except FileNotFoundError:
+                return False
+        return True
+
+    def obtener(self, url, tamano='m'):
+        """Ruta en disco de la miniatura de `url`, descargándola si aún no está."""
+        if not permitida(url):
+            raise ImagenNoPermitida(url)
+        if tamano not in TAMANOS:
+            raise ValueError(f"Tamaño desconocido: {tamano}")
+        base = self.ruta(url, tamano)
+        ruta = self._buscar(base)
+        if ruta is not None:
+            return ruta
+
+        def descargar():
+            with bloqueo_entre_procesos(base):
+                ruta = self._buscar(base)  # Otro proceso pudo guardarla mientras esperábamos
+                if ruta is None:
+                    contenido = miniatura(self._descargar(url), tamano)
+                    ruta = base + extension(contenido)
+                    self._guardar(ruta, contenido)
+            return ruta
+        return vuelos.hacer(base, descargar)
+
+    def _descargar(self, url):
+        """Cuerpo de la imagen, leído por trozos: se corta al pasar de PORTADAS_MAX_ORIGINAL."""
+        response = cliente.get(url, headers={'Accept': ACCEPT}, stream=True)
+        try:
+            if int(response.headers.get('Content-Length') or 0) > settings.PORTADAS_MAX_ORIGINAL:
+                raise ValueError(f"Imagen demasiado grande: {url}")
+            contenido = bytearray()
+            for trozo in response.iter_content(64 * 1024):
+                contenido += trozo
+                if len(contenido) > settings.PORTADAS_MAX_ORIGINAL:
+                    raise ValueError(f"Imagen demasiado grande: {url}")
+        finally:
+            response.close()
+        return bytes(contenido)
+
+    def _guardar(self, ruta, contenido):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporal, 'wb') as archivo:
+            archivo.write(contenido)
+        os.replace(temporal, ruta)
+        with self._lock:
+            self._escrituras += 1
+            purgar = self._escrituras >= self.purgar_cada
+            if purgar:
+                self._escrituras = 0
+        if purgar:
+            self.purgar()
+
+    def purgar(self):
+        """Desalojo LRU: borra las imágenes menos usadas hasta quedar en el 90% de `max_bytes`."""
+        archivos = []
+        total = 0
+        for subdirectorio in os.scandir(self.directorio) if os.path.isdir(self.directorio) else ():
+            if not subdirectorio.is_dir():
+                continue
+            for entrada in os.scandir(subdirectorio.path):
+                if entrada.name.endswith('.tmp'):
+                    continue
+                estado = entrada.stat()
+                archivos.append((estado.st_mtime, estado.st_size, entrada.path))
+                total += estado.st_size
+        if total <= self.max_bytes:
+            return 0
+        borrados = 0
+        for _, tamano, ruta in sorted(archivos):
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            total -= tamano
+            borrados += 1
+        return borrados
+
+
+portadas = CachePortadas(settings.PORTADAS_DIR, settings.PORTADAS_MAX_BYTES)
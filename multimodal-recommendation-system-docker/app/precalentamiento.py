@@ -0,0 +1,174 @@
+"""
+Precalentamiento de las cachés tras un despliegue.
+
+Recorre, por este orden:
+
+1. Los listados de Jikan (top, temporada actual y más populares), cuyos
+   animes se guardan en el catálogo local.
+2. Las recomendaciones de Jikan de los animes con más favoritos en nuestra
+   tabla `Favorito`, que quedan en la caché de respuestas con la misma URL que
+   pide la página de recomendaciones.
+3. Las obras de los autores de los libros con más favoritos, que van al
+   catálogo y al índice de autores (`ObrasAutor`).
+
+Las peticiones salen en lotes de PRECALENTAR_LOTE por `obtener_json_concurrente`
+con el limitador de cada API, así que respetan las mismas cuotas que los
+workers. Tras cada lote se escribe el progreso en PRECALENTAR_DIR; si el
+proceso se interrumpe, la siguiente ejecución con los mismos parámetros
+continúa donde se quedó.
+"""
+import json
+import os
+import time
+from collections import Counter
+from itertools import groupby
+from operator import attrgetter
+from typing import Callable, NamedTuple
+
+from django.conf import settings
+from django.db.models import Count
+
+from . import catalogo, recomendaciones
+from .fanout import obtener_json_concurrente
+from .http_cache import cache_respuestas, normalizar_url
+from .models import Favorito
+from .ratelimit import JIKAN_LIMITER, OPENLIBRARY_LIMITER
+
+# Listados de Jikan: (nombre, ruta, parámetros fijos)
+LISTADOS = [
+    ('top', '/top/anime', {}),
+    ('temporada', '/seasons/now', {}),
+    ('populares', '/top/anime', {'filter': 'bypopularity'}),
+]
+
+# Limitador y ajuste con los hilos de cada endpoint de la caché
+_APIS = {
+    'jikan_listado': (JIKAN_LIMITER, 'JIKAN_MAX_WORKERS'),
+    'jikan_recomendaciones': (JIKAN_LIMITER, 'JIKAN_MAX_WORKERS'),
+    'openlibrary_autor': (OPENLIBRARY_LIMITER, 'OPENLIBRARY_MAX_WORKERS'),
+}
+
+
+class Tarea(NamedTuple):
+    clave: str  # Identifica la tarea en el archivo de progreso
+    fase: str
+    endpoint: str  # Endpoint de la caché de respuestas
+    url: str
+    incorporar: Callable  # Recibe el JSON descargado o de la caché
+
+
+def _guardar_animes(data):
+    registros = [catalogo.normalizar_anime(anime) for anime in data.get('data', [])]
+    catalogo.guardar('anime', [r for r in registros if isinstance(r['mal_id'], int)])
+
+
+def _mas_favoritos(tipo_contenido, limite, campos=('contenido_id',)):
+    return (Favorito.objects.filter(tipo_contenido=tipo_contenido).values(*campos)
+            .annotate(usuarios=Count('usuario')).order_by('-usuarios', *campos)[:limite])
+
+
+def planificar(paginas, favoritos):
+    """Lista de `Tarea`s: `paginas` de cada listado y los `favoritos` animes y libros más populares."""
+    tareas = []
+    for nombre, ruta, params in LISTADOS:
+        for pagina in range(1, paginas + 1):
+            tareas.append(Tarea(f'{nombre}:{pagina}', 'listados', 'jikan_listado',
+                                normalizar_url(settings.JIKAN_API_URL + ruta, {**params, 'page': pagina}),
+                                _guardar_animes))
+
+    for fila in _mas_favoritos('anime', favoritos):
+        contenido_id = fila['contenido_id']
+        # La página de recomendaciones lee esta misma respuesta de la caché
+        tareas.append(Tarea(f'recomendaciones:{contenido_id}', 'recomendaciones', 'jikan_recomendaciones',
+                            recomendaciones.url_recomendaciones_jikan(contenido_id), lambda data: None))
+
+    fuentes = []
+    for fila in _mas_favoritos('libro', favoritos, ('contenido_id', 'autor', 'autor_key')):
+        fuente = recomendaciones.fuente_obras(Favorito(autor=fila['autor'], autor_key=fila['autor_key']))
+        if fuente is not None and fuente not in fuentes:
+            fuentes.append(fuente)
+    indexados = catalogo.obras_de_autores([f for f in fuentes if isinstance(f, str)])
+    for fuente in fuentes:
+        if fuente in indexados:
+            continue
+        clave = f'autor:{fuente}' if isinstance(fuente, str) else f'autor-nombre:{fuente[1]}'
+        tareas.append(Tarea(clave, 'autores', 'openlibrary_autor', recomendaciones.url_obras(fuente),
+                            lambda data, fuente=fuente: recomendaciones.incorporar_obras(fuente, data)))
+    return tareas
+
+
+class Progreso:
+    """Claves de las tareas terminadas, en un archivo JSON de PRECALENTAR_DIR."""
+
+    def __init__(self, parametros, reiniciar=False):
+        self.ruta = os.path.join(settings.PRECALENTAR_DIR, 'progreso.json')
+        self.parametros = parametros
+        self.hechas = set()
+        self.inicio = time.time()
+        if reiniciar:
+            return
+        try:
+            with open(self.ruta) as archivo:
+                guardado = json.load(archivo)
+        except (OSError, ValueError):
+            return
+        # Otro recorrido, o uno tan antiguo que lo que calentó ya puede haber caducado
+        if guardado.get('parametros') == parametros and time.time() - guardado['inicio'] < settings.PRECALENTAR_REANUDAR_MAX:
+            self.hechas = set(guardado['hechas'])
+            self.inicio = guardado['inicio']
+
+    def guardar(self):
+        os.makedirs(settings.PRECALENTAR_DIR, exist_ok=True)
+        with open(self.ruta + '.tmp', 'w') as archivo:
+            json.dump({'parametros': self.parametros, 'inicio': self.inicio, 'hechas': sorted(self.hechas)}, archivo)
+        os.replace(self.ruta + '.tmp', self.ruta)
+
+    def terminar(self):
+        try:
+            os.remove(self.ruta)
+        except FileNotFoundError:
+            pass
+
+
+def _ejecutar_lote(lote):
+    """Resuelve un lote del mismo endpoint; devuelve `(hechas, resumen)`."""
+    endpoint = lote[0].endpoint
+    limitador, max_workers = _APIS[endpoint]
+    por_clave = {tarea.clave: tarea for tarea in lote}
+    resultados, urls_pendientes = cache_respuestas.obtener_varios(endpoint, {t.clave: t.url for t in lote})
+    descargados, errores, pendientes = obtener_json_concurrente(
+        urls_pendientes, limitador, presupuesto=settings.PRECALENTAR_PRESUPUESTO,
+        max_workers=getattr(settings, max_workers),
+    )
+    cache_respuestas.guardar_varios(endpoint, {urls_pendientes[clave]: data for clave, data in descargados.items()})
+    resultados.update(descargados)
+    for clave, data in resultados.items():
+        por_clave[clave].incorporar(data)
+    resumen = Counter(en_cache=len(lote) - len(urls_pendientes), descargadas=len(descargados),
+                      errores=len(errores), pendientes=len(pendientes))
+    return set(resultados), resumen
+
+
+def precalentar(tareas, progreso, avisar=None):
+    """
+    Ejecuta las `tareas` que `progreso` no tiene como hechas, guardando el
+    progreso tras cada lote. Llama a `avisar(fase, resumen)` tras cada lote y
+    devuelve el resumen total: Counter con `en_cache`, `descargadas`,
+    `errores`, `pendientes` y `omitidas` (hechas en una ejecución anterior).
+    """
+    resumen = Counter(omitidas=sum(1 for t in tareas if t.clave in progreso.hechas))
+    restantes = [t for t in tareas if t.clave not in progreso.hechas]
+    # Los lotes no mezclan endpoints: cada uno va con el limitador de su API
+    for _, grupo in groupby(restantes, key=attrgetter('endpoint')):
+        grupo = list(grupo)
+        for i in range(0, len(grupo), settings.PRECALENTAR_LOTE):
+            lote = grupo[i:i + settings.PRECALENTAR_LOTE]
+            hechas, parcial = _ejecutar_lote(lote)
+            progreso.hechas |= hechas
+            progreso.guardar()
+            resumen.update(parcial)
+            if avisar is not None:
+                avisar(lote[0].fase, resumen)
+    if not resumen['errores'] and not resumen['pendientes']:
+        progreso.terminar()
+    return resumen
@@ -0,0 +1,184 @@
+"""
+Limitadores de tasa para las APIs externas (Jikan, OpenLibrary).
+
+Cada host tiene un `RateLimiter` con una o varias cubetas de tokens. Si se le
+da un archivo, el estado de las cubetas vive en él y se actualiza bajo un
+cerrojo fcntl, de modo que todos los workers del contenedor comparten la
+misma cuota en lugar de multiplicarla por el número de procesos. Un 429 con
+`Retry-After` se comunica con `penalizar()`: nadie vuelve a pedir a ese host
+hasta que pase ese tiempo.
+"""
+import asyncio
+import contextlib
+import os
+import struct
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Sin fcntl (Windows) cada proceso lleva su propia cuota
+    fcntl = None
+
+
+class TokenBucket:
+    """Cubeta de tokens: `capacidad` tokens que se rellenan a razón de `tasa` por segundo."""
+
+    def __init__(self, tasa, capacidad):
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad)
+        self._tokens = float(capacidad)
+        self._ultimo = time.monotonic()
+
+    def _rellenar(self, ahora):
+        transcurrido = ahora - self._ultimo
+        if transcurrido > 0:
+            self._tokens = min(self.capacidad, self._tokens + transcurrido * self.tasa)
+            self._ultimo = ahora
+
+    def espera(self, ahora):
+        """Segundos que faltan para que haya un token disponible (0 si ya lo hay)."""
+        self._rellenar(ahora)
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.tasa
+
+    def consumir(self):
+        self._tokens -= 1
+
+    def vaciar(self, ahora):
+        self._rellenar(ahora)
+        self._tokens = min(self._tokens, 0.0)
+
+
+class RateLimiter:
+    """
+    Agrupa varias cubetas (p. ej. por segundo y por minuto) y solo concede
+    un permiso cuando todas tienen saldo. Es seguro entre hilos y, con
+    `archivo`, también entre procesos.
+    """
+
+    def __init__(self, *cubetas, archivo=None):
+        self.cubetas = cubetas
+        self.archivo = archivo
+        self._bloqueado_hasta = 0.0
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+        # Estado en disco: (tokens, último relleno) de cada cubeta y el fin del bloqueo por Retry-After
+        self._formato = struct.Struct(f'<{2 * len(cubetas) + 1}d')
+
+    @classmethod
+    def desde_limites(cls, limites, archivo=None):
+        """Construye el limitador a partir de pares (peticiones, periodo_en_segundos)."""
+        return cls(*(TokenBucket(peticiones / periodo, peticiones) for peticiones, periodo in limites), archivo=archivo)
+
+    def _descriptor(self):
+        # Un descriptor por proceso: tras un fork el heredado compartiría el cerrojo con el padre
+        if self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.archivo), exist_ok=True)
+            self._fd = os.open(self.archivo, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    @contextlib.contextmanager
+    def _estado(self):
+        """Bloquea el limitador (hilos y, si hay archivo, procesos) con el estado compartido cargado."""
+        with self._lock:
+            if self.archivo is None or fcntl is None or not settings.RATELIMIT_ENTRE_PROCESOS:
+                yield
+                return
+            fd = self._descriptor()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                datos = os.pread(fd, self._formato.size, 0)
+                if len(datos) == self._formato.size:
+                    valores = self._formato.unpack(datos)
+                    # CLOCK_MONOTONIC es común a todos los procesos de la máquina, pero vuelve
+                    # a empezar al reiniciarla: un estado "del futuro" es de antes y se descarta
+                    ahora = time.monotonic()
+                    if (max(valores[1:-1:2], default=0) <= ahora
+                            and valores[-1] <= ahora + settings.RATELIMIT_RETRY_AFTER_MAX):
+                        for i, cubeta in enumerate(self.cubetas):
+                            cubeta._tokens, cubeta._ultimo = valores[2 * i], valores[2 * i + 1]
+                        self._bloqueado_hasta = valores[-1]
+                yield
+                valores = [v for cubeta in self.cubetas for v in (cubeta._tokens, cubeta._ultimo)]
+                os.pwrite(fd, self._formato.pack(*valores, self._bloqueado_hasta), 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def intentar(self):
+        """
+        Versión que no bloquea: consume un permiso si lo hay y devuelve 0; si
+        no, devuelve los segundos que faltan sin consumir nada.
+        """
+        with self._estado():
+            ahora = time.monotonic()
+            espera = max([self._bloqueado_hasta - ahora, 0.0] + [cubeta.espera(ahora) for cubeta in self.cubetas])
+            if espera == 0:
+                for cubeta in self.cubetas:
+                    cubeta.consumir()
+            return espera
+
+    def penalizar(self, segundos):
+        """El host pidió esperar `segundos` (429 con Retry-After): nadie recibe permisos hasta entonces."""
+        with self._estado():
+            ahora = time.monotonic()
+            self._bloqueado_hasta = max(self._bloqueado_hasta, ahora + segundos)
+            for cubeta in self.cubetas:
+                cubeta.vaciar(ahora)
+
+    def acquire(self, timeout=None):
+        """
+        Bloquea hasta obtener un permiso. Devuelve False si no se puede
+        conseguir antes de `timeout` segundos (con `timeout=0` no espera).
+        """
+        limite = None if timeout is None else time.monotonic() + timeout
+        while True:
+            espera = self.intentar()
+            if espera == 0:
+                return True
+            if limite is not None and time.monotonic() + espera > limite:
+                return False
+            time.sleep(espera)
+
+    async def aacquire(self, timeout=None):
+        """
+        Como `acquire()`, pero cede el bucle de eventos mientras espera (el
+        cerrojo del archivo solo se retiene lo que tarda leer y escribir el estado).
+        """
+        limite = None if timeout is None else time.monotonic() + timeout
+        while True:
+            espera = self.intentar()
+            if espera == 0:
+                return True
+            if limite is not None and time.monotonic() + espera > limite:
+                return False
+            await asyncio.sleep(espera)
+
+
+def _limitador(nombre, limites):
+    return RateLimiter.desde_limites(limites, archivo=os.path.join(settings.RATELIMIT_DIR, f'{nombre}.bucket'))
+
+
+# Cuota de Jikan: 3 peticiones/segundo y 60 peticiones/minuto
+JIKAN_LIMITER = _limitador('jikan', settings.JIKAN_RATE_LIMITS)
+OPENLIBRARY_LIMITER = _limitador('openlibrary', settings.OPENLIBRARY_RATE_LIMITS)
+
+# Ajuste con la URL base de cada API -> su limitador
+LIMITADORES = {
+    'JIKAN_API_URL': JIKAN_LIMITER,
+    'OPENLIBRARY_URL': OPENLIBRARY_LIMITER,
+}
+
+
+def para_host(host):
+    """Limitador de `host`, o None si sus peticiones no se limitan."""
+    for ajuste, limitador in LIMITADORES.items():
+        if urlsplit(getattr(settings, ajuste)).netloc == host:
+            return limitador
+    return None
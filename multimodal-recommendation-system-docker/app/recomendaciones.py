@@ -0,0 +1,260 @@
+"""
+Cálculo de las páginas de recomendaciones de animes y libros.
+
+Aquí vive todo el trabajo caro (filtrado colaborativo, índice vectorial y, si
+hace falta, llamadas a Jikan/OpenLibrary). El resultado es un dict
+serializable en JSON que `snapshots` guarda por usuario y tipo de contenido.
+"""
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from . import catalogo, embeddings, recomendador
+from .fanout import obtener_json_concurrente
+from .http_cache import cache_respuestas, normalizar_url
+from .items import AUTOR_DESCONOCIDO, CAMPOS_OPENLIBRARY
+from .models import Favorito
+from .ratelimit import JIKAN_LIMITER, OPENLIBRARY_LIMITER
+
+
+def _recomendaciones_cruzadas(origen, tipo_destino, excluir):
+    """Grupos "porque te gustó X" del otro tipo de contenido, desde el índice vectorial (sin red)."""
+    favoritos = [(f.tipo_contenido, f.contenido_id, f.contenido_titulo) for f in origen[:settings.EMBEDDINGS_FAVORITOS_ORIGEN]]
+    grupos = embeddings.porque_te_gusto(favoritos, tipo_destino, excluir=excluir)
+    registros = catalogo.registros(tipo_destino, {c for _, similares in grupos for c, _ in similares})
+    return [
+        [titulo, [registros[c] for c, _ in similares if c in registros]]
+        for titulo, similares in grupos
+    ]
+
+
+def ordenar_por_votos(votos, edades_dias, k):
+    """
+    Índices de los `k` mejores candidatos, de mayor a menor puntuación.
+
+    `votos` es la matriz candidato×favorito de votos de Jikan (NaN donde el
+    favorito no recomienda al candidato) y `edades_dias` la antigüedad de cada
+    favorito. Cada recomendación aporta `1 + log1p(votos)` ponderado por la
+    recencia del favorito (vida media RECOMENDACIONES_VIDA_MEDIA_DIAS), y los
+    candidatos que recomiendan varios favoritos se multiplican por
+    `1 + RECOMENDACIONES_PESO_FUENTES × (fuentes - 1)`. Los empates conservan
+    el orden de los candidatos.
+    """
+    presentes = ~np.isnan(votos)
+    pesos = np.exp2(-np.asarray(edades_dias, dtype=np.float64) / settings.RECOMENDACIONES_VIDA_MEDIA_DIAS)
+    aportes = np.where(presentes, 1 + np.log1p(np.nan_to_num(votos).clip(min=0)), 0.0)
+    scores = (aportes @ pesos) * (1 + settings.RECOMENDACIONES_PESO_FUENTES * (presentes.sum(axis=1) - 1))
+    if len(scores) > k:
+        mejores = np.argpartition(-scores, k - 1)[:k]
+    else:
+        mejores = np.arange(len(scores))
+    return mejores[np.lexsort((mejores, -scores[mejores]))]
+
+
+def _recomendaciones_jikan(user_favoritos, resultados, excluir, k):
+    """Animes recomendados por Jikan para los favoritos, ordenados por `ordenar_por_votos`."""
+    ahora = timezone.now()
+    fuentes = [f for f in user_favoritos if f.contenido_id in resultados]
+    candidatos, entradas, filas, columnas, votos = {}, [], [], [], []
+    for columna, favorito in enumerate(fuentes):
+        for rec_item in resultados[favorito.contenido_id].get('data', []):
+            anime_entry = rec_item.get('entry')
+            if not anime_entry or not anime_entry.get('mal_id'):
+                continue
+            mal_id = anime_entry['mal_id']
+            if str(mal_id) in excluir:
+                continue
+            fila = candidatos.get(mal_id)
+            if fila is None:
+                fila = candidatos[mal_id] = len(entradas)
+                entradas.append(anime_entry)
+            filas.append(fila)
+            columnas.append(columna)
+            votos.append(rec_item.get('votes') or 0)
+    if not entradas or k <= 0:
+        return []
+
+    matriz = np.full((len(entradas), len(fuentes)), np.nan)
+    np.fmax.at(matriz, (filas, columnas), votos)  # Si un favorito repite candidato, cuenta el mayor voto
+    edades = [(ahora - f.fecha_agregado).total_seconds() / 86400 for f in fuentes]
+    return [catalogo.normalizar_anime(entradas[i]) for i in ordenar_por_votos(matriz, edades, k)]
+
+
+def _recomendaciones_anime(usuario_id, user_favoritos):
+    recomendaciones_dict = {}
+    error_api = None
+
+    favoritos_ids = {favorito.contenido_id for favorito in user_favoritos}
+
+    # Vecinos precalculados del filtrado colaborativo: sin llamadas a la red
+    recomendados = recomendador.recomendar(usuario_id, 'anime')
+    registros = catalogo.registros('anime', [contenido_id for contenido_id, _ in recomendados])
+    for contenido_id, _ in recomendados:
+        if contenido_id in registros:
+            recomendaciones_dict[registros[contenido_id]['mal_id']] = registros[contenido_id]
+
+    if len(recomendaciones_dict) < settings.RECOMENDADOR_MIN_RESULTADOS:
+        # Pedimos las recomendaciones de todos los favoritos en paralelo, respetando
+        # la cuota de Jikan (~3 req/seg, 60 req/min) y el presupuesto de tiempo
+        urls = {favorito.contenido_id: url_recomendaciones_jikan(favorito.contenido_id) for favorito in user_favoritos}
+        # Solo salen a la red los favoritos que no están en la caché de respuestas
+        resultados, urls_pendientes = cache_respuestas.obtener_varios('jikan_recomendaciones', urls)
+        descargados, errores, pendientes = obtener_json_concurrente(
+            urls_pendientes,
+            JIKAN_LIMITER,
+            presupuesto=settings.RECOMENDACIONES_PRESUPUESTO,
+            max_workers=settings.JIKAN_MAX_WORKERS,
+        )
+        cache_respuestas.guardar_varios('jikan_recomendaciones', {urls_pendientes[clave]: data for clave, data in descargados.items()})
+        resultados.update(descargados)
+
+        # Los candidatos de Jikan se ordenan por votos, favoritos que los recomiendan y recencia
+        faltan = settings.RECOMENDACIONES_ANIME_MAX - len(recomendaciones_dict)
+        excluir = favoritos_ids | {str(mal_id) for mal_id in recomendaciones_dict}
+        for anime in _recomendaciones_jikan(user_favoritos, resultados, excluir, faltan):
+            recomendaciones_dict[anime['mal_id']] = anime
+
+        if errores:
+            error_api = f"Error al obtener recomendaciones de la API de Jikan: {next(iter(errores.values()))}. Algunas recomendaciones podrían faltar."
+        elif pendientes:
+            error_api = "La API de Jikan tardó demasiado en responder. Algunas recomendaciones podrían faltar."
+
+    return list(recomendaciones_dict.values()), error_api
+
+
+def url_recomendaciones_jikan(contenido_id):
+    return f"{settings.JIKAN_API_URL}/anime/{contenido_id}/recommendations"
+
+
+def fuente_obras(favorito):
+    """`autor_key` del favorito, ('nombre', autor) si no la tiene, o None si no hay autor."""
+    if favorito.autor_key:
+        return favorito.autor_key
+    if favorito.autor and favorito.autor != AUTOR_DESCONOCIDO:
+        return ('nombre', favorito.autor)
+    return None
+
+
+def url_obras(fuente):
+    """Búsqueda en OpenLibrary de las obras de una fuente de `fuente_obras()`."""
+    return normalizar_url(f"{settings.OPENLIBRARY_URL}/search.json", {
+        'limit': settings.OBRAS_POR_AUTOR, 'fields': CAMPOS_OPENLIBRARY,
+        **({'author_key': fuente} if isinstance(fuente, str) else {'author': fuente[1]}),
+    })
+
+
+def incorporar_obras(fuente, data, usuario_id=None):
+    """
+    Guarda en el catálogo y el índice de autores las obras recibidas de
+    `url_obras(fuente)`; devuelve sus work_id. En una búsqueda por nombre con
+    `usuario_id` completa la clave del autor en los favoritos de ese usuario.
+    """
+    registros = [catalogo.normalizar_libro(d) for d in data.get('docs', []) if d.get('key')]
+    if isinstance(fuente, str):
+        autor_key = fuente
+    else:
+        # Búsqueda por nombre: la clave del autor es la que más se repite en los resultados
+        claves = [r['author_key'] for r in registros if r['author_key']]
+        autor_key = max(claves, key=claves.count) if claves else None
+        # Solo los del usuario: el mismo nombre en otra cuenta puede ser otro autor
+        if autor_key and usuario_id is not None:
+            Favorito.objects.filter(usuario_id=usuario_id, tipo_contenido='libro', autor=fuente[1],
+                                    autor_key__isnull=True).update(autor_key=autor_key)
+    if autor_key:
+        catalogo.indexar_obras(autor_key, registros)
+    else:
+        catalogo.guardar('libro', registros)
+    return [r['work_id'] for r in registros]
+
+
+def _obras_de_autores(usuario_id, user_favoritos_libros):
+    """
+    (fuentes, obras, error_api): los autores de los favoritos, del favorito más
+    reciente al más antiguo, y {fuente: [work_id, ...]} desde el índice de
+    autores. Los autores que faltan en el índice se piden a OpenLibrary en
+    paralelo dentro del presupuesto de la página. Los favoritos antiguos sin
+    `autor_key` se buscan por nombre y se completa su clave.
+    """
+    fuentes = []
+    for favorito in user_favoritos_libros:
+        fuente = fuente_obras(favorito)
+        if fuente is not None and fuente not in fuentes:
+            fuentes.append(fuente)
+
+    obras = catalogo.obras_de_autores([f for f in fuentes if isinstance(f, str)])
+    urls = {fuente: url_obras(fuente) for fuente in fuentes if fuente not in obras}
+    resultados, urls_pendientes = cache_respuestas.obtener_varios('openlibrary_autor', urls)
+    descargados, errores, pendientes = obtener_json_concurrente(
+        urls_pendientes,
+        OPENLIBRARY_LIMITER,
+        presupuesto=settings.RECOMENDACIONES_PRESUPUESTO,
+        max_workers=settings.OPENLIBRARY_MAX_WORKERS,
+    )
+    cache_respuestas.guardar_varios('openlibrary_autor', {urls_pendientes[clave]: data for clave, data in descargados.items()})
+    resultados.update(descargados)
+
+    for fuente, data in resultados.items():
+        obras[fuente] = incorporar_obras(fuente, data, usuario_id)
+
+    error_api = None
+    if errores:
+        error_api = f"Error al obtener recomendaciones de la API de OpenLibrary: {next(iter(errores.values()))}. Algunas recomendaciones podrían faltar."
+    elif pendientes:
+        error_api = "La API de OpenLibrary tardó demasiado en responder. Algunas recomendaciones podrían faltar."
+    return fuentes, obras, error_api
+
+
+def _recomendaciones_libros(usuario_id, user_favoritos_libros):
+    recomendaciones_list = []
+    error_api = None
+
+    favoritos_ids = {favorito.contenido_id for favorito in user_favoritos_libros}
+
+    # Vecinos precalculados del filtrado colaborativo: sin llamadas a la red
+    recomendados = recomendador.recomendar(usuario_id, 'libro')
+    registros = catalogo.registros('libro', [contenido_id for contenido_id, _ in recomendados])
+    for contenido_id, _ in recomendados:
+        if contenido_id in registros:
+            recomendaciones_list.append(registros[contenido_id])
+
+    if len(recomendaciones_list) < settings.RECOMENDADOR_MIN_RESULTADOS:
+        # Más libros de los autores de todos los favoritos, repartidos por turnos entre autores
+        fuentes, obras, error_api = _obras_de_autores(usuario_id, user_favoritos_libros)
+        registros = catalogo.registros('libro', {w for lista in obras.values() for w in lista})
+        listas = [[w for w in obras.get(fuente, []) if w not in favoritos_ids and w in registros] for fuente in fuentes]
+        for posicion in range(max(map(len, listas), default=0)):
+            recomendaciones_list.extend(registros[lista[posicion]] for lista in listas if posicion < len(lista))
+
+    # Eliminar duplicados y limitar resultados
+    seen_ids = set()
+    recomendaciones_unicas = []
+    for libro in recomendaciones_list:
+        if libro['work_id'] not in seen_ids:
+            seen_ids.add(libro['work_id'])
+            recomendaciones_unicas.append(libro)
+            if len(recomendaciones_unicas) >= settings.RECOMENDACIONES_LIBROS_MAX:
+                break
+
+    return recomendaciones_unicas, error_api
+
+
+def calcular(usuario_id, tipo_contenido):
+    """
+    Recomendaciones de `tipo_contenido` para el usuario, más los grupos
+    "porque te gustó" del otro tipo. Devuelve un dict con `recomendaciones`,
+    `cruzadas`, `error_api` y `sin_favoritos`.
+    """
+    # Una sola consulta para los favoritos de ambos tipos, los más recientes primero
+    favoritos = list(Favorito.objects.filter(usuario_id=usuario_id).order_by('-fecha_agregado'))
+    user_favoritos = [f for f in favoritos if f.tipo_contenido == tipo_contenido]
+    origen = [f for f in favoritos if f.tipo_contenido != tipo_contenido]
+    cruzadas = _recomendaciones_cruzadas(
+        origen, tipo_contenido, excluir=[favorito.contenido_id for favorito in user_favoritos])
+    if not user_favoritos:
+        return {'recomendaciones': [], 'cruzadas': cruzadas, 'error_api': None, 'sin_favoritos': True}
+
+    if tipo_contenido == 'anime':
+        recomendaciones, error_api = _recomendaciones_anime(usuario_id, user_favoritos)
+    else:
+        recomendaciones, error_api = _recomendaciones_libros(usuario_id, user_favoritos)
+    return {'recomendaciones': recomendaciones, 'cruzadas': cruzadas, 'error_api': error_api, 'sin_favoritos': False}
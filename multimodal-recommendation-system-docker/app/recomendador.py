@@ -0,0 +1,315 @@
+"""
+Filtrado colaborativo item-item sobre la tabla Favorito.
+
+`construir_modelo()` arma la matriz dispersa usuario x item, calcula las
+similitudes item-item (coseno o Jaccard) y guarda los `k` mejores vecinos de
+cada item en `SimilitudItem`. Las vistas consultan esos vecinos a través de
+`recomendar()`, que los mantiene en memoria del proceso; el número de
+generación en la caché compartida indica cuándo hay que descartarlos todos, y
+la versión de cada item en `VersionVecinos`, cuándo hay que recargar solo los
+suyos (una sola consulta por llamada, en lugar de una lectura de disco por item).
+
+Cuando un usuario añade o quita un favorito, `actualizar_favorito()` recalcula
+solo los vecinos del item afectado y ajusta la lista de candidatos del usuario,
+sin reconstruir la matriz completa.
+"""
+import threading
+import uuid
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Window
+from django.db.models.functions import RowNumber
+from scipy import sparse
+
+from .models import Favorito, SimilitudItem, VersionVecinos
+
+CLAVE_GENERACION = 'recomendador:generacion'
+CLAVE_CANDIDATOS = 'recomendador:candidatos:{usuario_id}'
+CLAVE_PARAMETROS = 'recomendador:parametros'  # k, métrica y corte del último construir_modelo()
+
+_vecinos = {}  # (tipo, id) -> (versión, [(vecino_tipo, vecino_id, score), ...])
+_generacion = None
+_lock = threading.Lock()
+
+
+def construir_matriz():
+    """
+    Matriz CSR binaria usuario x item a partir de Favorito. Devuelve
+    `(matriz, items)`, donde `items[j]` es el par (tipo_contenido, contenido_id)
+    de la columna j.
+    """
+    usuarios, items = {}, {}
+    filas, columnas = [], []
+    favoritos = Favorito.objects.values_list('usuario_id', 'tipo_contenido', 'contenido_id')
+    for usuario_id, tipo, contenido_id in favoritos.iterator(chunk_size=5000):
+        filas.append(usuarios.setdefault(usuario_id, len(usuarios)))
+        columnas.append(items.setdefault((tipo, contenido_id), len(items)))
+    datos = np.ones(len(filas), dtype=np.float32)
+    matriz = sparse.csr_matrix(
+        (datos, (np.array(filas, dtype=np.int32), np.array(columnas, dtype=np.int32))),
+        shape=(len(usuarios), len(items)),
+    )
+    return matriz, list(items)
+
+
+def _puntuar(co, n_a, n_b, metrica):
+    """Similitud de dos items con `co` usuarios en común y `n_a`, `n_b` usuarios cada uno (escalares o arrays)."""
+    if metrica == 'jaccard':
+        return co / (n_a + n_b - co)
+    return co / np.sqrt(n_a * n_b)
+
+
+def similitudes(matriz, metrica='coseno'):
+    """
+    Matrices CSR item x item con las similitudes (sin diagonal) y las
+    coocurrencias de las que salen; ambas comparten estructura.
+    """
+    coocurrencias = sparse.coo_matrix(matriz.T @ matriz)
+    conteos = np.asarray(matriz.sum(axis=0)).ravel()
+    fuera_diagonal = coocurrencias.row != coocurrencias.col
+    filas = coocurrencias.row[fuera_diagonal]
+    columnas = coocurrencias.col[fuera_diagonal]
+    co = coocurrencias.data[fuera_diagonal]
+    scores = _puntuar(co, conteos[filas], conteos[columnas], metrica)
+    forma = (len(conteos), len(conteos))
+    scores = sparse.csr_matrix((scores.astype(np.float32), (filas, columnas)), shape=forma)
+    co = sparse.csr_matrix((co.astype(np.int32), (filas, columnas)), shape=forma)
+    return scores, co
+
+
+def top_k(scores, k):
+    """
+    Para cada fila de una CSR, las posiciones (en `scores.data` /
+    `scores.indices`) de sus `k` mejores valores, de mayor a menor.
+    """
+    posiciones = []
+    for i in range(scores.shape[0]):
+        inicio, fin = scores.indptr[i], scores.indptr[i + 1]
+        datos = scores.data[inicio:fin]
+        if len(datos) > k:
+            mejores = np.argpartition(-datos, k - 1)[:k]
+        else:
+            mejores = np.arange(len(datos))
+        posiciones.append(inicio + mejores[np.argsort(-datos[mejores], kind='stable')])
+    return posiciones
+
+
+def parametros():
+    """{k, metrica, min_coocurrencias} con los que se construyó el modelo; los de settings si no consta."""
+    return cache.get(CLAVE_PARAMETROS) or {
+        'k': settings.RECOMENDADOR_K, 'metrica': settings.RECOMENDADOR_METRICA,
+        'min_coocurrencias': settings.RECOMENDADOR_MIN_COOCURRENCIAS,
+    }
+
+
+def construir_modelo(k=None, metrica=None, min_coocurrencias=None):
+    """
+    Recalcula todos los vecinos y los guarda. Los parámetros que no se pasan
+    salen de settings; los usados quedan en la caché compartida para que las
+    actualizaciones incrementales puntúen igual. Devuelve el número de filas escritas.
+    """
+    k = k or settings.RECOMENDADOR_K
+    metrica = metrica or settings.RECOMENDADOR_METRICA
+    min_coocurrencias = settings.RECOMENDADOR_MIN_COOCURRENCIAS if min_coocurrencias is None else min_coocurrencias
+    matriz, items = construir_matriz()
+    scores, coocurrencias = similitudes(matriz, metrica)
+    filas = []
+    for i, posiciones in enumerate(top_k(scores, k)):
+        tipo, contenido_id = items[i]
+        for p in posiciones:
+            co = int(coocurrencias.data[p])
+            if co < min_coocurrencias:
+                continue
+            vecino_tipo, vecino_id = items[scores.indices[p]]
+            filas.append(SimilitudItem(
+                tipo_contenido=tipo, contenido_id=contenido_id,
+                vecino_tipo=vecino_tipo, vecino_id=vecino_id,
+                score=float(scores.data[p]), coocurrencias=co,
+            ))
+    with transaction.atomic():
+        SimilitudItem.objects.all().delete()
+        SimilitudItem.objects.bulk_create(filas, batch_size=2000)
+    cache.set(CLAVE_PARAMETROS, {'k': k, 'metrica': metrica, 'min_coocurrencias': min_coocurrencias}, timeout=None)
+    invalidar()
+    return len(filas)
+
+
+def invalidar():
+    """Avisa a todos los procesos de que deben descartar los vecinos que tengan en memoria."""
+    if not cache.add(CLAVE_GENERACION, 1, timeout=None):
+        cache.incr(CLAVE_GENERACION)
+
+
+def vecinos(items):
+    """{(tipo, id): [(vecino_tipo, vecino_id, score), ...]} para los items pedidos."""
+    global _generacion
+    generacion = cache.get(CLAVE_GENERACION)
+    versiones = dict.fromkeys(items)
+    if items:
+        filas = VersionVecinos.objects.filter(
+            tipo_contenido__in={tipo for tipo, _ in items},
+            contenido_id__in={contenido_id for _, contenido_id in items},
+        ).values_list('tipo_contenido', 'contenido_id', 'version')
+        for tipo, contenido_id, version in filas:
+            if (tipo, contenido_id) in versiones:
+                versiones[(tipo, contenido_id)] = version
+    with _lock:
+        if generacion != _generacion:
+            _vecinos.clear()
+            _generacion = generacion
+        faltan = [item for item in items if item not in _vecinos or _vecinos[item][0] != versiones[item]]
+    if faltan:
+        cargados = {item: (versiones[item], []) for item in faltan}
+        filas = SimilitudItem.objects.filter(
+            tipo_contenido__in={tipo for tipo, _ in faltan},
+            contenido_id__in={contenido_id for _, contenido_id in faltan},
+        ).order_by('-score').values_list('tipo_contenido', 'contenido_id', 'vecino_tipo', 'vecino_id', 'score')
+        for tipo, contenido_id, vecino_tipo, vecino_id, score in filas:
+            if (tipo, contenido_id) in cargados:
+                cargados[(tipo, contenido_id)][1].append((vecino_tipo, vecino_id, score))
+        with _lock:
+            _vecinos.update(cargados)
+    with _lock:
+        return {item: _vecinos[item][1] if item in _vecinos else [] for item in items}
+
+
+def _candidatos(favoritos):
+    """Suma de similitudes por vecino: {(tipo, id): score}."""
+    acumulado = {}
+    for lista in vecinos(favoritos).values():
+        for vecino_tipo, vecino_id, score in lista:
+            clave = (vecino_tipo, vecino_id)
+            acumulado[clave] = acumulado.get(clave, 0.0) + score
+    return acumulado
+
+
+def _estado_usuario(usuario_id):
+    """Favoritos y candidatos del usuario, desde la caché compartida o calculados."""
+    clave = CLAVE_CANDIDATOS.format(usuario_id=usuario_id)
+    estado = cache.get(clave)
+    if estado is None:
+        favoritos = set(Favorito.objects.filter(usuario_id=usuario_id).values_list('tipo_contenido', 'contenido_id'))
+        estado = {'favoritos': favoritos, 'candidatos': _candidatos(list(favoritos))}
+        cache.set(clave, estado, settings.RECOMENDADOR_CANDIDATOS_TTL)
+    return estado
+
+
+def olvidar_candidatos(usuario_id):
+    """Descarta la lista de candidatos del usuario; se recalcula en la próxima recomendación."""
+    cache.delete(CLAVE_CANDIDATOS.format(usuario_id=usuario_id))
+
+
+def recomendar(usuario_id, tipo_destino, limite=12):
+    """
+    Suma las similitudes de los vecinos de todos los favoritos del usuario y
+    devuelve los `limite` mejores `(contenido_id, score)` de `tipo_destino`
+    que no estén ya en favoritos. La lista de candidatos del usuario queda en
+    la caché compartida y `actualizar_favorito()` la ajusta en cada cambio.
+    """
+    estado = _estado_usuario(usuario_id)
+    mejores = [
+        (vecino_id, score) for (vecino_tipo, vecino_id), score in estado['candidatos'].items()
+        if vecino_tipo == tipo_destino and (vecino_tipo, vecino_id) not in estado['favoritos'] and score > 1e-9
+    ]
+    return sorted(mejores, key=lambda par: par[1], reverse=True)[:limite]
+
+
+def _recalcular_item(tipo, contenido_id, k, metrica, min_coocurrencias):
+    """
+    Recalcula las similitudes de un item con todos los items que comparten
+    algún usuario con él (sus únicos vecinos posibles), con la misma métrica y
+    corte que `construir_modelo()`, y reescribe sus filas y las filas
+    inversas. Devuelve la nueva lista de vecinos y los items cuyas filas cambiaron.
+    """
+    usuarios = Favorito.objects.filter(tipo_contenido=tipo, contenido_id=contenido_id).values('usuario_id')
+    coocurrencias = {
+        (fila['tipo_contenido'], fila['contenido_id']): fila['co']
+        for fila in Favorito.objects.filter(usuario_id__in=usuarios)
+        .exclude(tipo_contenido=tipo, contenido_id=contenido_id)
+        .values('tipo_contenido', 'contenido_id').annotate(co=Count('id'))
+    }
+    n_item = Favorito.objects.filter(tipo_contenido=tipo, contenido_id=contenido_id).count()
+    conteos = {}
+    if coocurrencias:
+        filas = (Favorito.objects
+                 .filter(tipo_contenido__in={t for t, _ in coocurrencias},
+                         contenido_id__in={c for _, c in coocurrencias})
+                 .values('tipo_contenido', 'contenido_id').annotate(n=Count('id')))
+        conteos = {(fila['tipo_contenido'], fila['contenido_id']): fila['n'] for fila in filas}
+
+    scores = {
+        vecino: float(_puntuar(co, n_item, conteos[vecino], metrica))
+        for vecino, co in coocurrencias.items() if vecino in conteos
+    }
+    # Como en construir_modelo(): los k mejores, y de ellos los que llegan al mínimo de coocurrencias
+    mejores = [vecino for vecino in sorted(scores, key=scores.get, reverse=True)[:k]
+               if coocurrencias[vecino] >= min_coocurrencias]
+
+    # Items que apuntaban al item: pierden o cambian esa fila aunque ya no coincidan con él
+    tocados = {(tipo, contenido_id), *scores, *SimilitudItem.objects.filter(
+        vecino_tipo=tipo, vecino_id=contenido_id).values_list('tipo_contenido', 'contenido_id')}
+    with transaction.atomic():
+        # Filas del item: se reescriben enteras
+        SimilitudItem.objects.filter(tipo_contenido=tipo, contenido_id=contenido_id).delete()
+        SimilitudItem.objects.bulk_create([
+            SimilitudItem(tipo_contenido=tipo, contenido_id=contenido_id,
+                          vecino_tipo=vecino[0], vecino_id=vecino[1],
+                          score=float(scores[vecino]), coocurrencias=coocurrencias[vecino])
+            for vecino in mejores
+        ])
+        # Filas inversas (vecino -> item): cambia n_item, así que cambian todas
+        SimilitudItem.objects.filter(vecino_tipo=tipo, vecino_id=contenido_id).delete()
+        SimilitudItem.objects.bulk_create([
+            SimilitudItem(tipo_contenido=vecino[0], contenido_id=vecino[1],
+                          vecino_tipo=tipo, vecino_id=contenido_id,
+                          score=float(score), coocurrencias=coocurrencias[vecino])
+            for vecino, score in scores.items() if coocurrencias[vecino] >= min_coocurrencias
+        ])
+        # Cada vecino conserva solo sus k mejores, en un único DELETE sobre el ranking de sus filas
+        afectados = SimilitudItem.objects.filter(
+            vecino_tipo=tipo, vecino_id=contenido_id,
+            tipo_contenido=OuterRef('tipo_contenido'), contenido_id=OuterRef('contenido_id'))
+        sobrantes = (SimilitudItem.objects.filter(Exists(afectados))
+                     .annotate(puesto=Window(RowNumber(), partition_by=[F('tipo_contenido'), F('contenido_id')],
+                                             order_by=[F('score').desc(), F('pk').asc()]))
+                     .filter(puesto__gt=k).values('pk'))
+        SimilitudItem.objects.filter(pk__in=sobrantes).delete()
+        # Nueva versión para los vecinos de los items tocados: cada proceso recarga solo esos
+        version = uuid.uuid4().hex
+        VersionVecinos.objects.bulk_create(
+            [VersionVecinos(tipo_contenido=t, contenido_id=c, version=version) for t, c in tocados],
+            update_conflicts=True, unique_fields=['tipo_contenido', 'contenido_id'], update_fields=['version'])
+    return [(vecino[0], vecino[1], float(scores[vecino])) for vecino in mejores], tocados
+
+
+def actualizar_favorito(usuario_id, tipo, contenido_id, agregado, k=None):
+    """
+    Aplica de forma incremental el alta (`agregado=True`) o la baja de un
+    favorito: se recalculan los vecinos del item y se ajustan los candidatos
+    del usuario, sin tocar el resto de la matriz.
+    """
+    modelo = parametros()
+    item = (tipo, contenido_id)
+    anteriores = vecinos([item])[item]
+    nuevos, tocados = _recalcular_item(
+        tipo, contenido_id, k or modelo['k'], modelo['metrica'], modelo['min_coocurrencias'])
+
+    clave = CLAVE_CANDIDATOS.format(usuario_id=usuario_id)
+    estado = cache.get(clave)
+    if estado is not None:
+        candidatos = estado['candidatos']
+        if agregado:
+            estado['favoritos'].add(item)
+            for vecino_tipo, vecino_id, score in nuevos:
+                candidatos[(vecino_tipo, vecino_id)] = candidatos.get((vecino_tipo, vecino_id), 0.0) + score
+        else:
+            estado['favoritos'].discard(item)
+            for vecino_tipo, vecino_id, score in anteriores:
+                candidatos[(vecino_tipo, vecino_id)] = candidatos.get((vecino_tipo, vecino_id), 0.0) - score
+            # El item quitado vuelve a ser candidato por su similitud con el resto de favoritos
+            candidatos[item] = sum(
+                score for vecino_tipo, vecino_id, score in nuevos if (vecino_tipo, vecino_id) in estado['favoritos'])
+        cache.set(clave, estado, settings.RECOMENDADOR_CANDIDATOS_TTL)
@@ -0,0 +1,124 @@
+"""
+Usuario de la sesión resuelto una vez por petición.
+
+`UsuarioSesionMiddleware` deja en `request.usuario` el `Usuario` de
+`request.session['usuario_id']` (o None). Los usuarios se guardan en una
+caché pequeña del proceso: los cambios hechos en este proceso la invalidan
+por señales y los de otros procesos se ven, como tarde, al caducar la
+entrada (USUARIO_CACHE_TTL).
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import JsonResponse
+from django.shortcuts import redirect
+
+from .models import Usuario
+
+_usuarios = OrderedDict()  # id -> (usuario, caduca)
+_lock = threading.Lock()
+
+
+def obtener_usuario(usuario_id):
+    """El `Usuario` con ese id desde la caché del proceso o la base de datos; None si no existe."""
+    if usuario_id is None:
+        return None
+    ahora = time.monotonic()
+    with _lock:
+        entrada = _usuarios.get(usuario_id)
+        if entrada is not None and entrada[1] > ahora:
+            _usuarios.move_to_end(usuario_id)
+            return entrada[0]
+    usuario = Usuario.objects.filter(id=usuario_id).first()
+    if usuario is not None:
+        with _lock:
+            _usuarios[usuario_id] = (usuario, ahora + settings.USUARIO_CACHE_TTL)
+            _usuarios.move_to_end(usuario_id)
+            while len(_usuarios) > settings.USUARIO_CACHE_MAX:
+                _usuarios.popitem(last=False)
+    return usuario
+
+
+@receiver([post_save, post_delete], sender=Usuario)
+def _invalidar(sender, instance, **kwargs):
+    with _lock:
+        _usuarios.pop(instance.id, None)
+
+
+def _resolver(request):
+    # Leer la sesión puede consultar la base de datos, así que en ASGI va en un hilo
+    request.usuario = obtener_usuario(request.session.get('usuario_id'))
+
+
+class UsuarioSesionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        _resolver(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        await sync_to_async(_resolver)(request)
+        return await self.get_response(request)
+
+
+def _con_comprobacion(vista, rechazar):
+    """Envuelve `vista` (síncrona o asíncrona) para que antes se llame a `rechazar(request)`."""
+    if iscoroutinefunction(vista):
+        @wraps(vista)
+        async def envoltura_async(request, *args, **kwargs):
+            respuesta = await sync_to_async(rechazar)(request)
+            if respuesta is not None:
+                return respuesta
+            return await vista(request, *args, **kwargs)
+        return envoltura_async
+
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        return rechazar(request) or vista(request, *args, **kwargs)
+    return envoltura
+
+
+def usuario_requerido(mensaje, nivel=messages.WARNING, volver=False):
+    """
+    Redirige al login (o a la página de origen si `volver`) con `mensaje`
+    cuando no hay sesión, y cierra la sesión si su usuario ya no existe.
+    """
+    def rechazar(request):
+        """Respuesta de redirección si la petición no tiene un usuario válido; None si lo tiene."""
+        destino = request.META.get('HTTP_REFERER', 'login_usuario') if volver else 'login_usuario'
+        if 'usuario_id' not in request.session:
+            messages.add_message(request, nivel, mensaje)
+            return redirect(destino)
+        if request.usuario is None:
+            request.session.flush()
+            messages.error(request, 'Tu sesión no es válida. Por favor, inicia sesión nuevamente.')
+            return redirect(destino)
+        return None
+
+    return lambda vista: _con_comprobacion(vista, rechazar)
+
+
+def usuario_requerido_api(vista):
+    """Para la API JSON: 401 en lugar de redirigir al login."""
+    def rechazar(request):
+        if request.usuario is None:
+            return JsonResponse({'error': 'Autenticación requerida'}, status=401)
+        return None
+
+    return _con_comprobacion(vista, rechazar)
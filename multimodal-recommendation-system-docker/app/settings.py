@@ -25,12 +25,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.metricas.MetricasMiddleware',  # Primero, para medir la petición completa
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',  # Añadido para i18n
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'app.sesion.UsuarioSesionMiddleware',  # request.usuario
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -39,10 +41,16 @@ ROOT_URLCONF = 'app.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'app.metricas.PlantillasMedidas',  # DjangoTemplates que mide el render
         'DIRS': [BASE_DIR / 'app' / 'templates'],  # Añadido para templates
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Las plantillas se compilan una vez por proceso (en DEBUG se recargan al cambiar)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -55,6 +63,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'app.wsgi.application'
+ASGI_APPLICATION = 'app.asgi.application'
 
 # Database
 DATABASES = {
@@ -121,4 +130,142 @@ MESSAGE_TAGS = {
     messages.ERROR: 'danger',
 }
 
-SESSION_TIMEOUT = 2
\ No newline at end of file
+SESSION_TIMEOUT = 2
+# URLs base de las APIs externas (se apuntan a los stubs de `benchmark_carga` para medir sin red)
+JIKAN_API_URL = os.environ.get('JIKAN_API_URL', 'https://api.jikan.moe/v4')
+OPENLIBRARY_URL = os.environ.get('OPENLIBRARY_URL', 'https://openlibrary.org')
+# Límites de tasa de Jikan: pares (peticiones, periodo en segundos)
+JIKAN_RATE_LIMITS = [(3, 1), (60, 60)]
+OPENLIBRARY_RATE_LIMITS = [(2, 1)]
+JIKAN_MAX_WORKERS = 4
+OPENLIBRARY_MAX_WORKERS = 2
+
+# Tiempo máximo (segundos) que la página de recomendaciones espera a Jikan
+# antes de mostrar resultados parciales
+RECOMENDACIONES_PRESUPUESTO = 8.0
+
+# Caché persistente de respuestas de APIs externas: (TTL, ventana stale-while-revalidate) en segundos
+UPSTREAM_CACHE_TTL = {
+    'default': (60 * 60, 60 * 60),
+    'jikan_busqueda': (6 * 60 * 60, 24 * 60 * 60),
+    'jikan_recomendaciones': (3 * 24 * 60 * 60, 7 * 24 * 60 * 60),  # Cambian muy poco por mal_id
+    'jikan_listado': (6 * 60 * 60, 24 * 60 * 60),  # Top y temporada (app/precalentamiento.py)
+    'openlibrary_busqueda': (12 * 60 * 60, 24 * 60 * 60),
+    'openlibrary_autor': (24 * 60 * 60, 3 * 24 * 60 * 60),
+    'openlibrary_isbn': (7 * 24 * 60 * 60, 7 * 24 * 60 * 60),  # Un ISBN no cambia de obra
+}
+UPSTREAM_CACHE_MAX_ENTRADAS = 20000  # Filas en la tabla antes del desalojo LRU
+UPSTREAM_CACHE_MAX_MEMORIA = 512  # Entradas calientes en memoria por proceso
+
+# Cliente HTTP compartido para APIs externas (app/upstream.py)
+UPSTREAM_TIMEOUT = (3.05, 10)  # (connect, read) en segundos
+UPSTREAM_REINTENTOS = 2
+UPSTREAM_BACKOFF = 0.3  # Base del backoff exponencial con jitter (segundos)
+UPSTREAM_BACKOFF_MAX = 3.0
+UPSTREAM_POOL_SIZE = 10  # Conexiones keep-alive por host
+UPSTREAM_CIRCUITO_UMBRAL = 5  # Fallos seguidos que abren el circuito
+UPSTREAM_CIRCUITO_ENFRIAMIENTO = 30  # Segundos con el circuito abierto
+UPSTREAM_ASYNC_MAX_CONEXIONES = 200  # Peticiones en vuelo por proceso con el cliente asíncrono
+
+# Tiempo (segundos) que una búsqueda ya resuelta se sirve desde el catálogo local sin volver a la API
+CATALOGO_TTL = 7 * 24 * 60 * 60
+
+# Caché compartida entre procesos (workers y comandos de gestión del mismo contenedor)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DJANGO_CACHE_DIR', '/var/tmp/django_cache'),
+    },
+    # Fragmentos de plantilla y páginas públicas: en memoria de cada proceso,
+    # porque leerlos de disco costaría más que volver a renderizarlos
+    'plantillas': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'plantillas',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+# Caché de páginas completas para visitantes sin sesión (app/paginas.py); 0 la desactiva
+PAGINAS_CACHE_TTL = int(os.environ.get('PAGINAS_CACHE_TTL', '0'))
+
+# Filtrado colaborativo: si los vecinos precalculados dan al menos estas
+# recomendaciones, no se consulta a las APIs externas
+RECOMENDADOR_MIN_RESULTADOS = 6
+RECOMENDADOR_K = 50  # Vecinos guardados por item
+RECOMENDADOR_METRICA = 'coseno'  # o 'jaccard'
+RECOMENDADOR_MIN_COOCURRENCIAS = 1  # Pares con menos usuarios en común se descartan
+RECOMENDADOR_CANDIDATOS_TTL = 24 * 60 * 60  # Candidatos por usuario en la caché compartida
+
+# Ranking de las recomendaciones de Jikan (app/recomendaciones.py)
+RECOMENDACIONES_ANIME_MAX = 24  # Animes en la página de recomendaciones
+RECOMENDACIONES_VIDA_MEDIA_DIAS = 90  # Un favorito de hace 90 días pesa la mitad que uno de hoy
+RECOMENDACIONES_PESO_FUENTES = 0.5  # Bonus por cada favorito más que recomienda el mismo anime
+RECOMENDACIONES_LIBROS_MAX = 12  # Libros en la página de recomendaciones
+OBRAS_POR_AUTOR = 10  # Obras que se guardan de cada autor en el índice de autores
+
+FAVORITOS_CACHE_TTL = 24 * 60 * 60  # Conjunto de favoritos por usuario y tipo (app/favoritos.py)
+
+# Datos generados por la aplicación (índices, cachés en disco...)
+DATA_DIR = os.environ.get('DATA_DIR', str(BASE_DIR / 'data'))
+
+# Índice vectorial común de animes y libros (app/embeddings.py)
+EMBEDDINGS_DIR = os.path.join(DATA_DIR, 'embeddings')
+EMBEDDINGS_DIMENSIONES = 1024
+EMBEDDINGS_FAVORITOS_ORIGEN = 3  # Favoritos más recientes para los que se muestra "porque te gustó"
+
+# Snapshots de recomendaciones por usuario (app/snapshots.py)
+SNAPSHOTS_TTL = 6 * 60 * 60  # Segundos hasta que un snapshot se considera caducado
+SNAPSHOTS_TTL_ERROR = 10 * 60  # Si la API falló al generarlo se reintenta antes
+# Recalcular en un hilo del propio proceso; si es False los recalcula
+# `manage.py refrescar_recomendaciones --continuo`
+SNAPSHOTS_REFRESCO_LOCAL = os.environ.get('SNAPSHOTS_REFRESCO_LOCAL', '1') == '1'
+
+# Usuarios de sesión en memoria de cada proceso (app/sesion.py)
+USUARIO_CACHE_TTL = 60  # Segundos que un proceso tarda, como mucho, en ver cambios hechos en otro
+USUARIO_CACHE_MAX = 1000
+USUARIOS_TOTAL_TTL = 60  # Segundos que /usuarios/ muestra el mismo total de usuarios
+
+# Cuotas de las APIs externas compartidas por todos los workers (app/ratelimit.py)
+RATELIMIT_ENTRE_PROCESOS = True
+RATELIMIT_DIR = os.path.join(DATA_DIR, 'ratelimit')
+RATELIMIT_RETRY_AFTER_MAX = 60  # Tope (segundos) de un Retry-After recibido con un 429
+RATELIMIT_RETRY_AFTER_DEFECTO = 1  # Pausa si el 429 no trae Retry-After
+RATELIMIT_ESPERA_MAX = 5  # Segundos que una petición de una vista espera turno antes de rendirse
+
+# Agrupación de peticiones idénticas a APIs externas (app/singleflight.py)
+SINGLEFLIGHT_ENTRE_PROCESOS = True  # Cerrojos de archivo compartidos por todos los workers
+SINGLEFLIGHT_DIR = os.path.join(DATA_DIR, 'singleflight')
+SINGLEFLIGHT_CERROJOS = 1024  # Archivos de cerrojo; cada URL cae siempre en el mismo
+SINGLEFLIGHT_ESPERA = 15  # Segundos máximos esperando a otro proceso antes de descargar igualmente
+
+# Listados largos (app/listados.py)
+LISTADOS_TAMANO_PAGINA = 50
+LISTADOS_CHUNK = 2000  # Filas por lectura al exportar en streaming
+
+# Proxy de portadas e imágenes (app/portadas.py)
+PORTADAS_DIR = os.path.join(DATA_DIR, 'portadas')
+PORTADAS_MAX_BYTES = int(os.environ.get('PORTADAS_MAX_MB', '256')) * 1024 * 1024  # Tope del directorio (LRU)
+PORTADAS_MAX_ORIGINAL = 5 * 1024 * 1024  # Imágenes de origen más grandes no se guardan
+PORTADAS_HOSTS = {'covers.openlibrary.org', 'cdn.myanimelist.net'}
+PORTADAS_CALIDAD = 80  # Calidad JPEG de las miniaturas
+PORTADAS_MAX_AGE = 365 * 24 * 60 * 60  # Cache-Control del navegador
+
+# Métricas por vista y endpoint /metrics (app/metricas.py)
+METRICAS_DIR = os.path.join(DATA_DIR, 'metricas')  # Un archivo por worker; /metrics los suma
+METRICAS_VOLCADO = 5  # Segundos entre volcados del estado de cada worker
+METRICAS_SERVER_TIMING = os.environ.get('METRICAS_SERVER_TIMING', '0') == '1'
+
+# Importación masiva de favoritos (app/importacion.py)
+IMPORTACION_LOTE = 500  # Filas por lote (resolución de ids + bulk_create)
+IMPORTACION_ISBN_LOTE = 50  # ISBN por búsqueda en OpenLibrary
+IMPORTACION_PRESUPUESTO = 30.0  # Segundos por lote para resolver ISBN
+IMPORTACION_MAX_BYTES = 10 * 1024 * 1024  # Tope del archivo subido desde la web
+IMPORTACION_DIR = os.path.join(DATA_DIR, 'importaciones')  # Archivos subidos a la espera de procesarse
+IMPORTACION_LOCAL = SNAPSHOTS_REFRESCO_LOCAL  # Hilo en cada proceso web; si no, las procesa refrescar_recomendaciones
+IMPORTACION_ATASCADA = 15 * 60  # Una importación en curso sin avances en este tiempo se retoma
+
+# Precalentamiento de cachés tras un despliegue (app/precalentamiento.py)
+PRECALENTAR_DIR = os.path.join(DATA_DIR, 'precalentar')  # Progreso para reanudar un recorrido interrumpido
+PRECALENTAR_LOTE = 10  # Peticiones entre escrituras del progreso
+PRECALENTAR_PRESUPUESTO = 60.0  # Segundos por lote
+PRECALENTAR_REANUDAR_MAX = 6 * 60 * 60  # Un progreso más antiguo se descarta y se empieza de nuevo
@@ -0,0 +1,139 @@
+"""
+Agrupación de peticiones idénticas en vuelo (single-flight).
+
+Cuando varias peticiones necesitan a la vez la misma URL externa, solo la
+primera la descarga y las demás esperan y reciben su resultado (o su
+excepción). `SingleFlight` agrupa hilos y tareas asyncio del mismo proceso;
+`bloqueo_entre_procesos()` añade un cerrojo de archivo (fcntl) para que los
+demás workers esperen a quien ya está descargando y después lean su copia de
+la caché en lugar de repetir la petición.
+"""
+import asyncio
+import contextlib
+import hashlib
+import os
+import threading
+import time
+
+import requests
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Sin fcntl (Windows) solo se agrupa dentro del proceso
+    fcntl = None
+
+
+class EsperaAgotada(requests.exceptions.Timeout):
+    """Se agotó el tiempo esperando el resultado de la petición en vuelo de otro."""
+
+
+class _Vuelo:
+    def __init__(self):
+        self.hecho = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._vuelos = {}  # clave -> _Vuelo
+        self._tareas = {}  # (bucle, clave) -> asyncio.Task
+        self._lock = threading.Lock()
+
+    def hacer(self, clave, funcion, timeout=None):
+        """
+        Ejecuta `funcion()` salvo que ya haya una llamada con la misma `clave`
+        en curso en este proceso; en ese caso espera (como mucho `timeout`
+        segundos) y devuelve su resultado.
+        """
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+        if not lider:
+            if not vuelo.hecho.wait(timeout):
+                raise EsperaAgotada(f"Sin respuesta de la petición en curso para {clave}")
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+        try:
+            vuelo.resultado = funcion()
+            return vuelo.resultado
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._vuelos[clave]
+            vuelo.hecho.set()
+
+    async def ahacer(self, clave, funcion):
+        """Como `hacer()` para tareas asyncio: `funcion()` devuelve una corrutina."""
+        llave = (asyncio.get_running_loop(), clave)
+        with self._lock:
+            tarea = self._tareas.get(llave)
+            if tarea is None:
+                tarea = self._tareas[llave] = asyncio.ensure_future(funcion())
+                tarea.add_done_callback(lambda _: self._olvidar(llave))
+        # shield: si se cancela una de las peticiones que esperan, las demás siguen
+        return await asyncio.shield(tarea)
+
+    def _olvidar(self, llave):
+        with self._lock:
+            self._tareas.pop(llave, None)
+
+
+def _ruta_cerrojo(clave):
+    # Un número fijo de archivos: cada clave cae siempre en el mismo
+    numero = int(hashlib.sha256(clave.encode('utf-8')).hexdigest(), 16) % settings.SINGLEFLIGHT_CERROJOS
+    os.makedirs(settings.SINGLEFLIGHT_DIR, exist_ok=True)
+    return os.path.join(settings.SINGLEFLIGHT_DIR, f'{numero:04x}.lock')
+
+
+def _tomar(archivo):
+    try:
+        fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+@contextlib.contextmanager
+def bloqueo_entre_procesos(clave, timeout=None):
+    """
+    Cerrojo exclusivo entre procesos para `clave`. Si no se consigue en
+    `timeout` segundos (SINGLEFLIGHT_ESPERA por defecto) se sigue sin él:
+    es una optimización, no una garantía.
+    """
+    if fcntl is None or not settings.SINGLEFLIGHT_ENTRE_PROCESOS:
+        yield
+        return
+    limite = time.monotonic() + (settings.SINGLEFLIGHT_ESPERA if timeout is None else timeout)
+    with open(_ruta_cerrojo(clave), 'a') as archivo:
+        while not _tomar(archivo) and time.monotonic() < limite:
+            time.sleep(0.05)
+        try:
+            yield
+        finally:
+            fcntl.flock(archivo, fcntl.LOCK_UN)
+
+
+@contextlib.asynccontextmanager
+async def abloqueo_entre_procesos(clave, timeout=None):
+    """Como `bloqueo_entre_procesos()`, esperando sin bloquear el bucle de eventos."""
+    if fcntl is None or not settings.SINGLEFLIGHT_ENTRE_PROCESOS:
+        yield
+        return
+    limite = time.monotonic() + (settings.SINGLEFLIGHT_ESPERA if timeout is None else timeout)
+    with open(_ruta_cerrojo(clave), 'a') as archivo:
+        while not _tomar(archivo) and time.monotonic() < limite:
+            await asyncio.sleep(0.05)
+        try:
+            yield
+        finally:
+            fcntl.flock(archivo, fcntl.LOCK_UN)
+
+
+vuelos = SingleFlight()
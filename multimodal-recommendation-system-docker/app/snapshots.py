@@ -0,0 +1,109 @@
+"""
+Snapshots precalculados de las páginas de recomendaciones.
+
+Las vistas leen la fila de `SnapshotRecomendacion` del usuario y la muestran
+tal cual; si está caducada o los favoritos cambiaron desde que se generó, se
+muestra igualmente (marcada como "actualizando") y se encola su recálculo.
+Los recálculos los hace un hilo consumidor dentro del proceso
+(SNAPSHOTS_REFRESCO_LOCAL) o el comando `refrescar_recomendaciones`.
+"""
+import logging
+import queue
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from .models import SnapshotRecomendacion
+from .recomendaciones import calcular
+
+logger = logging.getLogger(__name__)
+
+_cola = queue.Queue()
+_en_cola = set()
+_hilo = None
+_lock = threading.Lock()
+
+
+def obsoleto(snapshot):
+    return snapshot.pendiente or snapshot.expira <= timezone.now()
+
+
+def obtener(usuario_id, tipo_contenido):
+    return SnapshotRecomendacion.objects.filter(usuario_id=usuario_id, tipo_contenido=tipo_contenido).first()
+
+
+def guardar(usuario_id, tipo_contenido, contenido, version=0):
+    """
+    Guarda el resultado de `calcular()`. Si los favoritos cambiaron mientras se
+    calculaba (la versión ya no es `version`) el snapshot sigue pendiente.
+    """
+    ahora = timezone.now()
+    ttl = settings.SNAPSHOTS_TTL_ERROR if contenido.get('error_api') else settings.SNAPSHOTS_TTL
+    campos = {'contenido': contenido, 'generado': ahora, 'expira': ahora + timedelta(seconds=ttl)}
+    actualizados = SnapshotRecomendacion.objects.filter(usuario_id=usuario_id, tipo_contenido=tipo_contenido).update(
+        pendiente=Case(When(version=version, then=Value(False)), default=F('pendiente')), **campos)
+    if not actualizados:
+        SnapshotRecomendacion.objects.bulk_create(
+            [SnapshotRecomendacion(usuario_id=usuario_id, tipo_contenido=tipo_contenido, **campos)],
+            ignore_conflicts=True,
+        )
+
+
+def refrescar(usuario_id, tipo_contenido):
+    """Recalcula y guarda el snapshot. Devuelve el contenido nuevo."""
+    version = SnapshotRecomendacion.objects.filter(
+        usuario_id=usuario_id, tipo_contenido=tipo_contenido).values_list('version', flat=True).first() or 0
+    contenido = calcular(usuario_id, tipo_contenido)
+    guardar(usuario_id, tipo_contenido, contenido, version)
+    return contenido
+
+
+def marcar_pendientes(usuario_id):
+    """
+    Los favoritos del usuario cambiaron: sus snapshots quedan pendientes de
+    recalcular. Devuelve los tipos de contenido afectados.
+    """
+    snapshots = SnapshotRecomendacion.objects.filter(usuario_id=usuario_id)
+    tipos = list(snapshots.values_list('tipo_contenido', flat=True))
+    snapshots.update(pendiente=True, version=F('version') + 1)
+    return tipos
+
+
+def por_refrescar(limite=100):
+    """Snapshots pendientes o caducados, los más antiguos primero: [(usuario_id, tipo_contenido)]."""
+    return list(
+        SnapshotRecomendacion.objects.filter(Q(pendiente=True) | Q(expira__lte=timezone.now()))
+        .order_by('expira').values_list('usuario_id', 'tipo_contenido')[:limite]
+    )
+
+
+def encolar(usuario_id, tipo_contenido):
+    """Pide el recálculo al hilo consumidor del proceso (si está activado). Sin duplicados."""
+    global _hilo
+    if not settings.SNAPSHOTS_REFRESCO_LOCAL:
+        return
+    with _lock:
+        if (usuario_id, tipo_contenido) in _en_cola:
+            return
+        _en_cola.add((usuario_id, tipo_contenido))
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_consumir, daemon=True)
+            _hilo.start()
+    _cola.put((usuario_id, tipo_contenido))
+
+
+def _consumir():
+    while True:
+        usuario_id, tipo_contenido = _cola.get()
+        try:
+            refrescar(usuario_id, tipo_contenido)
+        except Exception:
+            logger.exception("No se pudo refrescar el snapshot %s/%s", usuario_id, tipo_contenido)
+        finally:
+            with _lock:
+                _en_cola.discard((usuario_id, tipo_contenido))
+            connection.close()
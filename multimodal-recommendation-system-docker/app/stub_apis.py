@@ -0,0 +1,149 @@
+"""
+Servidores locales que imitan Jikan y OpenLibrary para las pruebas de carga.
+
+Responden con las respuestas grabadas de `app/grabaciones/`, con una latencia
+configurable (media y jitter) y, con probabilidad `prob_429`, con un 429 y su
+`Retry-After`, igual que la API real cuando se supera la cuota. Cada stub
+cuenta las peticiones que recibe y los 429 que devuelve.
+
+Para apuntar la aplicación a un stub basta con cambiar JIKAN_API_URL u
+OPENLIBRARY_URL por su `url`.
+"""
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+GRABACIONES_DIR = os.path.join(os.path.dirname(__file__), 'grabaciones')
+
+
+def _grabacion(nombre):
+    with open(os.path.join(GRABACIONES_DIR, nombre), encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+
+def rutas_jikan():
+    busqueda = _grabacion('jikan_anime.json')
+    recomendaciones = _grabacion('jikan_recomendaciones.json')['data']
+
+    def responder(ruta, params):
+        partes = ruta.strip('/').split('/')
+        if partes in (['anime'], ['top', 'anime'], ['seasons', 'now']):
+            return busqueda
+        if len(partes) == 3 and partes[0] == 'anime' and partes[2] == 'recommendations' and partes[1].isdigit():
+            # Cada anime recibe una ventana distinta de la grabación, como en la API real
+            inicio = int(partes[1]) % len(recomendaciones)
+            return {'data': (recomendaciones[inicio:] + recomendaciones[:inicio])[:10]}
+        return None
+    return responder
+
+
+def rutas_openlibrary():
+    busqueda = _grabacion('openlibrary_search.json')
+
+    def responder(ruta, params):
+        if ruta != '/search.json':
+            return None
+        try:
+            limite = int(params.get('limit', ['100'])[0])
+        except ValueError:
+            limite = 100
+        docs = busqueda['docs']
+        if 'author_key' in params:
+            docs = [d for d in docs if params['author_key'][0] in d['author_key']]
+        elif 'author' in params:
+            autor = params['author'][0].lower()
+            docs = [d for d in docs if any(autor in nombre.lower() for nombre in d['author_name'])]
+        return {**busqueda, 'numFound': len(docs), 'docs': docs[:limite]}
+    return responder
+
+
+class StubAPI:
+    """Servidor HTTP en un hilo; `url` es su URL base."""
+
+    def __init__(self, nombre, responder, latencia=0.0, jitter=0.0, prob_429=0.0, retry_after=1, semilla=None):
+        self.nombre = nombre
+        self.responder = responder
+        self.latencia = latencia
+        self.jitter = jitter
+        self.prob_429 = prob_429
+        self.retry_after = retry_after
+        self.contadores = Counter()
+        self._aleatorio = random.Random(semilla)
+        self._lock = threading.Lock()
+        self._servidor = None
+
+    def _sortear(self):
+        with self._lock:
+            espera = max(0.0, self._aleatorio.uniform(self.latencia - self.jitter, self.latencia + self.jitter))
+            return espera, self._aleatorio.random() < self.prob_429
+
+    def _contar(self, evento):
+        with self._lock:
+            self.contadores[evento] += 1
+
+    def _manejador(self):
+        stub = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, como el pool del cliente upstream
+
+            def do_GET(self):
+                partes = urlsplit(self.path)
+                espera, limitar = stub._sortear()
+                time.sleep(espera)
+                stub._contar('peticiones')
+                if limitar:
+                    stub._contar('429')
+                    self._enviar(429, {'status': 429, 'message': 'Too Many Requests'},
+                                 {'Retry-After': str(stub.retry_after)})
+                    return
+                datos = stub.responder(partes.path, parse_qs(partes.query))
+                if datos is None:
+                    stub._contar('404')
+                    self._enviar(404, {'status': 404, 'message': 'Not Found'})
+                else:
+                    self._enviar(200, datos)
+
+            def _enviar(self, estado, datos, cabeceras=None):
+                cuerpo = json.dumps(datos).encode('utf-8')
+                self.send_response(estado)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(cuerpo)))
+                for nombre, valor in (cabeceras or {}).items():
+                    self.send_header(nombre, valor)
+                self.end_headers()
+                try:
+                    self.wfile.write(cuerpo)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # El cliente se cansó de esperar (presupuesto de tiempo agotado)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Manejador
+
+    @property
+    def url(self):
+        host, puerto = self._servidor.server_address[:2]
+        return f'http://{host}:{puerto}'
+
+    def iniciar(self, host='127.0.0.1', puerto=0):
+        self._servidor = ThreadingHTTPServer((host, puerto), self._manejador())
+        self._servidor.daemon_threads = True
+        threading.Thread(target=self._servidor.serve_forever, daemon=True, name=f'stub-{self.nombre}').start()
+        return self
+
+    def detener(self):
+        if self._servidor is not None:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+            self._servidor = None
+
+    def estadisticas(self):
+        with self._lock:
+            return dict(self.contadores)
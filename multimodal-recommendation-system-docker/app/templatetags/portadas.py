@@ -0,0 +1,16 @@
+from urllib.parse import urlencode
+
+from django import template
+from django.urls import reverse
+
+from ..portadas import permitida
+
+register = template.Library()
+
+
+@register.filter
+def portada(url, tamano='m'):
+    """URL de la miniatura servida por el proxy local; la original si su host no está permitido."""
+    if not url or not permitida(url):
+        return url or ''
+    return f"{reverse('portada')}?{urlencode({'url': url, 't': tamano})}"
@@ -1,4 +1,33 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+import httpx
+import numpy as np
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template.loader import render_to_string
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from . import catalogo, embeddings, favoritos, importacion, items, metricas, portadas, precalentamiento, ratelimit, recomendaciones, recomendador, sesion, snapshots, stub_apis
+from .fanout import obtener_json_concurrente
+from .http_cache import CuotaAgotada, ResponseCache, cache_respuestas, normalizar_url
+from .models import (Favorito, ImportacionFavoritos, ItemCatalogo, ObrasAutor, RespuestaCache, SimilitudItem,
+                     SnapshotRecomendacion, Usuario)
+from .ratelimit import RateLimiter
+from .singleflight import EsperaAgotada, SingleFlight
+from .upstream import AsyncUpstreamClient, CircuitoAbierto, UpstreamClient
+
 
 class YourAppTests(TestCase):
     def setUp(self):
@@ -8,3 +37,1225 @@ class YourAppTests(TestCase):
     def test_example(self):
         # Example test case
         self.assertEqual(1 + 1, 2)  # Replace with your actual test logic
+
+
+class RateLimiterTests(TestCase):
+    def test_respeta_capacidad_de_la_cubeta(self):
+        limiter = RateLimiter.desde_limites([(3, 1)])
+        for _ in range(3):
+            self.assertTrue(limiter.acquire(timeout=0))
+        self.assertFalse(limiter.acquire(timeout=0))
+
+    def test_todas_las_cubetas_deben_tener_saldo(self):
+        limiter = RateLimiter.desde_limites([(3, 1), (2, 60)])
+        self.assertTrue(limiter.acquire(timeout=0))
+        self.assertTrue(limiter.acquire(timeout=0))
+        # Queda saldo por segundo, pero no por minuto
+        self.assertFalse(limiter.acquire(timeout=0.5))
+
+    def test_cuota_compartida_entre_procesos(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        archivo = os.path.join(directorio, 'jikan.bucket')
+        # Dos limitadores sobre el mismo archivo se comportan como dos workers
+        uno = RateLimiter.desde_limites([(3, 60)], archivo=archivo)
+        otro = RateLimiter.desde_limites([(3, 60)], archivo=archivo)
+        self.assertEqual([uno.intentar(), otro.intentar(), uno.intentar()], [0, 0, 0])
+        self.assertGreater(otro.intentar(), 0)
+
+    def test_retry_after_bloquea_a_todos(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        archivo = os.path.join(directorio, 'jikan.bucket')
+        uno = RateLimiter.desde_limites([(100, 1)], archivo=archivo)
+        otro = RateLimiter.desde_limites([(100, 1)], archivo=archivo)
+        uno.penalizar(0.3)
+        self.assertFalse(otro.acquire(timeout=0))
+        self.assertTrue(otro.acquire(timeout=1))
+
+
+class FanoutTests(TestCase):
+    def _respuesta(self, url, timeout=None):
+        if 'lento' in url:
+            time.sleep(1)
+        return {'url': url}
+
+    def test_devuelve_resultados_parciales_al_agotar_el_presupuesto(self):
+        limiter = RateLimiter.desde_limites([(100, 1)])
+        urls = {'a': 'http://x/a', 'b': 'http://x/lento'}
+        with mock.patch('app.fanout.cliente.get_json', side_effect=self._respuesta):
+            inicio = time.monotonic()
+            resultados, errores, pendientes = obtener_json_concurrente(urls, limiter, presupuesto=0.3)
+        self.assertLess(time.monotonic() - inicio, 0.9)
+        self.assertEqual(resultados, {'a': {'url': 'http://x/a'}})
+        self.assertEqual(errores, {})
+        self.assertEqual(pendientes, ['b'])
+
+
+class SingleFlightTests(TestCase):
+    def test_llamadas_simultaneas_comparten_resultado(self):
+        vuelos, llamadas, resultados = SingleFlight(), [], []
+
+        def lenta():
+            llamadas.append(1)
+            time.sleep(0.2)
+            return {'ok': True}
+
+        hilos = [threading.Thread(target=lambda: resultados.append(vuelos.hacer('k', lenta))) for _ in range(5)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(len(llamadas), 1)
+        self.assertEqual(resultados, [{'ok': True}] * 5)
+        self.assertEqual(vuelos.hacer('k', lambda: 'otra'), 'otra')  # Terminado el vuelo, se repite
+
+    def test_los_que_esperan_respetan_su_timeout_y_reciben_el_error(self):
+        vuelos = SingleFlight()
+        empezado = threading.Event()
+
+        def falla():
+            empezado.set()
+            time.sleep(0.2)
+            raise requests.exceptions.ConnectionError('caida')
+
+        hilo = threading.Thread(target=lambda: self.assertRaises(requests.exceptions.ConnectionError, vuelos.hacer, 'k', falla))
+        hilo.start()
+        empezado.wait()
+        with self.assertRaises(EsperaAgotada):
+            vuelos.hacer('k', falla, timeout=0.01)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            vuelos.hacer('k', falla)
+        hilo.join()
+
+    def test_tareas_asincronas_comparten_resultado(self):
+        vuelos, llamadas = SingleFlight(), []
+
+        async def descargar():
+            llamadas.append(1)
+            await asyncio.sleep(0.05)
+            return 42
+
+        async def varias():
+            return await asyncio.gather(*(vuelos.ahacer('k', descargar) for _ in range(10)))
+
+        self.assertEqual(asyncio.run(varias()), [42] * 10)
+        self.assertEqual(len(llamadas), 1)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(max_entradas=2, purgar_cada=1)
+
+    def test_normaliza_parametros_y_texto_de_busqueda(self):
+        self.assertEqual(
+            normalizar_url('https://API.jikan.moe/v4/anime', {'sfw': 'true', 'q': '  Naruto   Shippuden '}),
+            normalizar_url('https://api.jikan.moe/v4/anime?q=naruto+shippuden&sfw=true'),
+        )
+
+    def test_segunda_lectura_no_sale_a_la_red(self):
+        with mock.patch('app.http_cache._descargar', return_value={'data': [1]}) as descargar:
+            self.assertEqual(self.cache.obtener('jikan_busqueda', 'https://api.jikan.moe/v4/anime', {'q': 'x'}), {'data': [1]})
+            # Una instancia nueva no tiene nada en memoria: la copia sale de la BD
+            otra = ResponseCache(max_entradas=2)
+            self.assertEqual(otra.obtener('jikan_busqueda', 'https://api.jikan.moe/v4/anime', {'q': 'X'}), {'data': [1]})
+        self.assertEqual(descargar.call_count, 1)
+        self.assertEqual(self.cache.estadisticas()[('jikan_busqueda', 'miss')], 1)
+        self.assertEqual(otra.estadisticas()[('jikan_busqueda', 'hit')], 1)
+
+    def test_descarga_comprueba_lo_guardado_por_otro_proceso(self):
+        url = 'https://api.jikan.moe/v4/anime?q=x'
+        otro_proceso = ResponseCache(max_entradas=100)
+        with mock.patch('app.http_cache._descargar', return_value={'v': 1}):
+            otro_proceso.obtener('default', url)
+        # Quien esperaba el cerrojo encuentra la copia en la BD y no repite la petición
+        with mock.patch('app.http_cache._descargar') as descargar:
+            self.assertEqual(self.cache._descargar_una_vez('default', url), {'v': 1})
+        descargar.assert_not_called()
+
+    def test_sirve_copia_caducada_y_revalida(self):
+        url = 'https://api.jikan.moe/v4/anime/1/recommendations'
+        self.cache.guardar('jikan_recomendaciones', url, {'data': 'viejo'})
+        RespuestaCache.objects.update(expira=timezone.now() - timedelta(seconds=1))
+        otra = ResponseCache(max_entradas=2)
+        with mock.patch.object(ResponseCache, '_revalidar') as revalidar:
+            hits, faltan = otra.obtener_varios('jikan_recomendaciones', {'1': url})
+        self.assertEqual(hits, {'1': {'data': 'viejo'}})
+        self.assertEqual(faltan, {})
+        revalidar.assert_called_once()
+
+    @override_settings(RATELIMIT_ESPERA_MAX=0.05)
+    def test_cuota_agotada_sirve_la_copia_vieja(self):
+        url = normalizar_url('https://api.jikan.moe/v4/anime', {'q': 'x'})
+        self.cache.guardar('jikan_busqueda', url, {'data': 'viejo'})
+        RespuestaCache.objects.update(expira=timezone.now() - timedelta(days=30))
+        limitador = RateLimiter.desde_limites([(1, 60)])
+        limitador.acquire()
+        with mock.patch('app.http_cache.para_host', return_value=limitador), \
+                mock.patch('app.http_cache.cliente') as cliente, mock.patch('app.http_cache.acliente') as acliente:
+            self.assertEqual(ResponseCache(max_entradas=2).obtener('jikan_busqueda', url), {'data': 'viejo'})
+            self.assertEqual(async_to_sync(ResponseCache(max_entradas=2).aobtener)('jikan_busqueda', url),
+                             {'data': 'viejo'})
+            # Sin copia que servir, llega a la vista como cualquier fallo de red (es un RequestException)
+            with self.assertRaises(CuotaAgotada):
+                self.cache.obtener('jikan_busqueda', 'https://api.jikan.moe/v4/anime?q=y')
+        cliente.get_json.assert_not_called()
+        acliente.get_json.assert_not_called()
+
+    def test_desalojo_lru(self):
+        for i in range(3):
+            self.cache.guardar('default', f'https://openlibrary.org/search.json?q={i}', {'i': i})
+            RespuestaCache.objects.filter(url__endswith=f'q={i}').update(
+                ultimo_acceso=timezone.now() - timedelta(hours=3 - i))
+        self.cache.purgar()
+        self.assertEqual(
+            sorted(RespuestaCache.objects.values_list('contenido__i', flat=True)), [1, 2])
+
+
+class UpstreamClientTests(TestCase):
+    def setUp(self):
+        self.cliente = UpstreamClient(timeout=(1, 1), reintentos=2, backoff=0, backoff_max=0,
+                                      pool=2, umbral_fallos=2, enfriamiento=60)
+
+    def _respuesta(self, status, data=None):
+        response = mock.Mock(status_code=status)
+        response.json.return_value = data
+        response.raise_for_status.side_effect = (
+            requests.exceptions.HTTPError(response=response) if status >= 400 else None)
+        return response
+
+    def test_reintenta_errores_transitorios(self):
+        with mock.patch('requests.Session.get', side_effect=[
+                self._respuesta(503), self._respuesta(200, {'ok': True})]) as get:
+            self.assertEqual(self.cliente.get_json('https://api.jikan.moe/v4/anime'), {'ok': True})
+        self.assertEqual(get.call_count, 2)
+
+    def test_no_reintenta_errores_del_cliente(self):
+        with mock.patch('requests.Session.get', return_value=self._respuesta(404)) as get:
+            with self.assertRaises(requests.exceptions.HTTPError):
+                self.cliente.get('https://openlibrary.org/search.json')
+        self.assertEqual(get.call_count, 1)
+
+    def test_429_con_retry_after_frena_el_limitador_del_host(self):
+        limitador = RateLimiter.desde_limites([(100, 1)])
+        demasiadas = self._respuesta(429)
+        demasiadas.headers = {'Retry-After': '2'}
+        with mock.patch('requests.Session.get', side_effect=[demasiadas, self._respuesta(200, {'ok': True})]), \
+                mock.patch('app.upstream.ratelimit.para_host', return_value=limitador), \
+                mock.patch('app.upstream.time.sleep') as dormir:
+            self.assertEqual(self.cliente.get_json('https://api.jikan.moe/v4/anime'), {'ok': True})
+        dormir.assert_called_once_with(2.0)
+        self.assertGreater(limitador.intentar(), 1)
+
+    def test_circuito_abierto_falla_rapido(self):
+        with mock.patch('requests.Session.get', side_effect=requests.exceptions.ConnectionError) as get:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                self.cliente.get('https://api.jikan.moe/v4/anime')
+            with self.assertRaises(CircuitoAbierto):
+                self.cliente.get('https://api.jikan.moe/v4/anime')
+        self.assertEqual(get.call_count, 2)
+        self.assertTrue(self.cliente.circuito_abierto('api.jikan.moe'))
+
+    def _abrir_circuito(self):
+        with mock.patch('requests.Session.get', side_effect=requests.exceptions.ConnectionError):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                self.cliente.get('https://api.jikan.moe/v4/anime')
+        # Pasado el enfriamiento el circuito queda semiabierto
+        self.cliente._por_host('api.jikan.moe')[1]._abierto_hasta = 0
+
+    def test_prueba_con_error_no_previsto_libera_el_circuito(self):
+        self._abrir_circuito()
+        with mock.patch('requests.Session.get', side_effect=requests.exceptions.ChunkedEncodingError) as get:
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                self.cliente.get('https://api.jikan.moe/v4/anime')
+        self.assertEqual(get.call_count, 1)
+        self.cliente._por_host('api.jikan.moe')[1]._abierto_hasta = 0
+        with mock.patch('requests.Session.get', side_effect=KeyError('x')):
+            with self.assertRaises(KeyError):
+                self.cliente.get('https://api.jikan.moe/v4/anime')
+        # Ninguna de las dos pruebas deja el circuito bloqueado: la siguiente petición pasa y lo cierra
+        with mock.patch('requests.Session.get', return_value=self._respuesta(200, {'ok': True})):
+            self.assertEqual(self.cliente.get_json('https://api.jikan.moe/v4/anime'), {'ok': True})
+        self.assertFalse(self.cliente.circuito_abierto('api.jikan.moe'))
+
+    def test_prueba_asincrona_cancelada_libera_el_circuito(self):
+        self._abrir_circuito()
+        llamadas = []
+
+        async def responder(request):
+            llamadas.append(request)
+            if len(llamadas) == 1:
+                await asyncio.sleep(10)
+            if len(llamadas) == 2:
+                raise httpx.DecodingError('gzip roto', request=request)
+            return httpx.Response(200, json={'ok': True})
+
+        acliente = AsyncUpstreamClient(self.cliente, transport=httpx.MockTransport(responder))
+
+        async def pedir():
+            tarea = asyncio.create_task(acliente.get('https://api.jikan.moe/v4/anime'))
+            await asyncio.sleep(0.01)
+            tarea.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await tarea
+            # La cancelada no bloquea la prueba: la siguiente llega al host (y falla de otra forma)
+            with self.assertRaises(requests.exceptions.RequestException) as error:
+                await acliente.get('https://api.jikan.moe/v4/anime')
+            self.assertNotIsInstance(error.exception, CircuitoAbierto)
+            self.cliente._por_host('api.jikan.moe')[1]._abierto_hasta = 0
+            return await acliente.get_json('https://api.jikan.moe/v4/anime')
+
+        self.assertEqual(asyncio.run(pedir()), {'ok': True})
+        self.assertEqual(len(llamadas), 3)
+
+    def test_cliente_asincrono_reintenta_y_traduce_errores(self):
+        estados = iter([503, 200, 404])
+
+        def responder(request):
+            estado = next(estados)
+            return httpx.Response(estado, json={'ok': True} if estado == 200 else {})
+
+        acliente = AsyncUpstreamClient(self.cliente, transport=httpx.MockTransport(responder))
+
+        async def pedir():
+            datos = await acliente.get_json('https://api.jikan.moe/v4/anime')
+            with self.assertRaises(requests.exceptions.HTTPError):
+                await acliente.get('https://api.jikan.moe/v4/anime/1')
+            return datos
+
+        self.assertEqual(asyncio.run(pedir()), {'ok': True})
+
+
+class CatalogoTests(TestCase):
+    ANIME = {
+        'mal_id': 16498, 'title': 'Shingeki no Kyojin', 'url': 'https://myanimelist.net/anime/16498',
+        'images': {'jpg': {'image_url': 'https://cdn.myanimelist.net/16498.jpg'}, 'webp': {}},
+        'type': 'TV', 'episodes': 25, 'score': 8.5, 'synopsis': 'Titanes.',
+        'genres': [{'mal_id': 1, 'name': 'Action'}], 'trailer': {'youtube_id': 'x'},
+    }
+
+    def test_segunda_busqueda_sale_del_catalogo(self):
+        remoto = mock.Mock(return_value=[self.ANIME])
+        primera = catalogo.buscar('anime', 'Attack on Titan', remoto)
+        segunda = catalogo.buscar('anime', 'attack   on titan', remoto)
+        self.assertEqual(remoto.call_count, 1)
+        self.assertEqual(primera, segunda)
+        self.assertNotIn('trailer', segunda[0])
+        self.assertEqual(segunda[0]['image_url'], 'https://cdn.myanimelist.net/16498.jpg')
+
+    def test_indice_invertido_sobre_titulo_autor_y_genero(self):
+        catalogo.guardar('libro', [catalogo.normalizar_libro({
+            'key': '/works/OL1W', 'title': 'Cien años de soledad', 'author_name': ['Gabriel García Márquez'],
+            'subject': ['Realismo mágico'],
+        })])
+        self.assertEqual(catalogo.buscar_local('libro', 'garcia soledad')[0]['work_id'], 'OL1W')
+        self.assertEqual(catalogo.buscar_local('libro', 'realismo magico')[0]['work_id'], 'OL1W')
+        self.assertEqual(catalogo.buscar_local('libro', 'soledad borges'), [])
+        self.assertEqual(catalogo.buscar_local('anime', 'soledad'), [])
+
+    @override_settings(SNAPSHOTS_REFRESCO_LOCAL=False)
+    def test_ids_de_anime_no_numericos(self):
+        usuario = Usuario.objects.create(nombre='u', email='u@x.com', password_hash='pbkdf2_x')
+        sesion = self.client.session
+        sesion['usuario_id'] = usuario.id
+        sesion.save()
+        response = self.client.post('/toggle-favorito/', {
+            'contenido_id': 'abc', 'contenido_titulo': 'X', 'tipo_contenido': 'anime'}, follow=True)
+        self.assertContains(response, 'Identificador de anime no válido')
+        self.assertFalse(Favorito.objects.exists())
+
+        # Una fila antigua con id no numérico no rompe los registros de los demás
+        Favorito.objects.create(usuario=usuario, tipo_contenido='anime', contenido_id='abc', contenido_titulo='X')
+        Favorito.objects.create(usuario=usuario, tipo_contenido='anime', contenido_id='5', contenido_titulo='Y')
+        with self.assertLogs('app.catalogo', 'WARNING'):
+            self.assertEqual(list(catalogo.registros('anime', ['abc', '5'])), ['5'])
+
+        # Ni entra por el CSV de mis favoritos
+        csv = io.BytesIO(b'contenido_id,tipo_contenido,contenido_titulo\nabc,anime,X\n5,anime,Y\nOL1W,libro,Z\n')
+        self.assertEqual([fila.contenido_id for fila in importacion.leer(csv)], ['5', 'OL1W'])
+
+    def test_consultas_en_otras_escrituras_no_comparten_registro(self):
+        otro = dict(self.ANIME, mal_id=21, title='One Piece', genres=[])
+        catalogo.buscar('anime', '進撃の巨人', mock.Mock(return_value=[self.ANIME]))
+        remoto = mock.Mock(return_value=[otro])
+        resultados = catalogo.buscar('anime', 'ワンピース', remoto)
+        self.assertEqual(remoto.call_count, 1)
+        self.assertEqual([r['mal_id'] for r in resultados], [21])
+        self.assertEqual([r['mal_id'] for r in catalogo.buscar('anime', 'ワンピース', remoto)], [21])
+        self.assertEqual(catalogo.tokenizar('Привет, Ángel! C++ K'), ['привет', 'angel'])
+        self.assertNotEqual(catalogo.normalizar_consulta('K'), catalogo.normalizar_consulta('C++'))
+
+
+
+class ItemsTests(TestCase):
+    def test_libro_solo_guarda_los_campos_que_se_muestran(self):
+        libro = items.BookItem.desde_openlibrary({
+            'key': '/works/OL1W', 'title': 'Dune', 'author_name': ['Frank Herbert'], 'first_publish_year': 1965,
+            'first_sentence': ['In the week before...'], 'edition_key': ['OL%dM' % i for i in range(300)],
+            'isbn': ['0441013597'] * 200,
+        })
+        self.assertFalse(hasattr(libro, '__dict__'))
+        self.assertEqual(libro.key, '/works/OL1W')
+        self.assertEqual(libro.first_sentence, 'In the week before...')
+        self.assertNotIn('isbn', libro.como_dict())
+        self.assertEqual(items.BookItem.desde_dict(libro.como_dict()), libro)
+
+    def test_lee_registros_guardados_con_el_formato_anterior(self):
+        anime = items.desde_dict('anime', {'mal_id': 1, 'title': 'Cowboy Bebop', 'es_favorito': False,
+                                           'images': {'jpg': {'image_url': 'https://img/1.jpg'}}})
+        self.assertEqual(anime.image_url, 'https://img/1.jpg')
+        libro = items.desde_dict('libro', {'key': '/works/OL2W', 'work_id': 'OL2W', 'title': 'Hyperion',
+                                           'first_publish_year': 'N/A', 'first_sentence': []})
+        self.assertIsNone(libro.first_publish_year)
+        self.assertIsNone(libro.first_sentence)
+
+    async def test_openlibrary_pide_solo_los_campos_necesarios(self):
+        with mock.patch('app.http_cache.acliente.get_json', mock.AsyncMock(return_value={'docs': []})) as get_json:
+            await catalogo.abuscar_con_api('libro', 'frank herbert')
+        self.assertIn('fields=' + items.CAMPOS_OPENLIBRARY.replace(',', '%2C'), get_json.await_args.args[0])
+
+
+class CachePlantillasTests(TestCase):
+    def setUp(self):
+        caches['plantillas'].clear()
+
+    def test_tarjeta_cacheada_conserva_el_estado_de_favorito(self):
+        request = RequestFactory().get('/buscar-anime/')
+        anime = items.AnimeItem(mal_id=5, title='Cowboy Bebop')
+        render_to_string('anime_search.html', {'resultados': [anime]}, request=request)
+        anime.title, anime.es_favorito = 'Otro título', True
+        html = render_to_string('anime_search.html', {'resultados': [anime]}, request=request)
+        self.assertIn('Cowboy Bebop', html)  # Fragmento de la caché
+        self.assertIn('Quitar de Favoritos', html)  # El botón se renderiza siempre
+
+    @override_settings(PAGINAS_CACHE_TTL=60)
+    def test_pagina_publica_por_idioma_y_solo_sin_sesion(self):
+        fragmentos = caches['plantillas']
+        with mock.patch.object(fragmentos, 'set', wraps=fragmentos.set) as guardar:
+            for idioma in ('en', 'en', 'fr'):
+                self.assertEqual(self.client.get('/', HTTP_ACCEPT_LANGUAGE=idioma).status_code, 200)
+            self.assertEqual(guardar.call_count, 2)
+
+            usuario = Usuario.objects.create(nombre='u', email='u@x.com', password_hash='pbkdf2_x')
+            sesion = self.client.session
+            sesion['usuario_id'] = usuario.id
+            sesion.save()
+            self.assertContains(self.client.get('/', HTTP_ACCEPT_LANGUAGE='en'), 'Bienvenido, u!')
+            self.assertEqual(guardar.call_count, 2)
+
+
+class PortadasTests(TestCase):
+    URL = 'https://covers.openlibrary.org/b/id/123-M.jpg'
+    # Firma PNG con datos que Pillow no sabe decodificar: se guarda el original tal cual
+    PNG = b'\x89PNG\r\n\x1a\n' + b'x' * 392
+
+    @staticmethod
+    def _respuesta(contenido, trozos=100):
+        return mock.Mock(headers={}, iter_content=mock.Mock(
+            return_value=iter([contenido[i:i + trozos] for i in range(0, len(contenido), trozos)])))
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio)
+        self.cache = portadas.CachePortadas(self.directorio, max_bytes=1000)
+        self.descarga = mock.Mock(side_effect=lambda *args, **kwargs: self._respuesta(self.PNG))
+        parche = mock.patch('app.portadas.cliente.get', self.descarga)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def test_descarga_una_vez_y_desaloja_las_menos_usadas(self):
+        ruta = self.cache.obtener(self.URL)
+        self.assertEqual(self.cache.obtener(self.URL), ruta)
+        self.assertEqual(self.descarga.call_count, 1)
+        with self.assertRaises(portadas.ImagenNoPermitida):
+            self.cache.obtener('https://ejemplo.com/a.jpg')
+
+        os.utime(ruta, (1, 1))  # La más antigua
+        for i in range(2):
+            self.cache.obtener(f'https://cdn.myanimelist.net/images/anime/{i}.jpg')
+        self.assertEqual(self.cache.purgar(), 1)
+        self.assertFalse(os.path.exists(ruta))
+
+    def test_formato_segun_el_contenido_guardado(self):
+        ruta = self.cache.obtener(self.URL)
+        # La URL dice .jpg, pero lo guardado es PNG: se sirve como PNG
+        self.assertTrue(ruta.endswith('.png'))
+        self.assertEqual(portadas.CachePortadas.tipo(ruta), 'image/png')
+        self.assertEqual(self.cache.obtener(self.URL), ruta)
+        self.assertEqual(self.descarga.call_count, 1)
+        self.assertIn('image/', self.descarga.call_args.kwargs['headers']['Accept'])
+        self.assertTrue(self.descarga.call_args.kwargs['stream'])
+
+        self.descarga.side_effect = lambda *args, **kwargs: self._respuesta(b'<html>no es una imagen</html>')
+        with self.assertRaises(ValueError):
+            self.cache.obtener('https://covers.openlibrary.org/b/id/7-M.jpg')
+
+    @override_settings(PORTADAS_MAX_ORIGINAL=250)
+    def test_corta_la_descarga_al_pasar_del_limite(self):
+        respuesta = self._respuesta(self.PNG + b'x' * 10000)
+        self.descarga.side_effect = None
+        self.descarga.return_value = respuesta
+        with self.assertRaises(ValueError):
+            self.cache.obtener(self.URL)
+        # Se deja de leer en cuanto se pasa del límite y la conexión se cierra
+        self.assertEqual(len(list(respuesta.iter_content.return_value)), 104 - 3)  # 3 trozos de 100 > 250
+        respuesta.close.assert_called_once()
+        self.assertEqual(os.listdir(self.directorio), [])
+
+    def test_vista_con_cache_del_navegador(self):
+        with mock.patch.object(portadas.portadas, 'directorio', self.directorio):
+            response = self.client.get('/portada/', {'url': self.URL})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertIn('immutable', response['Cache-Control'])
+            repetida = self.client.get('/portada/', {'url': self.URL}, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(repetida.status_code, 304)
+            self.assertEqual(self.client.get('/portada/', {'url': 'http://169.254.169.254/'}).status_code, 400)
+
+            self.descarga.side_effect = requests.exceptions.ConnectionError()
+            otra = 'https://covers.openlibrary.org/b/id/456-M.jpg'
+            self.assertRedirects(self.client.get('/portada/', {'url': otra}), otra, fetch_redirect_response=False)
+
+class MetricasTests(TestCase):
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio)
+        ajustes = override_settings(METRICAS_DIR=self.directorio)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        parche = mock.patch.object(metricas, 'registro', metricas.Registro())
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    @override_settings(METRICAS_SERVER_TIMING=True)
+    def test_server_timing_y_endpoint_por_vista(self):
+        usuario = Usuario.objects.create(nombre='u', email='u@x.com', password_hash='pbkdf2_x')
+        sesion = self.client.session
+        sesion['usuario_id'] = usuario.id
+        sesion.save()
+        response = self.client.get('/usuarios/')
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* consultas"')
+        self.assertNotIn('plantillas;dur=0.0', response['Server-Timing'])
+
+        texto = self.client.get('/metrics').content.decode()
+        self.assertIn('# TYPE app_vista_duracion_segundos histogram', texto)
+        self.assertIn('app_vista_duracion_segundos_count{vista="lista_usuarios"} 1', texto)
+
+    def test_upstream_y_cache_se_atribuyen_a_la_medicion_actual(self):
+        medicion = metricas.Medicion()
+        token = metricas._actual.set(medicion)
+        try:
+            metricas.upstream('api.jikan.moe', 0.2)
+            metricas.upstream('api.jikan.moe', 0.3)
+            metricas.cache('hit')
+        finally:
+            metricas._actual.reset(token)
+        self.assertEqual(medicion.upstream['api.jikan.moe'][0], 2)
+        self.assertIn('api.jikan.moe x2', medicion.server_timing(1.0))
+        self.assertEqual(medicion.cache['hit'], 1)
+
+    def test_exportar_suma_los_volcados_de_todos_los_procesos(self):
+        otro = metricas.Registro()
+        otro.observar('app_upstream_segundos', 'vista="-",host="otro.example"', 0.07)
+        otro.contar('app_cache_respuestas_total', 'vista="-",resultado="miss"', 4)
+        with open(os.path.join(self.directorio, '1.json'), 'w') as archivo:
+            json.dump(otro.estado(), archivo)
+        metricas.upstream('otro.example', 0.2)
+        texto = metricas.exportar()
+        self.assertIn('app_upstream_segundos_bucket{vista="-",host="otro.example",le="0.1"} 1', texto)
+        self.assertIn('app_upstream_segundos_bucket{vista="-",host="otro.example",le="0.25"} 2', texto)
+        self.assertIn('app_cache_respuestas_total{vista="-",resultado="miss"} 4', texto)
+
+
+class StubApisTests(TestCase):
+    def test_responde_grabaciones_e_inyecta_429(self):
+        stub = stub_apis.StubAPI('openlibrary', stub_apis.rutas_openlibrary()).iniciar()
+        self.addCleanup(stub.detener)
+        response = requests.get(f'{stub.url}/search.json', params={'q': 'dune', 'limit': 3}, timeout=5)
+        self.assertEqual(len(response.json()['docs']), 3)
+
+        stub.prob_429, stub.retry_after = 1.0, 7
+        response = requests.get(f'{stub.url}/search.json', timeout=5)
+        self.assertEqual((response.status_code, response.headers['Retry-After']), (429, '7'))
+        self.assertEqual(stub.estadisticas(), {'peticiones': 2, '429': 1})
+
+    def test_limitador_sigue_a_la_url_configurada(self):
+        with override_settings(JIKAN_API_URL='http://127.0.0.1:9999'):
+            self.assertIs(ratelimit.para_host('127.0.0.1:9999'), ratelimit.JIKAN_LIMITER)
+            self.assertIsNone(ratelimit.para_host('api.jikan.moe'))
+        self.assertIs(ratelimit.para_host('api.jikan.moe'), ratelimit.JIKAN_LIMITER)
+
+
+class RecomendadorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuarios = [Usuario.objects.create(nombre=f'u{i}', email=f'u{i}@x.com', password_hash='pbkdf2_x') for i in range(3)]
+        # u0: 1, 2, libro OL1W | u1: 1, 2 | u2: 2, 3
+        for usuario, lote in zip(self.usuarios, [[('anime', '1'), ('anime', '2'), ('libro', 'OL1W')],
+                                             [('anime', '1'), ('anime', '2')],
+                                             [('anime', '2'), ('anime', '3')]]):
+            for tipo, contenido_id in lote:
+                Favorito.objects.create(usuario=usuario, tipo_contenido=tipo, contenido_id=contenido_id,
+                                        contenido_titulo=f'{tipo} {contenido_id}')
+
+    def test_similitud_coseno_top_k(self):
+        recomendador.construir_modelo(k=2)
+        vecinos = list(SimilitudItem.objects.filter(tipo_contenido='anime', contenido_id='1')
+                       .order_by('-score').values_list('vecino_id', 'coocurrencias'))
+        # cos(1, 2) = 2 / sqrt(2 * 3); cos(1, OL1W) = 1 / sqrt(2 * 1)
+        self.assertEqual(vecinos, [('2', 2), ('OL1W', 1)])
+        self.assertFalse(SimilitudItem.objects.filter(contenido_id='1', vecino_id='3').exists())
+
+    def test_recomendar_excluye_favoritos_y_filtra_por_tipo(self):
+        recomendador.construir_modelo()
+        u1 = self.usuarios[1]
+        self.assertEqual([contenido_id for contenido_id, _ in recomendador.recomendar(u1.id, 'anime')], ['3'])
+        self.assertEqual(recomendador.recomendar(u1.id, 'libro')[0][0], 'OL1W')
+
+    def test_reconstruir_invalida_la_memoria_del_proceso(self):
+        recomendador.construir_modelo()
+        self.assertTrue(recomendador.vecinos([('anime', '3')])[('anime', '3')])
+        SimilitudItem.objects.all().delete()
+        self.assertTrue(recomendador.vecinos([('anime', '3')])[('anime', '3')])  # Sigue en memoria
+        recomendador.construir_modelo(min_coocurrencias=5)
+        self.assertEqual(recomendador.vecinos([('anime', '3')])[('anime', '3')], [])
+
+    def test_actualizar_un_favorito_solo_recarga_los_items_afectados(self):
+        recomendador.construir_modelo()
+        recomendador.vecinos([('anime', '1'), ('anime', '3')])
+        with self.assertNumQueries(1):  # Ya en memoria: solo se leen las versiones, en una consulta
+            recomendador.vecinos([('anime', '1'), ('anime', '3')])
+        SimilitudItem.objects.filter(contenido_id='3').delete()  # Solo se vería si se recargara '3'
+        u1 = self.usuarios[1]
+        Favorito.objects.create(usuario=u1, tipo_contenido='libro', contenido_id='OL5W', contenido_titulo='libro')
+        recomendador.actualizar_favorito(u1.id, 'libro', 'OL5W', agregado=True)
+        actuales = recomendador.vecinos([('anime', '1'), ('anime', '3')])
+        self.assertIn('OL5W', [vecino_id for _, vecino_id, _ in actuales[('anime', '1')]])
+        self.assertTrue(actuales[('anime', '3')])
+
+    def _similitudes(self):
+        return {
+            (fila[0], fila[1], fila[2], fila[3]): (round(fila[4], 5), fila[5])
+            for fila in SimilitudItem.objects.values_list(
+                'tipo_contenido', 'contenido_id', 'vecino_tipo', 'vecino_id', 'score', 'coocurrencias')
+        }
+
+    def test_actualizacion_incremental_equivale_a_reconstruir(self):
+        recomendador.construir_modelo()
+        u2 = self.usuarios[2]
+        self.assertEqual([c for c, _ in recomendador.recomendar(u2.id, 'anime')], ['1'])
+
+        Favorito.objects.create(usuario=u2, tipo_contenido='anime', contenido_id='1', contenido_titulo='anime 1')
+        recomendador.actualizar_favorito(u2.id, 'anime', '1', agregado=True)
+        incremental = self._similitudes()
+        self.assertEqual(recomendador.recomendar(u2.id, 'anime'), [])
+        self.assertEqual(recomendador.recomendar(u2.id, 'libro')[0][0], 'OL1W')
+
+        Favorito.objects.filter(usuario=u2, contenido_id='1').delete()
+        recomendador.actualizar_favorito(u2.id, 'anime', '1', agregado=False)
+        self.assertEqual([c for c, _ in recomendador.recomendar(u2.id, 'anime')], ['1'])
+        quitado = self._similitudes()
+
+        recomendador.construir_modelo()
+        self.assertEqual(quitado, self._similitudes())
+        Favorito.objects.create(usuario=u2, tipo_contenido='anime', contenido_id='1', contenido_titulo='anime 1')
+        recomendador.construir_modelo()
+        self.assertEqual(incremental, self._similitudes())
+
+    def test_incremental_usa_la_metrica_y_el_corte_del_modelo(self):
+        u2 = self.usuarios[2]
+        for min_coocurrencias in (1, 2):
+            Favorito.objects.filter(usuario=u2, contenido_id='1').delete()
+            recomendador.construir_modelo(metrica='jaccard', min_coocurrencias=min_coocurrencias)
+            Favorito.objects.create(usuario=u2, tipo_contenido='anime', contenido_id='1', contenido_titulo='anime 1')
+            recomendador.actualizar_favorito(u2.id, 'anime', '1', agregado=True)
+            incremental = self._similitudes()
+            recomendador.construir_modelo(metrica='jaccard', min_coocurrencias=min_coocurrencias)
+            self.assertEqual(incremental, self._similitudes())
+        # jaccard(1, OL1W) = 1 / (3 + 1 - 1) con el corte en 1; con 2 solo queda el par 1-2
+        self.assertEqual(set(incremental), {('anime', '1', 'anime', '2'), ('anime', '2', 'anime', '1')})
+
+
+class ObrasAutorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create(nombre='u', email='u@x.com', password_hash='pbkdf2_x')
+        # Cinco autores: antes solo se consultaban los tres primeros favoritos
+        for n in range(4):
+            Favorito.objects.create(usuario=self.usuario, tipo_contenido='libro', contenido_id=f'OL{n}W',
+                                    contenido_titulo=f'Libro {n}', autor=f'Autor {n}', autor_key=f'OL{n}A')
+        Favorito.objects.create(usuario=self.usuario, tipo_contenido='libro', contenido_id='OL9W',
+                                contenido_titulo='Libro 9', autor='Autor Nueve')
+        self.otro = Usuario.objects.create(nombre='o', email='o@x.com', password_hash='pbkdf2_x')
+        Favorito.objects.create(usuario=self.otro, tipo_contenido='libro', contenido_id='OL8W',
+                                contenido_titulo='Libro 8', autor='Autor Nueve')
+
+    def _docs(self, autor_key, cantidad=3):
+        return {'docs': [{'key': f'/works/{autor_key}{i}W', 'title': f'{autor_key} {i}',
+                          'author_name': ['x'], 'author_key': [autor_key]} for i in range(cantidad)]}
+
+    def test_consulta_todos_los_autores_en_paralelo_y_reutiliza_el_indice(self):
+        def concurrente(urls, limiter, presupuesto, max_workers):
+            datos = {fuente: self._docs(fuente if isinstance(fuente, str) else 'OL9A') for fuente in urls}
+            return datos, {}, []
+
+        with mock.patch('app.recomendaciones.obtener_json_concurrente', side_effect=concurrente) as descarga:
+            libros, error = recomendaciones._recomendaciones_libros(self.usuario.id, list(
+                Favorito.objects.filter(usuario=self.usuario).order_by('id')))
+        self.assertIsNone(error)
+        self.assertEqual(len(descarga.call_args.args[0]), 5)
+        # Por turnos: la primera obra de cada autor, después la segunda...
+        self.assertEqual([l['work_id'] for l in libros[:6]],
+                         ['OL0A0W', 'OL1A0W', 'OL2A0W', 'OL3A0W', 'OL9A0W', 'OL0A1W'])
+        self.assertEqual(Favorito.objects.get(contenido_id='OL9W').autor_key, 'OL9A')
+        # La clave deducida del nombre no se escribe en los favoritos de otros usuarios
+        self.assertIsNone(Favorito.objects.get(contenido_id='OL8W').autor_key)
+        self.assertEqual(ObrasAutor.objects.get(autor_key='OL9A').obras, ['OL9A0W', 'OL9A1W', 'OL9A2W'])
+
+        cache_respuestas.olvidar()
+        RespuestaCache.objects.all().delete()
+        with mock.patch('app.recomendaciones.obtener_json_concurrente', return_value=({}, {}, [])) as descarga:
+            otra_vez, _ = recomendaciones._recomendaciones_libros(self.usuario.id, list(
+                Favorito.objects.filter(usuario=self.usuario).order_by('id')))
+        self.assertEqual(descarga.call_args.args[0], {})  # Todo sale del índice de autores
+        self.assertEqual(otra_vez, libros)
+
+
+class ImportacionTests(TestCase):
+    MAL = (b'<?xml version="1.0" encoding="UTF-8" ?>\n<myanimelist><myinfo><user_id>1</user_id></myinfo>'
+           + b''.join(b'<anime><series_animedb_id>%d</series_animedb_id><series_title><![CDATA[Anime %d]]></series_title>'
+                      b'<my_status>Completed</my_status></anime>' % (n, n) for n in range(1, 8))
+           + b'</myanimelist>')
+    GOODREADS = ('\ufeffBook Id,Title,Author,ISBN,ISBN13,Exclusive Shelf\n'
+                 '1,Dune,Frank Herbert,"=""0441013597""","=""9780441013593""",read\n'
+                 '2,Inventado,Nadie,"=""""","=""""",to-read\n').encode('utf-8')
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create(nombre='u', email='u@x.com', password_hash='pbkdf2_x')
+        Favorito.objects.create(usuario=self.usuario, tipo_contenido='anime', contenido_id='1', contenido_titulo='Anime 1')
+
+    def test_mal_por_lotes_ignora_repetidos_e_invalida(self):
+        cache.set(recomendador.CLAVE_CANDIDATOS.format(usuario_id=self.usuario.id), {'favoritos': set(), 'candidatos': {}})
+        progreso = []
+        with self.settings(IMPORTACION_LOTE=3):
+            resumen = importacion.importar(self.usuario.id, importacion.leer(io.BytesIO(self.MAL)),
+                                           lambda r: progreso.append(r['leidas']))
+        self.assertEqual(progreso, [3, 6, 7])
+        self.assertEqual((resumen['importadas'], resumen['repetidas']), (6, 1))
+        self.assertEqual(Favorito.objects.filter(usuario=self.usuario, tipo_contenido='anime').count(), 7)
+        self.assertIsNone(cache.get(recomendador.CLAVE_CANDIDATOS.format(usuario_id=self.usuario.id)))
+
+        respuesta = b''.join(importacion.exportar_mal(
+            RequestFactory().get('/'), Favorito.objects.filter(usuario=self.usuario)).streaming_content)
+        releidas = list(importacion.leer(io.BytesIO(respuesta)))
+        self.assertEqual(sorted(int(f.contenido_id) for f in releidas), list(range(1, 8)))
+
+    def test_goodreads_resuelve_isbn_en_lote(self):
+        doc = {'key': '/works/OL893415W', 'title': 'Dune', 'author_name': ['Frank Herbert'],
+               'author_key': ['OL79034A'], 'isbn': ['9780441013593', '0441013597']}
+
+        def concurrente(urls, limiter, presupuesto, max_workers):
+            return {clave: {'docs': [doc]} for clave in urls}, {}, []
+
+        with mock.patch('app.importacion.obtener_json_concurrente', side_effect=concurrente) as descarga:
+            resumen = importacion.importar(self.usuario.id, importacion.leer(io.BytesIO(self.GOODREADS)))
+        self.assertEqual(len(descarga.call_args.args[0]), 1)  # Los dos ISBN en una sola búsqueda
+        self.assertEqual((resumen['importadas'], resumen['sin_resolver']), (1, 1))
+        libro = Favorito.objects.get(usuario=self.usuario, tipo_contenido='libro')
+        self.assertEqual((libro.contenido_id, libro.autor_key, libro.autor), ('OL893415W', 'OL79034A', 'Frank Herbert'))
+
+    @override_settings(LISTADOS_CHUNK=2)
+    async def test_exportacion_mal_asgi_por_bloques(self):
+        await Favorito.objects.abulk_create([
+            Favorito(usuario=self.usuario, tipo_contenido='anime', contenido_id=str(n), contenido_titulo=f'Anime {n}')
+            for n in range(2, 5)])
+
+        def iniciar_sesion():
+            sesion = self.client.session
+            sesion['usuario_id'] = self.usuario.id
+            sesion.save()
+        await sync_to_async(iniciar_sesion)()
+        self.async_client.cookies = self.client.cookies
+        response = await self.async_client.get('/mis-favoritos/?formato=mal')
+        self.assertTrue(response.is_async)
+        bloques = [bloque async for bloque in response.streaming_content]
+        self.assertGreater(len(bloques), 2)
+        self.assertEqual(len(list(importacion.leer(io.BytesIO(b''.join(bloques))))), 4)
+
+    def test_vista_importa_y_rechaza_formatos_desconocidos(self):
+        sesion = self.client.session
+        sesion['usuario_id'] = self.usuario.id
+        sesion.save()
+        url = '/mis-favoritos/importar/'
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        with self.settings(IMPORTACION_DIR=directorio, IMPORTACION_LOCAL=False):
+            response = self.client.post(url, {'archivo': SimpleUploadedFile('animelist.xml', self.MAL)}, follow=True)
+            # La petición solo encola: los favoritos llegan cuando el worker procesa la importación
+            self.assertContains(response, 'Importando favoritos')
+            self.assertEqual(Favorito.objects.filter(usuario=self.usuario).count(), 1)
+            fila = ImportacionFavoritos.objects.get(usuario=self.usuario)
+            self.assertEqual(importacion.pendientes(), [fila.pk])
+
+            importacion.procesar(fila.pk)
+            self.assertEqual(Favorito.objects.filter(usuario=self.usuario).count(), 7)
+            self.assertEqual(importacion.pendientes(), [])
+            self.assertEqual(os.listdir(directorio), [])
+            estado = self.client.get(f'/api/v1/favorites/imports/{fila.pk}').json()
+            self.assertEqual((estado['status'], estado['imported'], estado['duplicates']), ('done', 6, 1))
+            self.assertContains(self.client.get('/mis-favoritos/'), 'Importación terminada')
+
+            response = self.client.post(url, {'archivo': SimpleUploadedFile('x.csv', b'a,b\n1,2\n')}, follow=True)
+            self.assertContains(response, 'No se reconoce el archivo')
+            self.assertEqual(ImportacionFavoritos.objects.count(), 1)
+            self.assertEqual(os.listdir(directorio), [])
+
+        otro = Usuario.objects.create(nombre='Otro', email='otro@x.com', password_hash='pbkdf2_x')
+        sesion = self.client.session
+        sesion['usuario_id'] = otro.id
+        sesion.save()
+        self.assertEqual(self.client.get(f'/api/v1/favorites/imports/{fila.pk}').status_code, 404)
+
+
+class PrecalentamientoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        cache_respuestas.olvidar()
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+        for n in range(3):
+            usuario = Usuario.objects.create(nombre=f'u{n}', email=f'u{n}@x.com', password_hash='pbkdf2_x')
+            # El anime 5 lo tienen los tres usuarios; el 6, dos; el 7, uno
+            for contenido_id in ['5', '6', '7'][:3 - n]:
+                Favorito.objects.create(usuario=usuario, tipo_contenido='anime', contenido_id=contenido_id,
+                                        contenido_titulo=f'Anime {contenido_id}')
+            Favorito.objects.create(usuario=usuario, tipo_contenido='libro', contenido_id='OL1W',
+                                    contenido_titulo='Dune', autor='Frank Herbert', autor_key='OL79034A')
+
+    def _descargas(self, pendientes_por_lote):
+        """Simula el fan-out: en cada llamada las `pendientes_por_lote` últimas URLs no llegan a tiempo."""
+        llamadas = []
+
+        def concurrente(urls, limiter, presupuesto, max_workers):
+            llamadas.append(list(urls))
+            claves = list(urls)
+            corte = len(claves) - pendientes_por_lote
+            datos = {}
+            for clave in claves[:corte]:
+                url = urls[clave]
+                if '/top/anime' in url or '/seasons/now' in url:
+                    datos[clave] = {'data': [{'mal_id': 100 + len(llamadas), 'title': 'Listado'}]}
+                elif 'author_key' in url:
+                    datos[clave] = {'docs': [{'key': '/works/OL2W', 'title': 'Dune Messiah', 'author_key': ['OL79034A']}]}
+                else:
+                    datos[clave] = {'data': []}
+            return datos, {}, claves[corte:]
+        return concurrente, llamadas
+
+    def test_recorre_por_popularidad_y_reanuda(self):
+        with self.settings(PRECALENTAR_DIR=self.directorio, PRECALENTAR_LOTE=2):
+            tareas = precalentamiento.planificar(paginas=1, favoritos=2)
+            self.assertEqual([t.clave for t in tareas], [
+                'top:1', 'temporada:1', 'populares:1', 'recomendaciones:5', 'recomendaciones:6', 'autor:OL79034A'])
+
+            # Primera ejecución: en cada lote la última URL se queda sin tiempo
+            concurrente, _ = self._descargas(pendientes_por_lote=1)
+            with mock.patch('app.precalentamiento.obtener_json_concurrente', side_effect=concurrente):
+                resumen = precalentamiento.precalentar(tareas, precalentamiento.Progreso({'p': 1}))
+            self.assertEqual((resumen['descargadas'], resumen['pendientes']), (2, 4))
+            self.assertTrue(os.path.exists(os.path.join(self.directorio, 'progreso.json')))
+
+            # La segunda solo pide lo que faltaba y borra el progreso al terminar
+            progreso = precalentamiento.Progreso({'p': 1})
+            self.assertEqual(progreso.hechas, {'top:1', 'recomendaciones:5'})
+            concurrente, llamadas = self._descargas(pendientes_por_lote=0)
+            with mock.patch('app.precalentamiento.obtener_json_concurrente', side_effect=concurrente):
+                resumen = precalentamiento.precalentar(tareas, progreso)
+            self.assertEqual(sorted(c for lote in llamadas for c in lote),
+                             ['autor:OL79034A', 'populares:1', 'recomendaciones:6', 'temporada:1'])
+            self.assertEqual((resumen['omitidas'], resumen['pendientes']), (2, 0))
+            self.assertFalse(os.path.exists(os.path.join(self.directorio, 'progreso.json')))
+
+        self.assertTrue(ItemCatalogo.objects.filter(tipo_contenido='anime', titulo='Listado').exists())
+        self.assertEqual(ObrasAutor.objects.get(autor_key='OL79034A').obras, ['OL2W'])
+        # La página de recomendaciones encuentra la respuesta en la caché
+        hits, faltan = cache_respuestas.obtener_varios(
+            'jikan_recomendaciones', {'5': recomendaciones.url_recomendaciones_jikan('5')})
+        self.assertEqual((list(hits), faltan), (['5'], {}))
+
+
+class RankingVotosTests(TestCase):
+    def test_votos_fuentes_y_recencia(self):
+        nan = float('nan')
+        votos = np.array([
+            [10, nan],   # 0: muchos votos de un favorito reciente
+            [3, 3],      # 1: dos favoritos lo recomiendan
+            [nan, 40],   # 2: muchos votos, pero de un favorito antiguo
+            [1, nan],    # 3
+        ])
+        self.assertEqual(recomendaciones.ordenar_por_votos(votos, [0, 360], k=4).tolist(), [1, 0, 3, 2])
+        self.assertEqual(recomendaciones.ordenar_por_votos(votos, [360, 0], k=1).tolist(), [2])
+
+    def test_candidatos_de_jikan_agregados_por_favorito(self):
+        ahora = timezone.now()
+        favoritos = [Favorito(contenido_id='1', fecha_agregado=ahora), Favorito(contenido_id='2', fecha_agregado=ahora)]
+
+        def entrada(mal_id, votos):
+            return {'entry': {'mal_id': mal_id, 'title': f'Anime {mal_id}'}, 'votes': votos}
+        resultados = {
+            '1': {'data': [entrada(10, 2), entrada(2, 50), entrada(11, 5)]},
+            '2': {'data': [entrada(11, 4), entrada(12, 1)]},
+        }
+        animes = recomendaciones._recomendaciones_jikan(favoritos, resultados, excluir={'1', '2'}, k=10)
+        self.assertEqual([a['mal_id'] for a in animes], [11, 10, 12])
+
+
+class IndiceVectorialTests(TestCase):
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajustes = override_settings(EMBEDDINGS_DIR=directorio, EMBEDDINGS_DIMENSIONES=256)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        catalogo.guardar('anime', [catalogo.normalizar_anime({
+            'mal_id': 1, 'title': 'Mahou Shoujo', 'synopsis': 'A young witch learns dragon magic.',
+            'genres': [{'name': 'Fantasy'}, {'name': 'Magic'}],
+        })])
+        catalogo.guardar('libro', [
+            catalogo.normalizar_libro({'key': '/works/OL1W', 'title': 'A Wizard of Earthsea',
+                                       'subject': ['Fantasy', 'Magic', 'Dragons'], 'author_name': ['Ursula K. Le Guin']}),
+            catalogo.normalizar_libro({'key': '/works/OL2W', 'title': 'Salt Fat Acid Heat',
+                                       'subject': ['Cooking'], 'author_name': ['Samin Nosrat']}),
+        ])
+
+    def test_anime_devuelve_libros_parecidos(self):
+        self.assertEqual(embeddings.construir(), 3)
+        grupos = embeddings.porque_te_gusto([('anime', '1', 'Mahou Shoujo')], 'libro')
+        self.assertEqual(grupos[0][0], 'Mahou Shoujo')
+        self.assertEqual([contenido_id for contenido_id, _ in grupos[0][1]], ['OL1W'])
+
+    def test_reconstruir_publica_el_indice_nuevo(self):
+        embeddings.construir()
+        self.assertEqual(len(embeddings.indice().ids), 3)
+        catalogo.guardar('anime', [catalogo.normalizar_anime({'mal_id': 2, 'title': 'Otro'})])
+        time.sleep(0.01)
+        embeddings.construir()
+        self.assertEqual(len(embeddings.indice().ids), 4)
+        self.assertEqual(embeddings.indice().bloques, {'anime': (0, 2), 'libro': (2, 4)})
+
+
+@override_settings(SNAPSHOTS_REFRESCO_LOCAL=False)
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.usuario = Usuario.objects.create(nombre='u', email='u@x.com', password_hash='pbkdf2_x')
+        sesion = self.client.session
+        sesion['usuario_id'] = self.usuario.id
+        sesion.save()
+        self.contenido = {'recomendaciones': [{'mal_id': 5, 'title': 'Anime 5'}], 'cruzadas': [],
+                          'error_api': None, 'sin_favoritos': False}
+
+    def test_la_vista_sirve_el_snapshot_guardado(self):
+        with mock.patch('app.snapshots.calcular', return_value=self.contenido) as calcular:
+            self.client.get('/recomendaciones/')
+            response = self.client.get('/recomendaciones/')
+        self.assertEqual(calcular.call_count, 1)  # Solo la primera visita calcula
+        self.assertContains(response, 'Anime 5')
+        self.assertFalse(response.context['refrescando'])
+
+    def test_snapshot_obsoleto_se_muestra_y_se_encola(self):
+        snapshots.guardar(self.usuario.id, 'anime', self.contenido)
+        self.assertEqual(snapshots.marcar_pendientes(self.usuario.id), ['anime'])
+        with mock.patch('app.snapshots.calcular') as calcular, mock.patch('app.snapshots.encolar') as encolar:
+            response = self.client.get('/recomendaciones/')
+        calcular.assert_not_called()
+        encolar.assert_called_once_with(self.usuario.id, 'anime')
+        self.assertTrue(response.context['refrescando'])
+        self.assertContains(response, 'Anime 5')
+        self.assertEqual(snapshots.por_refrescar(), [(self.usuario.id, 'anime')])
+
+    def test_cambio_durante_el_recalculo_sigue_pendiente(self):
+        snapshots.guardar(self.usuario.id, 'anime', self.contenido)
+
+        def calcular(usuario_id, tipo_contenido):
+            snapshots.marcar_pendientes(usuario_id)  # Otro favorito llega mientras se calcula
+            return self.contenido
+
+        with mock.patch('app.snapshots.calcular', side_effect=calcular):
+            snapshots.refrescar(self.usuario.id, 'anime')
+        self.assertTrue(SnapshotRecomendacion.objects.get(usuario=self.usuario).pendiente)
+        with mock.patch('app.snapshots.calcular', return_value=self.contenido):
+            snapshots.refrescar(self.usuario.id, 'anime')
+        self.assertFalse(SnapshotRecomendacion.objects.get(usuario=self.usuario).pendiente)
+
+
+@override_settings(SNAPSHOTS_REFRESCO_LOCAL=False)
+class PresupuestoConsultasTests(TestCase):
+    """El número de consultas por página no debe crecer con el número de favoritos."""
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create(nombre='u', email='u@x.com', password_hash='pbkdf2_x')
+        sesion = self.client.session
+        sesion['usuario_id'] = self.usuario.id
+        sesion.save()
+        catalogo.buscar('anime', 'naruto', lambda: [{'mal_id': 20, 'title': 'Naruto'}])
+        catalogo.buscar('libro', 'dune', lambda: [{'key': '/works/OL1W', 'title': 'Dune'}])
+
+    def _favoritos(self, n):
+        Favorito.objects.bulk_create([
+            Favorito(usuario=self.usuario, tipo_contenido=tipo, contenido_id=f'{i}', contenido_titulo=f'{tipo} {i}')
+            for i in range(n) for tipo in ('anime', 'libro')
+        ], ignore_conflicts=True)
+
+    def _assert_presupuesto(self, url, consultas):
+        self.client.get(url)  # El usuario de la sesión queda en la caché del proceso
+        for n in (1, 25):
+            self._favoritos(n)
+            with self.assertNumQueries(consultas):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_mis_favoritos(self):
+        self._assert_presupuesto('/mis-favoritos/', 2)
+
+    def test_buscar_anime(self):
+        self._assert_presupuesto('/buscar-anime/?query=naruto', 4)
+
+    def test_buscar_libros(self):
+        self._assert_presupuesto('/buscar-libros/?query=dune', 4)
+
+    def test_toggle_invalida_el_conjunto_de_favoritos(self):
+        self.client.get('/buscar-anime/?query=naruto')
+        self.client.post('/toggle-favorito/', {'contenido_id': '20', 'contenido_titulo': 'Naruto',
+                                               'tipo_contenido': 'anime'})
+        with self.assertNumQueries(5):  # Una más: el conjunto se vuelve a leer
+            response = self.client.get('/buscar-anime/?query=naruto')
+        self.assertTrue(response.context['resultados'][0].es_favorito)
+
+    def test_recomendaciones_desde_snapshot(self):
+        snapshots.guardar(self.usuario.id, 'anime', {
+            'recomendaciones': [], 'cruzadas': [], 'error_api': None, 'sin_favoritos': False})
+        self._assert_presupuesto('/recomendaciones/', 2)
+
+    def test_toggle_favorito(self):
+        datos = {'contenido_id': '999', 'contenido_titulo': 'Nuevo', 'tipo_contenido': 'anime'}
+        self.client.get('/mis-favoritos/')  # El usuario de la sesión queda en la caché del proceso
+        for n in (1, 25):
+            self._favoritos(n)
+            # Alta y baja: los vecinos del item se recalculan con un número fijo de consultas
+            with self.assertNumQueries(21):
+                self.assertEqual(self.client.post('/toggle-favorito/', datos).status_code, 302)
+            with self.assertNumQueries(16):
+                self.assertEqual(self.client.post('/toggle-favorito/', datos).status_code, 302)
+
+    def test_lista_usuarios(self):
+        self._assert_presupuesto('/usuarios/', 2)
+        # Con más usuarios que una página, la siguiente tampoco cuenta la tabla
+        Usuario.objects.bulk_create([
+            Usuario(nombre=f'u{i}', email=f'u{i}@x.com', password_hash='pbkdf2_x') for i in range(120)])
+        with self.assertNumQueries(2):
+            response = self.client.get('/usuarios/')
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(f"/usuarios/?cursor={response.context['siguiente']}").status_code, 200)
+
+
+class UsuarioSesionTests(TestCase):
+    def setUp(self):
+        self.usuario = Usuario.objects.create(nombre='Ana', email='ana@x.com', password_hash='pbkdf2_x')
+        sesion = self.client.session
+        sesion['usuario_id'] = self.usuario.id
+        sesion.save()
+
+    def test_usuario_en_cache_del_proceso(self):
+        self.assertEqual(sesion.obtener_usuario(self.usuario.id), self.usuario)
+        with self.assertNumQueries(0):
+            self.assertEqual(sesion.obtener_usuario(self.usuario.id).nombre, 'Ana')
+
+    def test_cambios_de_perfil_invalidan_la_cache(self):
+        usuario_id = self.usuario.id
+        sesion.obtener_usuario(usuario_id)
+        self.usuario.nombre = 'Ana María'
+        self.usuario.save()
+        self.assertEqual(sesion.obtener_usuario(usuario_id).nombre, 'Ana María')
+        self.usuario.delete()
+        self.assertIsNone(sesion.obtener_usuario(usuario_id))
+
+    def test_sesion_de_usuario_borrado_se_cierra(self):
+        self.usuario.delete()
+        response = self.client.get('/mis-favoritos/')
+        self.assertRedirects(response, '/login/', fetch_redirect_response=False)
+        self.assertNotIn('usuario_id', self.client.session)
+
+
+class VistasAsincronasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        usuario = Usuario.objects.create(nombre='u', email='u@x.com', password_hash='pbkdf2_x')
+        sesion = self.client.session
+        sesion['usuario_id'] = usuario.id
+        sesion.save()
+        self.async_client.cookies = self.client.cookies
+
+    async def test_busqueda_por_asgi_sin_bloquear(self):
+        jikan = mock.AsyncMock(return_value={'data': [{'mal_id': 1, 'title': 'Cowboy Bebop'}]})
+        with mock.patch('app.http_cache.acliente.get_json', jikan):
+            response = await self.async_client.get('/buscar-anime/', {'query': 'cowboy'})
+            self.assertContains(response, 'Cowboy Bebop')
+            # La segunda vez sale del catálogo local
+            await self.async_client.get('/buscar-anime/', {'query': 'Cowboy'})
+        jikan.assert_awaited_once()
+
+    async def test_sin_sesion_redirige_al_login(self):
+        self.async_client.cookies.clear()
+        response = await self.async_client.get('/recomendaciones-libros/')
+        self.assertRedirects(response, '/login/', fetch_redirect_response=False)
+
+
+class ListadosTests(TestCase):
+    def setUp(self):
+        self.usuario = Usuario.objects.create(nombre='u', email='u@x.com', password_hash='pbkdf2_x')
+        sesion = self.client.session
+        sesion['usuario_id'] = self.usuario.id
+        sesion.save()
+        Favorito.objects.bulk_create([
+            Favorito(usuario=self.usuario, tipo_contenido='anime', contenido_id=str(i), contenido_titulo=f'Anime {i}')
+            for i in range(7)
+        ])
+        # Varias filas con la misma fecha: el id desempata
+        Favorito.objects.filter(contenido_id__in=['2', '3', '4']).update(fecha_agregado=timezone.now())
+
+    @override_settings(LISTADOS_TAMANO_PAGINA=3)
+    def test_paginacion_por_cursor_recorre_todo_sin_repetir(self):
+        vistos, url = [], '/mis-favoritos/'
+        while url:
+            response = self.client.get(url)
+            vistos.extend(f.contenido_id for f in response.context['favoritos'])
+            siguiente = response.context['siguiente']
+            url = f'/mis-favoritos/?cursor={siguiente}' if siguiente else None
+        esperado = Favorito.objects.order_by('-fecha_agregado', '-id').values_list('contenido_id', flat=True)
+        self.assertEqual(vistos, list(esperado))
+
+    def test_cursor_invalido_vuelve_a_la_primera_pagina(self):
+        response = self.client.get('/mis-favoritos/?cursor=no-es-un-cursor')
+        self.assertEqual(len(response.context['favoritos']), 7)
+
+    def test_exportacion_en_streaming(self):
+        response = self.client.get('/mis-favoritos/?formato=jsonl')
+        self.assertTrue(response.streaming)
+        lineas = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lineas), 7)
+        self.assertEqual(set(json.loads(lineas[0])), {
+            'contenido_id', 'contenido_titulo', 'tipo_contenido', 'autor', 'autor_key', 'fecha_agregado'})
+
+        response = self.client.get('/usuarios/?formato=csv')
+        filas = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(filas, ['id,nombre,email,rol', f'{self.usuario.id},u,u@x.com,usuario'])
+
+    @override_settings(LISTADOS_CHUNK=3)
+    async def test_exportacion_asgi_por_bloques(self):
+        self.async_client.cookies = self.client.cookies  # La sesión creada en setUp
+        response = await self.async_client.get('/mis-favoritos/?formato=csv')
+        self.assertTrue(response.streaming)
+        self.assertTrue(response.is_async)
+        bloques = [bloque async for bloque in response.streaming_content]
+        # Cabecera + 7 filas, de 3 en 3 líneas
+        self.assertEqual(len(bloques), 3)
+        self.assertEqual(b''.join(bloques).decode().count('\r\n'), 8)
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create(nombre='u', email='u@x.com', password_hash='pbkdf2_x')
+        sesion = self.client.session
+        sesion['usuario_id'] = self.usuario.id
+        sesion.save()
+        self.async_client.cookies = self.client.cookies
+
+    def test_sin_sesion_responde_401(self):
+        self.client.cookies.clear()
+        response = self.client.get('/api/v1/favorites')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'error': 'Autenticación requerida'})
+
+    async def test_busqueda_devuelve_registros_recortados(self):
+        jikan = mock.AsyncMock(return_value={'data': [{
+            'mal_id': 30, 'title': 'Neon Genesis Evangelion', 'episodes': 26, 'score': 8.75, 'synopsis': 'x' * 500,
+            'genres': [{'name': 'Action'}], 'images': {'jpg': {'image_url': 'https://img/1.jpg'}},
+        }]})
+        with mock.patch('app.http_cache.acliente.get_json', jikan):
+            response = await self.async_client.get('/api/v1/anime/search', {'q': 'evangelion'})
+        item = response.json()['results'][0]
+        self.assertNotIn('synopsis', item)
+        self.assertEqual(item['id'], 30)
+        self.assertEqual(item['score'], 8.75)
+        self.assertEqual(item['image'], 'https://img/1.jpg')
+        self.assertFalse(item['favorite'])
+
+    async def test_busqueda_repetida_responde_304_sin_buscar(self):
+        jikan = mock.AsyncMock(return_value={'data': [{'mal_id': 30, 'title': 'Neon Genesis Evangelion'}]})
+        with mock.patch('app.http_cache.acliente.get_json', jikan):
+            response = await self.async_client.get('/api/v1/anime/search', {'q': 'evangelion'})
+        self.assertIn('Last-Modified', response)
+        with mock.patch('app.catalogo.abuscar_con_api') as buscar:
+            repetida = await self.async_client.get('/api/v1/anime/search', {'q': 'evangelion'},
+                                                   headers={'If-None-Match': response['ETag']})
+            self.assertEqual(repetida.status_code, 304)
+            desde = await self.async_client.get('/api/v1/anime/search', {'q': 'evangelion'},
+                                                headers={'If-Modified-Since': response['Last-Modified']})
+            self.assertEqual(desde.status_code, 304)
+        buscar.assert_not_called()
+
+        # Marcar un resultado como favorito cambia el ETag y la fecha, aunque la consulta siga igual
+        await sync_to_async(Favorito.objects.create)(
+            usuario=self.usuario, tipo_contenido='anime', contenido_id='30', contenido_titulo='Evangelion')
+        await sync_to_async(favoritos.invalidar)(self.usuario.id, 'anime')
+        for cabeceras in ({'If-None-Match': response['ETag']}, {'If-Modified-Since': response['Last-Modified']}):
+            cambiada = await self.async_client.get('/api/v1/anime/search', {'q': 'evangelion'}, headers=cabeceras)
+            self.assertEqual(cambiada.status_code, 200)
+            self.assertTrue(cambiada.json()['results'][0]['favorite'])
+
+    def test_if_none_match_responde_304(self):
+        Favorito.objects.create(usuario=self.usuario, tipo_contenido='libro', contenido_id='OL1W',
+                                contenido_titulo='Dune', autor='Frank Herbert')
+        response = self.client.get('/api/v1/favorites')
+        self.assertEqual(response.json()['results'][0]['type'], 'books')
+        repetida = self.client.get('/api/v1/favorites', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repetida.status_code, 304)
+        self.assertEqual(repetida.content, b'')
+        desde = self.client.get('/api/v1/favorites', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(desde.status_code, 304)
+
+        Favorito.objects.create(usuario=self.usuario, tipo_contenido='anime', contenido_id='1',
+                                contenido_titulo='Cowboy Bebop')
+        cambiada = self.client.get('/api/v1/favorites', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cambiada.status_code, 200)
+
+    @override_settings(SNAPSHOTS_REFRESCO_LOCAL=False)
+    def test_if_modified_since_tras_quitar_un_favorito(self):
+        datos = {'contenido_id': '1', 'contenido_titulo': 'Cowboy Bebop', 'tipo_contenido': 'anime'}
+        self.client.post('/toggle-favorito/', dict(datos, contenido_id='2', contenido_titulo='Trigun'))
+        self.client.post('/toggle-favorito/', datos)
+        response = self.client.get('/api/v1/favorites')
+        self.assertEqual(len(response.json()['results']), 2)
+        # La baja no cambia ningún fecha_agregado, pero sí la fecha de los favoritos del usuario
+        self.client.post('/toggle-favorito/', datos)
+        cambiada = self.client.get('/api/v1/favorites', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cambiada.status_code, 200)
+        self.assertEqual([fila['id'] for fila in cambiada.json()['results']], ['2'])
+        repetida = self.client.get('/api/v1/favorites', HTTP_IF_MODIFIED_SINCE=cambiada['Last-Modified'])
+        self.assertEqual(repetida.status_code, 304)
+
+    def test_recomendaciones_con_if_modified_since(self):
+        snapshots.guardar(self.usuario.id, 'libro', {
+            'recomendaciones': [{'work_id': 'OL2W', 'title': 'Hyperion', 'author_name': 'Dan Simmons',
+                                 'first_publish_year': 'N/A', 'cover_url': None}],
+            'cruzadas': [], 'error_api': None, 'sin_favoritos': False})
+        response = self.client.get('/api/v1/recommendations/books')
+        libro = response.json()['results'][0]
+        self.assertEqual(libro['authors'], ['Dan Simmons'])
+        self.assertIsNone(libro['year'])
+        repetida = self.client.get('/api/v1/recommendations/books',
+                                   HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(repetida.status_code, 304)
+        self.assertEqual(self.client.get('/api/v1/recommendations/mangas').status_code, 404)
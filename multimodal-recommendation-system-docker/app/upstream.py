@@ -0,0 +1,307 @@
+"""
+Cliente HTTP compartido para las APIs externas (Jikan, OpenLibrary).
+
+Mantiene una sesión con pool de conexiones keep-alive por host, aplica
+timeouts explícitos, reintentos acotados con backoff exponencial con jitter y
+un circuit breaker por host que falla rápido cuando la API está caída. Las
+latencias van a `metricas` (app_upstream_segundos en /metrics). `acliente` es
+la versión asíncrona (httpx) que usan las vistas ASGI.
+"""
+import asyncio
+import random
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from django.conf import settings
+from django.utils.http import parse_http_date_safe
+from requests.adapters import HTTPAdapter
+
+from . import metricas, ratelimit
+
+# Códigos de estado que merece la pena reintentar
+_REINTENTABLES = {429, 500, 502, 503, 504}
+
+
+def segundos_retry_after(valor):
+    """Segundos que pide una cabecera Retry-After (número o fecha HTTP); None si no hay o no se entiende."""
+    if not valor:
+        return None
+    try:
+        segundos = float(valor)
+    except ValueError:
+        fecha = parse_http_date_safe(valor)
+        if fecha is None:
+            return None
+        segundos = fecha - time.time()
+    return min(max(segundos, 0.0), settings.RATELIMIT_RETRY_AFTER_MAX)
+
+
+class CircuitoAbierto(requests.exceptions.ConnectionError):
+    """El circuit breaker del host está abierto: no se intenta la petición."""
+
+
+class CircuitBreaker:
+    """
+    Tras `umbral` fallos seguidos el circuito se abre durante `enfriamiento`
+    segundos; después deja pasar una petición de prueba (semiabierto) y se
+    cierra si sale bien.
+    """
+
+    def __init__(self, umbral, enfriamiento):
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self._fallos = 0
+        self._abierto_hasta = 0.0
+        self._probando = False
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        with self._lock:
+            if self._fallos < self.umbral:
+                return True
+            if time.monotonic() < self._abierto_hasta or self._probando:
+                return False
+            self._probando = True  # Semiabierto: una sola petición de prueba
+            return True
+
+    def exito(self):
+        with self._lock:
+            self._fallos = 0
+            self._probando = False
+
+    def liberar(self):
+        """La petición no llegó a dar resultado (p. ej. se canceló): si era la de prueba, otra podrá probar."""
+        with self._lock:
+            self._probando = False
+
+    def fallo(self):
+        with self._lock:
+            self._fallos += 1
+            self._probando = False
+            if self._fallos >= self.umbral:
+                self._abierto_hasta = time.monotonic() + self.enfriamiento
+
+    @property
+    def abierto(self):
+        with self._lock:
+            return self._fallos >= self.umbral and time.monotonic() < self._abierto_hasta
+
+
+class UpstreamClient:
+    def __init__(self, timeout, reintentos, backoff, backoff_max, pool, umbral_fallos, enfriamiento):
+        self.timeout = timeout  # (connect, read)
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.pool = pool
+        self.umbral_fallos = umbral_fallos
+        self.enfriamiento = enfriamiento
+        self._sesiones = {}
+        self._circuitos = {}
+        self._lock = threading.Lock()
+
+    def _por_host(self, host):
+        with self._lock:
+            if host not in self._sesiones:
+                sesion = requests.Session()
+                adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool)
+                sesion.mount('https://', adaptador)
+                sesion.mount('http://', adaptador)
+                sesion.headers.update({
+                    'Accept': 'application/json',
+                    'Accept-Encoding': 'gzip, deflate',
+                    'Connection': 'keep-alive',
+                })
+                self._sesiones[host] = sesion
+                self._circuitos[host] = CircuitBreaker(self.umbral_fallos, self.enfriamiento)
+            return self._sesiones[host], self._circuitos[host]
+
+    def _demasiadas_peticiones(self, host, retry_after):
+        """Tras un 429 frena a todos los procesos que usan el host; devuelve la pausa mínima antes de reintentar."""
+        pausa = segundos_retry_after(retry_after)
+        if pausa is None:
+            pausa = settings.RATELIMIT_RETRY_AFTER_DEFECTO
+        limitador = ratelimit.para_host(host)
+        if limitador is not None:
+            limitador.penalizar(pausa)
+        return pausa
+
+    @staticmethod
+    def _observar(host, inicio):
+        metricas.upstream(host, time.monotonic() - inicio)
+
+    def _espera(self, intento):
+        # Full jitter: uniforme entre 0 y el backoff exponencial
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** intento)))
+
+    def get(self, url, params=None, timeout=None, headers=None, stream=False):
+        """
+        GET con reintentos y circuit breaker. `timeout` (segundos) acota el
+        tiempo total, reintentos incluidos. Devuelve la respuesta ya validada
+        con `raise_for_status()`; con `stream` el cuerpo queda por leer y
+        quien llama debe cerrarla. `headers` se suma a las de la sesión.
+        """
+        host = urlsplit(url).netloc
+        sesion, circuito = self._por_host(host)
+        limite = None if timeout is None else time.monotonic() + timeout
+        intento = 0
+        while True:
+            if not circuito.permitir():
+                raise CircuitoAbierto(f"Circuito abierto para {host}")
+            pausa = 0.0
+            timeout_peticion = self.timeout
+            if limite is not None:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    raise requests.exceptions.Timeout(f"Sin tiempo para consultar {host}")
+                timeout_peticion = (min(self.timeout[0], restante), min(self.timeout[1], restante))
+
+            inicio = time.monotonic()
+            try:
+                response = sesion.get(url, params=params, timeout=timeout_peticion, headers=headers, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._observar(host, inicio)
+                circuito.fallo()
+                error = e
+            except requests.exceptions.RequestException:
+                # Cuerpo cortado, demasiadas redirecciones...: fallo del host, pero no se reintenta
+                self._observar(host, inicio)
+                circuito.fallo()
+                raise
+            except BaseException:
+                circuito.liberar()
+                raise
+            else:
+                self._observar(host, inicio)
+                if response.status_code >= 500:
+                    circuito.fallo()
+                else:
+                    circuito.exito()
+                if response.status_code not in _REINTENTABLES:
+                    if response.status_code >= 400:
+                        response.close()  # Con `stream` la conexión vuelve al pool sin leer el cuerpo
+                    response.raise_for_status()
+                    return response
+                response.close()
+                if response.status_code == 429:
+                    pausa = self._demasiadas_peticiones(host, response.headers.get('Retry-After'))
+                error = requests.exceptions.HTTPError(f"{response.status_code} para {url}", response=response)
+
+            espera = max(self._espera(intento), pausa)
+            if intento >= self.reintentos or (limite is not None and time.monotonic() + espera >= limite):
+                raise error
+            time.sleep(espera)
+            intento += 1
+
+    def get_json(self, url, params=None, timeout=None):
+        return self.get(url, params=params, timeout=timeout).json()
+
+    def circuito_abierto(self, host):
+        return self._por_host(host)[1].abierto
+
+
+class AsyncUpstreamClient:
+    """
+    Versión asíncrona de `UpstreamClient` sobre httpx. Comparte con el cliente
+    síncrono la configuración y los circuit breakers por host, y traduce los
+    errores a las excepciones de `requests` para que las vistas los traten
+    igual.
+    """
+
+    def __init__(self, base, max_conexiones=100, transport=None):
+        self.base = base
+        self.max_conexiones = max_conexiones
+        self.transport = transport
+        self._clientes = weakref.WeakKeyDictionary()  # bucle de eventos -> httpx.AsyncClient
+
+    def _cliente(self):
+        # Un httpx.AsyncClient solo puede usarse desde el bucle en el que se creó
+        bucle = asyncio.get_running_loop()
+        cliente_http = self._clientes.get(bucle)
+        if cliente_http is None:
+            cliente_http = httpx.AsyncClient(
+                headers={'Accept': 'application/json', 'Accept-Encoding': 'gzip, deflate'},
+                limits=httpx.Limits(max_connections=self.max_conexiones,
+                                    max_keepalive_connections=self.base.pool),
+                follow_redirects=True,
+                transport=self.transport,
+            )
+            self._clientes[bucle] = cliente_http
+        return cliente_http
+
+    async def get(self, url, params=None, timeout=None):
+        """Igual que `UpstreamClient.get()`, sin bloquear el bucle de eventos."""
+        host = urlsplit(url).netloc
+        _, circuito = self.base._por_host(host)
+        limite = None if timeout is None else time.monotonic() + timeout
+        intento = 0
+        while True:
+            if not circuito.permitir():
+                raise CircuitoAbierto(f"Circuito abierto para {host}")
+            pausa = 0.0
+            conexion, lectura = self.base.timeout
+            if limite is not None:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    raise requests.exceptions.Timeout(f"Sin tiempo para consultar {host}")
+                conexion, lectura = min(conexion, restante), min(lectura, restante)
+
+            inicio = time.monotonic()
+            try:
+                response = await self._cliente().get(
+                    url, params=params, timeout=httpx.Timeout(lectura, connect=conexion))
+            except httpx.TimeoutException as e:
+                self.base._observar(host, inicio)
+                circuito.fallo()
+                error = requests.exceptions.Timeout(str(e) or f"Timeout consultando {host}")
+            except httpx.TransportError as e:
+                self.base._observar(host, inicio)
+                circuito.fallo()
+                error = requests.exceptions.ConnectionError(str(e) or f"Error de conexión con {host}")
+            except httpx.HTTPError as e:
+                self.base._observar(host, inicio)
+                circuito.fallo()
+                raise requests.exceptions.RequestException(str(e) or f"Error consultando {host}") from e
+            except BaseException:
+                # Cancelada (el cliente cerró la conexión) o error propio: no cuenta, pero libera la prueba
+                circuito.liberar()
+                raise
+            else:
+                self.base._observar(host, inicio)
+                if response.status_code >= 500:
+                    circuito.fallo()
+                else:
+                    circuito.exito()
+                if response.status_code not in _REINTENTABLES:
+                    if response.is_error:
+                        raise requests.exceptions.HTTPError(f"{response.status_code} para {url}")
+                    return response
+                if response.status_code == 429:
+                    pausa = self.base._demasiadas_peticiones(host, response.headers.get('Retry-After'))
+                error = requests.exceptions.HTTPError(f"{response.status_code} para {url}")
+
+            espera = max(self.base._espera(intento), pausa)
+            if intento >= self.base.reintentos or (limite is not None and time.monotonic() + espera >= limite):
+                raise error
+            await asyncio.sleep(espera)
+            intento += 1
+
+    async def get_json(self, url, params=None, timeout=None):
+        return (await self.get(url, params=params, timeout=timeout)).json()
+
+
+cliente = UpstreamClient(
+    timeout=settings.UPSTREAM_TIMEOUT,
+    reintentos=settings.UPSTREAM_REINTENTOS,
+    backoff=settings.UPSTREAM_BACKOFF,
+    backoff_max=settings.UPSTREAM_BACKOFF_MAX,
+    pool=settings.UPSTREAM_POOL_SIZE,
+    umbral_fallos=settings.UPSTREAM_CIRCUITO_UMBRAL,
+    enfriamiento=settings.UPSTREAM_CIRCUITO_ENFRIAMIENTO,
+)
+
+acliente = AsyncUpstreamClient(cliente, max_conexiones=settings.UPSTREAM_ASYNC_MAX_CONEXIONES)
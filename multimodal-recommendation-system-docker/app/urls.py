@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.urls import path, include
-from . import views
+from . import api, views
 
 # Todas las URLs sin prefijos de idioma
 urlpatterns = [
@@ -15,6 +15,15 @@ urlpatterns = [
     path('buscar-libros/', views.buscar_libros, name='buscar_libros'),
     path('toggle-favorito/', views.toggle_favorito, name='toggle_favorito'),
     path('mis-favoritos/', views.mis_favoritos, name='mis_favoritos'),
+    path('mis-favoritos/importar/', views.importar_favoritos, name='importar_favoritos'),
     path('recomendaciones/', views.recomendaciones_anime, name='recomendaciones_anime'),
     path('recomendaciones-libros/', views.recomendaciones_libros, name='recomendaciones_libros'),
+    path('portada/', views.portada, name='portada'),
+    path('metrics', views.metrics, name='metrics'),
+    # API JSON versionada
+    path('api/v1/anime/search', api.buscar_anime, name='api_buscar_anime'),
+    path('api/v1/books/search', api.buscar_libros, name='api_buscar_libros'),
+    path('api/v1/recommendations/<str:tipo>', api.recomendaciones, name='api_recomendaciones'),
+    path('api/v1/favorites', api.lista_favoritos, name='api_favoritos'),
+    path('api/v1/favorites/imports/<int:importacion_id>', api.estado_importacion, name='api_estado_importacion'),
 ]
\ No newline at end of file
@@ -1,25 +1,31 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django.contrib import messages
+from django.core.cache import cache
 from .models import Usuario, Favorito
 from .forms import UsuarioForm, LoginForm, AnimeSearchForm, LibroSearchForm
+from . import catalogo, favoritos, importacion, items, listados, metricas, portadas, recomendador, snapshots
+from .paginas import cache_publica
+from .sesion import usuario_requerido
 from django.utils.translation import activate
 from django.utils import translation
 import requests
-import time # Added for rate limiting in recommendations
 
+@cache_publica
 def index(request):
     user_info = ""
-    if 'usuario_id' in request.session:
-        try:
-            usuario = Usuario.objects.get(id=request.session['usuario_id'])
-            user_info = f"<p>Bienvenido, {usuario.nombre}! (<a href='/logout/'>Cerrar sesión</a>)</p>"
-            # Adding links for new features if user is logged in
-            user_info += "<p><a href='/buscar-anime/'>Buscar Anime</a> | <a href='/buscar-libros/'>Buscar Libros</a> | <a href='/mis-favoritos/'>Mis Favoritos</a> | <a href='/recomendaciones/'>Recomendaciones Anime</a> | <a href='/recomendaciones-libros/'>Recomendaciones Libros</a></p>"
-        except Usuario.DoesNotExist:
-            request.session.flush() # Clear session if user ID is invalid
-            user_info = "<p><a href='/login/'>Iniciar sesión</a> | <a href='/registro/'>Registrarse</a></p>"
+    if request.usuario is not None:
+        usuario = request.usuario
+        user_info = f"<p>Bienvenido, {usuario.nombre}! (<a href='/logout/'>Cerrar sesión</a>)</p>"
+        # Adding links for new features if user is logged in
+        user_info += "<p><a href='/buscar-anime/'>Buscar Anime</a> | <a href='/buscar-libros/'>Buscar Libros</a> | <a href='/mis-favoritos/'>Mis Favoritos</a> | <a href='/recomendaciones/'>Recomendaciones Anime</a> | <a href='/recomendaciones-libros/'>Recomendaciones Libros</a></p>"
     else:
+        if 'usuario_id' in request.session:
+            request.session.flush() # Clear session if user ID is invalid
         user_info = "<p><a href='/login/'>Iniciar sesión</a> | <a href='/registro/'>Registrarse</a></p>"
     
     return HttpResponse(f"<h1>¡Hola, Django desde Docker!</h1>{user_info}<br><a href='/usuarios/'>Ver usuarios (requiere login)</a>")
@@ -36,21 +42,21 @@ def registro_usuario(request):
     
     return render(request, 'registro.html', {'form': form})
 
+@usuario_requerido('Debes iniciar sesión para ver la lista de usuarios.')
 def lista_usuarios(request):
-    if 'usuario_id' not in request.session:
-        messages.warning(request, 'Debes iniciar sesión para ver la lista de usuarios.')
-        return redirect('login_usuario')
-    
-    try:
-        # Ensure the logged-in user exists
-        Usuario.objects.get(id=request.session['usuario_id'])
-    except Usuario.DoesNotExist:
-        request.session.flush()
-        messages.error(request, 'Tu sesión no es válida o ha expirado. Por favor, inicia sesión nuevamente.')
-        return redirect('login_usuario')
-    
     usuarios = Usuario.objects.all()
-    return render(request, 'lista_usuarios.html', {'usuarios': usuarios})
+    formato = request.GET.get('formato')
+    if formato in listados.FORMATOS:
+        return listados.exportar(request, usuarios.order_by('id'), ['id', 'nombre', 'email', 'rol'], formato, 'usuarios')
+
+    usuarios, siguiente = listados.paginar(
+        usuarios.only('id', 'nombre', 'email', 'rol'), ['id'], request.GET.get('cursor'))
+    return render(request, 'lista_usuarios.html', {
+        'usuarios': usuarios,
+        'siguiente': siguiente,
+        # Un COUNT(*) recorre la tabla entera: se recalcula como mucho cada USUARIOS_TOTAL_TTL
+        'total': cache.get_or_set('usuarios:total', Usuario.objects.count, settings.USUARIOS_TOTAL_TTL),
+    })
 
 def login_usuario(request):
     if request.method == 'POST':
@@ -73,65 +79,41 @@ def logout_usuario(request):
     messages.success(request, '¡Sesión cerrada exitosamente!')
     return redirect('index')
 
-def buscar_anime(request):
-    if 'usuario_id' not in request.session:
-        messages.warning(request, 'Debes iniciar sesión para buscar anime.')
-        return redirect('login_usuario')
-
-    try:
-        current_user = Usuario.objects.get(id=request.session['usuario_id'])
-    except Usuario.DoesNotExist:
-        request.session.flush()
-        messages.error(request, 'Tu sesión no es válida. Por favor, inicia sesión nuevamente.')
-        return redirect('login_usuario')
+@usuario_requerido('Debes iniciar sesión para buscar anime.')
+async def buscar_anime(request):
+    current_user = request.usuario
 
     form = AnimeSearchForm()
     resultados_api = None
     error_api = None
     
-    favoritos_ids = list(Favorito.objects.filter(usuario=current_user, tipo_contenido='anime').values_list('contenido_id', flat=True))
+    favoritos_ids = await sync_to_async(favoritos.ids_favoritos)(current_user.id, 'anime')
 
     if request.method == 'GET' and 'query' in request.GET:
         form = AnimeSearchForm(request.GET)
         if form.is_valid():
             query = form.cleaned_data['query']
             try:
-                # Using sfw filter to ensure content is generally safe for work
-                response = requests.get(f"https://api.jikan.moe/v4/anime?q={query}&sfw")
-                response.raise_for_status() 
-                resultados_api = response.json().get('data', [])
+                # Primero el catálogo local; Jikan solo para consultas nuevas o caducadas.
+                resultados_api = await catalogo.abuscar_con_api('anime', query)
             except requests.exceptions.RequestException as e:
                 error_api = f"Error al contactar la API de Jikan: {e}"
             except ValueError: 
                 error_api = "Error al procesar la respuesta de la API de Jikan."
     
-    resultados_procesados = []
-    if resultados_api:
-        for anime_data in resultados_api:
-            mal_id = anime_data.get('mal_id')
-            if isinstance(mal_id, int):
-                anime_data['es_favorito'] = str(mal_id) in favoritos_ids
-            else:
-                anime_data['es_favorito'] = False 
-            resultados_procesados.append(anime_data)
+    resultados_procesados = items.lista('anime', resultados_api or [])
+    for anime in resultados_procesados:
+        anime.es_favorito = anime.contenido_id in favoritos_ids
 
-    return render(request, 'anime_search.html', {
+    return await sync_to_async(render)(request, 'anime_search.html', {
         'form': form,
         'resultados': resultados_procesados,
         'error_api': error_api
     })
 
+@usuario_requerido('Debes iniciar sesión para gestionar tus favoritos.', nivel=messages.ERROR, volver=True)
 def toggle_favorito(request):
-    if 'usuario_id' not in request.session:
-        messages.error(request, 'Debes iniciar sesión para gestionar tus favoritos.')
-        return redirect(request.META.get('HTTP_REFERER', 'login_usuario'))
-
-    try:
-        usuario = Usuario.objects.get(id=request.session['usuario_id'])
-    except Usuario.DoesNotExist:
-        request.session.flush()
-        messages.error(request, 'Tu sesión no es válida. Por favor, inicia sesión nuevamente.')
-        return redirect(request.META.get('HTTP_REFERER', 'login_usuario'))
+    usuario = request.usuario
 
     if request.method == 'POST':
         contenido_id = request.POST.get('contenido_id') or request.POST.get('anime_id')
@@ -142,6 +124,10 @@ def toggle_favorito(request):
         if not contenido_id or not contenido_titulo:
             messages.error(request, 'Datos incompletos para marcar como favorito.')
             return redirect(request.META.get('HTTP_REFERER', 'buscar_anime'))
+        # Los ids de MyAnimeList son números: el catálogo los guarda como mal_id entero
+        if tipo_contenido == 'anime' and not str(contenido_id).isdigit():
+            messages.error(request, 'Identificador de anime no válido.')
+            return redirect(request.META.get('HTTP_REFERER', 'buscar_anime'))
 
         try:
             favorito_existente, created = Favorito.objects.get_or_create(
@@ -150,7 +136,8 @@ def toggle_favorito(request):
                 tipo_contenido=tipo_contenido,
                 defaults={
                     'contenido_titulo': contenido_titulo,
-                    'autor': autor if tipo_contenido == 'libro' else None
+                    'autor': autor if tipo_contenido == 'libro' else None,
+                    'autor_key': (request.POST.get('autor_key') or None) if tipo_contenido == 'libro' else None,
                 }
             )
             
@@ -159,6 +146,13 @@ def toggle_favorito(request):
             else:
                 favorito_existente.delete()
                 messages.info(request, f'"{contenido_titulo}" eliminado de tus favoritos.')
+
+            favoritos.invalidar(usuario.id, tipo_contenido)
+            # Solo se recalculan los vecinos del item y los candidatos de este usuario
+            recomendador.actualizar_favorito(usuario.id, tipo_contenido, str(contenido_id), agregado=created)
+            # Las páginas de recomendaciones se recalculan en segundo plano
+            for tipo in snapshots.marcar_pendientes(usuario.id):
+                snapshots.encolar(usuario.id, tipo)
                 
         except Exception as e:
             messages.error(request, f'Ocurrió un error al procesar tu solicitud: {str(e)}')
@@ -167,206 +161,139 @@ def toggle_favorito(request):
 
     return redirect(request.META.get('HTTP_REFERER', 'buscar_anime'))
 
+@usuario_requerido('Debes iniciar sesión para ver tus favoritos.')
 def mis_favoritos(request):
-    if 'usuario_id' not in request.session:
-        messages.warning(request, 'Debes iniciar sesión para ver tus favoritos.')
-        return redirect('login_usuario')
+    favoritos = Favorito.objects.filter(usuario=request.usuario)
+    formato = request.GET.get('formato')
+    if formato in listados.FORMATOS:
+        campos = ['contenido_id', 'contenido_titulo', 'tipo_contenido', 'autor', 'autor_key', 'fecha_agregado']
+        return listados.exportar(request, favoritos.order_by('-fecha_agregado', '-id'), campos, formato, 'favoritos')
+    if formato == 'mal':
+        return importacion.exportar_mal(request, favoritos.order_by('-fecha_agregado', '-id'))
+
+    # Página por cursor sobre el índice (usuario, -fecha_agregado)
+    favoritos, siguiente = listados.paginar(favoritos, ['-fecha_agregado', '-id'], request.GET.get('cursor'))
+    # Solo se consulta si el usuario subió un archivo en esta sesión; se olvida cuando deja de ser reciente
+    reciente = None
+    if 'importacion_id' in request.session:
+        reciente = importacion.reciente(request.usuario.id, request.session['importacion_id'])
+        if reciente is None:
+            del request.session['importacion_id']
+    return render(request, 'mis_favoritos.html', {'favoritos': favoritos, 'siguiente': siguiente, 'importacion': reciente})
+
+@usuario_requerido('Debes iniciar sesión para importar favoritos.', nivel=messages.ERROR)
+def importar_favoritos(request):
+    archivo = request.FILES.get('archivo')
+    if request.method != 'POST' or archivo is None:
+        messages.error(request, 'Selecciona un archivo para importar.')
+        return redirect('mis_favoritos')
+    if archivo.size > settings.IMPORTACION_MAX_BYTES:
+        messages.error(request, 'El archivo es demasiado grande; usa el comando importar_favoritos.')
+        return redirect('mis_favoritos')
+
+    # Se procesa en segundo plano: resolver miles de ISBN con la cuota de OpenLibrary lleva minutos
     try:
-        current_user = Usuario.objects.get(id=request.session['usuario_id'])
-        favoritos = Favorito.objects.filter(usuario=current_user).order_by('-fecha_agregado')
-    except Usuario.DoesNotExist:
-        request.session.flush()
-        messages.error(request, 'Tu sesión no es válida. Por favor, inicia sesión nuevamente.')
-        return redirect('login_usuario')
-    
-    return render(request, 'mis_favoritos.html', {'favoritos': favoritos})
-
-def recomendaciones_anime(request):
-    if 'usuario_id' not in request.session:
-        messages.warning(request, 'Debes iniciar sesión para ver recomendaciones.')
-        return redirect('login_usuario')
-
-    try:
-        current_user = Usuario.objects.get(id=request.session['usuario_id'])
-    except Usuario.DoesNotExist:
-        request.session.flush()
-        messages.error(request, 'Tu sesión no es válida. Por favor, inicia sesión nuevamente.')
-        return redirect('login_usuario')
-
-    user_favoritos = Favorito.objects.filter(usuario=current_user, tipo_contenido='anime')
-    if not user_favoritos:
-        messages.info(request, 'Añade algunos animes a tus favoritos para obtener recomendaciones.')
-        return render(request, 'recomendaciones_anime.html', {'recomendaciones': []})
-
-    recomendaciones_dict = {}
-    error_api = None
-    
-    favoritos_ids = list(user_favoritos.values_list('contenido_id', flat=True))
-
-    for i, favorito in enumerate(user_favoritos):
-        anime_id = favorito.contenido_id
-        try:
-            if i > 0: 
-                time.sleep(0.4) # Jikan API rate limit: ~3 req/sec. Be considerate.
-
-            response = requests.get(f"https://api.jikan.moe/v4/anime/{anime_id}/recommendations")
-            response.raise_for_status()
-            data = response.json().get('data', [])
-            
-            for rec_item in data:
-                anime_entry = rec_item.get('entry')
-                if anime_entry and anime_entry.get('mal_id'):
-                    mal_id = anime_entry['mal_id']
-                    if mal_id not in favoritos_ids and mal_id not in recomendaciones_dict:
-                        anime_entry['es_favorito'] = False # By definition, these are not yet favorites
-                        recomendaciones_dict[mal_id] = anime_entry
-        
-        except requests.exceptions.RequestException as e:
-            error_api = f"Error al obtener recomendaciones de la API de Jikan: {e}. Algunas recomendaciones podrían faltar."
-            break 
-        except ValueError:
-            error_api = "Error al procesar la respuesta de la API de Jikan para recomendaciones."
-            break
-
-    recomendaciones_list = list(recomendaciones_dict.values())
-    
-    # Shuffle recommendations for variety if desired, e.g. import random; random.shuffle(recomendaciones_list)
-
-    return render(request, 'recomendaciones_anime.html', {
-        'recomendaciones': recomendaciones_list,
-        'error_api': error_api
+        request.session['importacion_id'] = importacion.crear(request.usuario.id, archivo).pk
+    except importacion.FormatoDesconocido:
+        messages.error(request, 'No se reconoce el archivo: sube el XML de MyAnimeList o el CSV de Goodreads.')
+        return redirect('mis_favoritos')
+    messages.info(request, 'Importación en curso: tus favoritos irán apareciendo en esta página.')
+    return redirect('mis_favoritos')
+
+def _pagina_recomendaciones(request, usuario, tipo_contenido, plantilla):
+    """Muestra el snapshot guardado; si está obsoleto se muestra igual y se encola su recálculo."""
+    snapshot = snapshots.obtener(usuario.id, tipo_contenido)
+    refrescando = False
+    if snapshot is None:
+        # Primera visita: no hay nada que mostrar, se calcula ahora
+        contenido = snapshots.refrescar(usuario.id, tipo_contenido)
+    else:
+        contenido = snapshot.contenido
+        refrescando = snapshots.obsoleto(snapshot)
+        if refrescando:
+            snapshots.encolar(usuario.id, tipo_contenido)
+
+    if contenido['sin_favoritos'] and not refrescando:
+        tipo = 'animes' if tipo_contenido == 'anime' else 'libros'
+        messages.info(request, f'Añade algunos {tipo} a tus favoritos para obtener recomendaciones.')
+    return render(request, plantilla, {
+        'recomendaciones': items.lista(tipo_contenido, contenido['recomendaciones']),
+        'cruzadas': [(titulo, items.lista(tipo_contenido, registros)) for titulo, registros in contenido['cruzadas']],
+        'error_api': contenido['error_api'],
+        'refrescando': refrescando,
     })
 
-def buscar_libros(request):
-    if 'usuario_id' not in request.session:
-        messages.warning(request, 'Debes iniciar sesión para buscar libros.')
-        return redirect('login_usuario')
+@usuario_requerido('Debes iniciar sesión para ver recomendaciones.')
+async def recomendaciones_anime(request):
+    current_user = request.usuario
 
-    try:
-        current_user = Usuario.objects.get(id=request.session['usuario_id'])
-    except Usuario.DoesNotExist:
-        request.session.flush()
-        messages.error(request, 'Tu sesión no es válida. Por favor, inicia sesión nuevamente.')
-        return redirect('login_usuario')
+    # Solo lee el snapshot (o lo calcula en la primera visita), fuera del bucle de eventos
+    return await sync_to_async(_pagina_recomendaciones)(request, current_user, 'anime', 'recomendaciones_anime.html')
+
+@usuario_requerido('Debes iniciar sesión para buscar libros.')
+async def buscar_libros(request):
+    current_user = request.usuario
 
     form = LibroSearchForm()
     resultados_api = None
     error_api = None
     
-    favoritos_ids = list(Favorito.objects.filter(usuario=current_user, tipo_contenido='libro').values_list('contenido_id', flat=True))
+    favoritos_ids = await sync_to_async(favoritos.ids_favoritos)(current_user.id, 'libro')
 
     if request.method == 'GET' and 'query' in request.GET:
         form = LibroSearchForm(request.GET)
         if form.is_valid():
             query = form.cleaned_data['query']
             try:
-                response = requests.get(f"https://openlibrary.org/search.json?q={query}&limit=20")
-                response.raise_for_status() 
-                resultados_api = response.json().get('docs', [])
+                resultados_api = await catalogo.abuscar_con_api('libro', query)
             except requests.exceptions.RequestException as e:
                 error_api = f"Error al contactar la API de OpenLibrary: {e}"
             except ValueError: 
                 error_api = "Error al procesar la respuesta de la API de OpenLibrary."
     
-    resultados_procesados = []
-    if resultados_api:
-        for libro_data in resultados_api:
-            # Extraer información del libro
-            work_key = libro_data.get('key', '')
-            if work_key:
-                libro_data['work_id'] = work_key.split('/')[-1]
-                libro_data['es_favorito'] = libro_data['work_id'] in favoritos_ids
-                
-                # Procesar datos adicionales
-                libro_data['author_name'] = ', '.join(libro_data.get('author_name', ['Autor desconocido']))
-                libro_data['first_publish_year'] = libro_data.get('first_publish_year', 'N/A')
-                
-                # URL de la imagen del libro
-                if 'cover_i' in libro_data:
-                    libro_data['cover_url'] = f"https://covers.openlibrary.org/b/id/{libro_data['cover_i']}-M.jpg"
-                else:
-                    libro_data['cover_url'] = None
-                    
-                resultados_procesados.append(libro_data)
-
-    return render(request, 'libro_search.html', {
+    resultados_procesados = items.lista('libro', resultados_api or [])
+    for libro in resultados_procesados:
+        libro.es_favorito = libro.contenido_id in favoritos_ids
+
+    return await sync_to_async(render)(request, 'libro_search.html', {
         'form': form,
         'resultados': resultados_procesados,
         'error_api': error_api
     })
 
-def recomendaciones_libros(request):
-    if 'usuario_id' not in request.session:
-        messages.warning(request, 'Debes iniciar sesión para ver recomendaciones.')
-        return redirect('login_usuario')
+@usuario_requerido('Debes iniciar sesión para ver recomendaciones.')
+async def recomendaciones_libros(request):
+    current_user = request.usuario
 
-    try:
-        current_user = Usuario.objects.get(id=request.session['usuario_id'])
-    except Usuario.DoesNotExist:
-        request.session.flush()
-        messages.error(request, 'Tu sesión no es válida. Por favor, inicia sesión nuevamente.')
-        return redirect('login_usuario')
-
-    user_favoritos_libros = Favorito.objects.filter(usuario=current_user, tipo_contenido='libro')
-    if not user_favoritos_libros:
-        messages.info(request, 'Añade algunos libros a tus favoritos para obtener recomendaciones.')
-        return render(request, 'recomendaciones_libros.html', {'recomendaciones': []})
-
-    recomendaciones_list = []
-    error_api = None
-    
-    favoritos_ids = list(user_favoritos_libros.values_list('contenido_id', flat=True))
+    # Solo lee el snapshot (o lo calcula en la primera visita), fuera del bucle de eventos
+    return await sync_to_async(_pagina_recomendaciones)(request, current_user, 'libro', 'recomendaciones_libros.html')
 
-    # Buscar libros similares basados en los autores de libros favoritos
-    try:
-        for favorito in user_favoritos_libros[:3]:  # Limitamos a 3 favoritos para no saturar la API
-            # Obtener el autor del libro favorito
-            autor_busqueda = favorito.autor
-            if autor_busqueda and autor_busqueda != 'Autor desconocido':
-                # Buscar más libros del mismo autor
-                response = requests.get(f"https://openlibrary.org/search.json?author={autor_busqueda}&limit=5")
-                response.raise_for_status()
-                data = response.json().get('docs', [])
-                
-                for libro_data in data:
-                    work_key = libro_data.get('key', '')
-                    if work_key:
-                        work_id = work_key.split('/')[-1]
-                        # No recomendar libros que ya están en favoritos
-                        if work_id not in favoritos_ids:
-                            libro_data['work_id'] = work_id
-                            libro_data['es_favorito'] = False
-                            libro_data['author_name'] = ', '.join(libro_data.get('author_name', ['Autor desconocido']))
-                            libro_data['first_publish_year'] = libro_data.get('first_publish_year', 'N/A')
-                            
-                            if 'cover_i' in libro_data:
-                                libro_data['cover_url'] = f"https://covers.openlibrary.org/b/id/{libro_data['cover_i']}-M.jpg"
-                            else:
-                                libro_data['cover_url'] = None
-                                
-                            recomendaciones_list.append(libro_data)
-            
-            time.sleep(0.5)  # Rate limiting para OpenLibrary
-            
-    except requests.exceptions.RequestException as e:
-        error_api = f"Error al obtener recomendaciones de la API de OpenLibrary: {e}"
-    except ValueError:
-        error_api = "Error al procesar la respuesta de la API de OpenLibrary."
-
-    # Eliminar duplicados y limitar resultados
-    seen_ids = set()
-    recomendaciones_unicas = []
-    for libro in recomendaciones_list:
-        if libro['work_id'] not in seen_ids:
-            seen_ids.add(libro['work_id'])
-            recomendaciones_unicas.append(libro)
-            if len(recomendaciones_unicas) >= 12:  # Limitar a 12 recomendaciones
-                break
-
-    return render(request, 'recomendaciones_libros.html', {
-        'recomendaciones': recomendaciones_unicas,
-        'error_api': error_api
-    })
+def portada(request):
+    """Miniatura de una portada desde la caché en disco; si no se puede descargar, redirige al original."""
+    url = request.GET.get('url', '')
+    tamano = request.GET.get('t', 'm')
+    if not portadas.permitida(url) or tamano not in portadas.TAMANOS:
+        return HttpResponseBadRequest('Imagen no permitida')
+
+    # La URL de origen identifica el contenido, así que la clave sirve de ETag
+    etag = quote_etag(portadas.CachePortadas.clave(url, tamano))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        try:
+            ruta = portadas.portadas.obtener(url, tamano)
+            archivo = open(ruta, 'rb')
+        except (requests.exceptions.RequestException, ValueError, FileNotFoundError):
+            return HttpResponseRedirect(url)
+        response = FileResponse(archivo, content_type=portadas.CachePortadas.tipo(ruta))
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.PORTADAS_MAX_AGE, immutable=True)
+    return response
+
+def metrics(request):
+    """Métricas de todos los workers en formato de exposición de Prometheus."""
+    response = HttpResponse(metricas.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    patch_cache_control(response, no_store=True)
+    return response
 
 def cambiar_idioma(request):
     """Vista personalizada para cambiar el idioma"""
@@ -23,6 +23,15 @@ else:
     print('Superusuario ya existe')
 "
 
-# Iniciar el servidor Django
-echo "Iniciando servidor Django..."
-python manage.py runserver 0.0.0.0:8080
+# Iniciar el servidor: gunicorn + uvicorn (ASGI) salvo DJANGO_SERVIDOR=dev
+if [ "$DJANGO_SERVIDOR" = "dev" ]; then
+  echo "Iniciando servidor de desarrollo de Django..."
+  exec python manage.py runserver 0.0.0.0:8080
+fi
+# Precalentar cachés en segundo plano (comparte las cuotas de las APIs con los workers)
+if [ "$PRECALENTAR" = "1" ]; then
+  python manage.py precalentar_cache &
+fi
+echo "Iniciando gunicorn con workers de uvicorn..."
+rm -rf "${DATA_DIR:-data}/metricas"  # Métricas de workers de un arranque anterior
+exec gunicorn app.asgi:application -c gunicorn.conf.py
@@ -0,0 +1,13 @@
+# Configuración de gunicorn con workers de uvicorn (ASGI) para producción
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8080')
+worker_class = 'uvicorn.workers.UvicornWorker'
+# Cada worker atiende muchas peticiones en vuelo; el acceso a la base de
+# datos sigue siendo síncrono, de ahí la fórmula clásica 2 * núcleos + 1
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'